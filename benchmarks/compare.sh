@@ -0,0 +1,13 @@
+#!/bin/sh
+# Runs the stage benchmarks against the committed benchmarks/baseline.json and fails when a stage got more than
+# 20% slower than it. With --update-baseline the run rewrites the baseline instead, to be committed with the change
+# that moved the numbers. The baseline is only comparable on the machine that recorded it.
+set -e
+cd "$(dirname "$0")/.."
+if [ "$1" = "--update-baseline" ]; then
+    shift
+    set -- --benchmark-json=benchmarks/baseline.json "$@"
+else
+    set -- --benchmark-compare=benchmarks/baseline.json --benchmark-compare-fail=mean:20% "$@"
+fi
+PYTHONPATH=src exec python -m pytest benchmarks "$@"
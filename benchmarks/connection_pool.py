@@ -0,0 +1,74 @@
+"""
+Per-query setup overhead of a fresh connection per query, the way redshiftExporter used to connect,
+against a pooled connection with cached credentials. Runs against a local Postgres stand-in, e.g.
+
+    docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=postgres postgres
+    PYTHONPATH=src python benchmarks/connection_pool.py --dsn "host=localhost user=postgres password=postgres"
+
+The SSM and get_cluster_credentials round trips a fresh Redshift connection makes are simulated
+with --credentials-latency.
+"""
+import argparse
+import datetime
+import time
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from pendoguidesproject.connection_pool import ConnectionPool, CachedCredentials, utcnow
+
+QUERY = "select 1"
+
+
+def fetchCredentials(latency):
+    time.sleep(latency)
+    return {"expiration": utcnow() + datetime.timedelta(minutes=15)}
+
+
+def connect(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    return conn
+
+
+def query(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(QUERY)
+        cursor.fetchall()
+
+
+def fresh(dsn, queries, latency):
+    for _ in range(queries):
+        fetchCredentials(latency)
+        conn = connect(dsn)
+        query(conn)
+        conn.close()
+
+
+def pooled(dsn, queries, latency):
+    credentials = CachedCredentials(lambda: fetchCredentials(latency))
+    pool = ConnectionPool(lambda: credentials.get() and connect(dsn))
+    for _ in range(queries):
+        with pool.connection() as conn:
+            query(conn)
+    pool.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", default="host=localhost user=postgres password=postgres dbname=postgres")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--credentials-latency", type=float, default=0.05, help="Seconds per simulated SSM and IAM round trip")
+    args = parser.parse_args()
+
+    timings = {}
+    for name, run in [("fresh", fresh), ("pooled", pooled)]:
+        start = time.perf_counter()
+        run(args.dsn, args.queries, args.credentials_latency)
+        timings[name] = (time.perf_counter() - start) / args.queries
+        print(f"{name:>6}: {timings[name] * 1000:.2f} ms per query")
+    print(f"setup overhead saved: {(timings['fresh'] - timings['pooled']) * 1000:.2f} ms per query")
+
+
+if __name__ == "__main__":
+    main()
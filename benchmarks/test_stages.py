@@ -0,0 +1,96 @@
+"""
+Throughput and peak memory of the transform and clean stages on synthetic data, at 10k to 10M events.
+
+    benchmarks/compare.sh
+    benchmarks/compare.sh --update-baseline
+
+The first fails when a stage got more than 20% slower than benchmarks/baseline.json, the second rewrites it. Scales above
+BENCHMARK_MAX_EVENTS (100k by default) are skipped, set it to 10000000 for the full suite.
+"""
+import os
+import tracemalloc
+
+import pytest
+
+from pendoguidesproject import synthetic
+from pendoguidesproject.transformations.activity import joinActivity, joinTestDriveLeads
+from pendoguidesproject.transformations.sessionize import sessionize
+from pendoguidesproject.transformations.sharding import sessionizeSharded
+from pendoguidesproject.transformations.status import asOf, personalisedStatus
+
+pytest.importorskip("pytest_benchmark")
+
+SCALES = [10000, 100000, 1000000, 10000000]
+MAX_EVENTS = int(os.environ.get("BENCHMARK_MAX_EVENTS", 100000))
+WORKERS = [1, 2, 4]
+# Sharding only pays off once the events outweigh starting the workers
+SHARDED_EVENTS = min(1000000, MAX_EVENTS)
+# The prefixes clean.enhanceReadability gives the side tables
+PREFIXES = {
+    "dgc_users": "usr_",
+    "pendo_activity": "pa_",
+    "salesforcecampaign": "sfc_",
+    "salesforcecampaignmember": "sfcm_",
+    "lead": "lead_",
+    "contact": "ctct_",
+    "account": "acc_",
+}
+
+scales = pytest.mark.parametrize("events", [
+    pytest.param(events, marks=pytest.mark.skipif(events > MAX_EVENTS, reason=f"above BENCHMARK_MAX_EVENTS={MAX_EVENTS}"))
+    for events in SCALES
+])
+
+
+def peak_memory(function, *args):
+    # A separate, untimed run, tracing allocations slows the timed rounds down
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_stage(benchmark, events, function, *args):
+    benchmark.extra_info["events"] = events
+    benchmark.extra_info["peak_memory_mb"] = round(peak_memory(function, *args) / 2**20, 1)
+    result = benchmark.pedantic(function, args=args, rounds=3 if events <= 100000 else 1, iterations=1)
+    benchmark.extra_info["events_per_second"] = round(events / benchmark.stats.stats.mean)
+    return result
+
+
+def tables(events):
+    # One test-drive lead per 10 events, with 5 activity rows each
+    data = synthetic.testDriveTables(leads=max(events // 10, 10))
+    return {name: data[name].add_prefix(prefix) for name, prefix in PREFIXES.items()}
+
+
+def clean(data):
+    new = joinTestDriveLeads(data["salesforcecampaign"], data["salesforcecampaignmember"], data["lead"], data["contact"], data["account"])
+    completeLeft, activity = joinActivity(new, data["dgc_users"], data["pendo_activity"])
+    return personalisedStatus(activity, asOf("2021-06-01"))
+
+
+@scales
+def test_sessionize(benchmark, events):
+    output = run_stage(benchmark, events, sessionize, synthetic.guidesUsage(events))
+    assert len(output) > 0
+
+
+@pytest.mark.parametrize("workers", [
+    pytest.param(workers, marks=pytest.mark.skipif(workers > os.cpu_count(), reason=f"more workers than the {os.cpu_count()} CPUs"))
+    for workers in WORKERS
+])
+def test_sessionize_sharded(benchmark, workers):
+    # Compare the means across workers on a machine with at least as many CPUs as workers
+    benchmark.extra_info["workers"] = workers
+    benchmark.extra_info["cpus"] = os.cpu_count()
+    output = run_stage(benchmark, SHARDED_EVENTS, sessionizeSharded, synthetic.guidesUsage(SHARDED_EVENTS), workers)
+    assert len(output) > 0
+
+
+@scales
+def test_clean(benchmark, events):
+    status = run_stage(benchmark, events, clean, tables(events))
+    assert status["lead_uuid_c"].is_unique
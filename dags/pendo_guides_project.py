@@ -51,7 +51,7 @@ transform = DatafyContainerOperator(
     task_id="transform",
     name="transform",
     image=image,
-    arguments=["--date", "{{ ds }}", "--jobs", "transform", "--env", "{{ macros.datafy.env() }}"],
+    arguments=["--date", "{{ ds }}", "--jobs", "transform", "--env", "{{ macros.datafy.env() }}", "--workers", "2"],
     annotations={"iam.amazonaws.com/role": transform_role},
     resources={"request_memory": "8G", "request_cpu": "2", "limit_cpu": "2",},
 )
@@ -75,6 +75,10 @@ def get_export_task(
         cmds=["python3"],
         arguments=[
             "/app/src/pendoguidesproject/jobs/load.py",
+            "--date",
+            "{{ ds }}",
+            "--mode",
+            "upsert",
             "--dataset",
             f"{table_name}",
         ]
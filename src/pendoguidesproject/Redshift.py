@@ -1,11 +1,61 @@
+import json
 import os
+import uuid
 import psycopg2
 import boto3
-from typing import Dict
+import botocore
+import pandas as pd
+import pyarrow as pa
+from typing import Dict, Iterator
 from psycopg2 import sql
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from pendoguidesproject.aws_parameter_store import AwsParameterStore
-import boto3
+from pendoguidesproject.connection_pool import getCredentials, getPool
+from pendoguidesproject.metrics import count
+from pendoguidesproject.schema_diff import SchemaDiff, catalogType, fingerprint, redshiftType
+
+STREAM_ITERSIZE = 50000
+# The dtypes of Redshift result columns by Postgres type oid, other types come back as objects
+POSTGRES_DTYPES = {
+    16: "bool",
+    20: "int64",
+    21: "int64",
+    23: "int64",
+    700: "float64",
+    701: "float64",
+    1114: "datetime64[ns]",
+    1184: "datetime64[ns, UTC]",
+}
+# The Parquet types of Redshift result columns by Postgres type oid, numeric (1700) keeps its precision and scale
+ARROW_TYPES = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int64(),
+    23: pa.int64(),
+    700: pa.float64(),
+    701: pa.float64(),
+    1082: pa.date32(),
+    1114: pa.timestamp("us"),
+    1184: pa.timestamp("us", tz="UTC"),
+}
+# Upper bound on the connections a process holds open to the cluster at once
+MAX_CONNECTIONS = 4
+
+
+def arrowSchema(description) -> pa.Schema:
+    """
+    The Parquet schema of a result set from its cursor.description, so a streamed write does not depend on
+    the values of its first batch, e.g. a column that is only null there. Unknown types are written as strings.
+    """
+    fields = []
+    for column in description:
+        if column.type_code == 1700:
+            kind = pa.decimal128(column.precision or 38, column.scale or 0)
+        else:
+            kind = ARROW_TYPES.get(column.type_code, pa.string())
+        fields.append(pa.field(column.name, kind))
+    return pa.schema(fields)
+
 
 class redshiftExporter:
     def __init__(self, project, table: str, historical_load=False):
@@ -18,81 +68,244 @@ class redshiftExporter:
         self.glue_database = self.get_glue_database(project)
         self.incremental_load = True
         self.historical_load = historical_load
+        self.extraction = os.environ.get("extraction", "query")
 
     def export(self):
-        conn = self.get_connection(self.db_user, self.region, self.database, self.environment)
-        cursor = conn.cursor()
-        self.create_external_schema_if_not_exists(cursor, self.schema, self.glue_database)
-        self.update_external_table(cursor, self.table, self.schema, self.incremental_load, self.historical_load)
-        conn.commit()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self.create_external_schema_if_not_exists(cursor, self.schema, self.glue_database)
+            self.update_external_table(cursor, self.table, self.schema, self.incremental_load, self.historical_load)
+            conn.commit()
+
+    def replace_partitions(self, df: pd.DataFrame, dates, partition_column="date_partition") -> bool:
+        """
+        Replaces whole date partitions in one transaction: deletes every row of the given dates and inserts the
+        rows of df, COPYd into a staging table, so readers never see a partition half loaded. Dates without rows
+        in df are only deleted. Returns False when the target table does not exist yet.
+
+        :param df: Every row of the partitions being replaced
+        :param dates: The YYYY-MM-DD dates of the partitions, partition_column may hold a day or a timestamp
+        """
+        if len(dates) == 0:
+            print(f"No partitions of {self.table} changed")
+            return True
+        import awswrangler as wr
+
+        # The Glue catalog, and so the table, has the sanitized column names, e.g. account_id for "account id"
+        df = df.rename(columns=wr.catalog.sanitize_column_name)
+        partition_column = wr.catalog.sanitize_column_name(partition_column)
+        table_name = self.table + "hist" if self.historical_load else self.table
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if not self.table_exists(cursor, table_name, self.schema):
+                print(f"Table {table_name} in schema {self.schema} does not exist yet, nothing to replace partitions of")
+                return False
+
+            # COPY maps Parquet columns by position, so stage them in the order of the target table
+            columns = self.get_column_order(cursor, table_name, self.schema)
+            staging_path = f"s3://{self.get_bucket()}/staging/load/{self.schema}/{table_name}/{uuid.uuid4()}/"
+            if len(df) > 0:
+                wr.s3.to_parquet(df=df[columns], path=staging_path + "delta.parquet")
+            target = sql.SQL("{}.{}").format(sql.Identifier(self.schema), sql.Identifier(table_name))
+            staging = sql.Identifier(f"{table_name}_staging")
+            try:
+                conn.autocommit = False
+                print(f"Replacing the partitions {sorted(dates)} of {table_name} with {len(df)} rows")
+                cursor.execute(sql.SQL("DELETE FROM {} WHERE {}::date IN ({})").format(
+                    target, sql.Identifier(partition_column), sql.SQL(", ").join(sql.Literal(date) for date in sorted(dates)))
+                )
+                if len(df) > 0:
+                    cursor.execute(sql.SQL("CREATE TEMP TABLE {} (LIKE {})").format(staging, target))
+                    cursor.execute(sql.SQL("COPY {} FROM {} IAM_ROLE {} FORMAT AS PARQUET").format(
+                        staging, sql.Literal(staging_path), sql.Literal(self.get_iam_role()))
+                    )
+                    cursor.execute(sql.SQL("INSERT INTO {} SELECT * FROM {}").format(target, staging))
+                    # The temp table would otherwise live as long as the pooled connection
+                    cursor.execute(sql.SQL("DROP TABLE {}").format(staging))
+                count("redshift_rows_written", len(df))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                if len(df) > 0:
+                    wr.s3.delete_objects(path=staging_path)
+        return True
+
+    def table_exists(self, cursor, table, schema) -> bool:
+        cursor.execute(
+            "select 1 from information_schema.tables where table_schema = %s and table_name = %s", (schema, table)
+        )
+        return cursor.fetchone() is not None
+
+    def get_column_order(self, cursor, table, schema) -> list:
+        cursor.execute(
+            "select column_name from information_schema.columns where table_schema = %s and table_name = %s "
+            "order by ordinal_position", (schema, table)
+        )
+        return [row[0] for row in cursor.fetchall()]
 
     def import_data(self):
         conn = self.get_connection(self.db_user, self.region, self.database, self.environment)
         return conn
 
+    def connection(self):
+        """
+        Context manager handing out a pooled autocommit connection, shared per (db_user, database, environment)
+        by every exporter in the process. The connection goes back to the pool on exit, or is closed on error.
+        Blocks while MAX_CONNECTIONS connections are in use.
+        """
+        pool = getPool(
+            (self.db_user, self.database, self.environment),
+            lambda: self.get_connection(self.db_user, self.region, self.database, self.environment),
+            max_connections=MAX_CONNECTIONS,
+        )
+        return pool.connection()
+
+    def read_query(self, conn, query, params=None) -> pd.DataFrame:
+        if self.extraction == "unload":
+            df = self.unload_query(conn, query, params)
+            count("redshift_rows_read", len(df))
+            return df
+        if self.extraction == "stream":
+            return pd.concat(self.stream_query(conn, query, params), ignore_index=True)
+        df = pd.read_sql_query(query, conn, params=params)
+        count("redshift_rows_read", len(df))
+        return df
+
+    def stream_query(self, conn, query, params=None, itersize=STREAM_ITERSIZE) -> Iterator[pd.DataFrame]:
+        # Server-side cursors only live inside a transaction
+        autocommit = conn.autocommit
+        conn.autocommit = False
+        cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cursor.itersize = itersize
+        try:
+            cursor.execute(query, params)
+            batches = 0
+            while True:
+                rows = cursor.fetchmany(itersize)
+                # An empty result still yields one empty batch, so callers get the columns
+                if rows or batches == 0:
+                    columns = [column.name for column in cursor.description]
+                    count("redshift_rows_read", len(rows))
+                    batch = pd.DataFrame.from_records(rows, columns=columns)
+                    # The batches are untyped, writers take the schema of the result set from here
+                    batch.attrs["arrow_schema"] = arrowSchema(cursor.description)
+                    yield batch
+                    batches += 1
+                if len(rows) < itersize:
+                    break
+            print(f"Streamed query in {batches} batches of at most {itersize} rows")
+        finally:
+            cursor.close()
+            conn.rollback()
+            conn.autocommit = autocommit
+
+    def unload_query(self, conn, query, params=None) -> pd.DataFrame:
+        # awswrangler takes seconds to import, only the paths that use it import it
+        import awswrangler as wr
+
+        # Let the compute nodes write Parquet in parallel instead of streaming rows through the leader
+        staging_path = f"s3://{self.get_bucket()}/staging/unload/{self.schema}/{uuid.uuid4()}/"
+        cursor = conn.cursor()
+        if params:
+            query = cursor.mogrify(query, params).decode()
+        print(f"Unloading query to {staging_path}")
+        cursor.execute(sql.SQL("UNLOAD ({}) TO {} IAM_ROLE {} FORMAT AS PARQUET").format(
+            sql.Literal(query), sql.Literal(staging_path), sql.Literal(self.get_iam_role()))
+        )
+        try:
+            return wr.s3.read_parquet(path=staging_path, use_threads=True)
+        except wr.exceptions.NoFilesFound:
+            # UNLOAD writes no files for an empty result
+            return self.empty_result(cursor, query)
+        finally:
+            wr.s3.delete_objects(path=staging_path, use_threads=True)
+
+    def empty_result(self, cursor, query) -> pd.DataFrame:
+        """An empty frame with the columns and dtypes of a query, described by running it with limit 0."""
+        cursor.execute(sql.SQL("select * from ({}) as described limit 0").format(sql.SQL(query.strip().rstrip(";"))))
+        return pd.DataFrame({
+            column.name: pd.Series(dtype=POSTGRES_DTYPES.get(column.type_code, "object")) for column in cursor.description
+        })
+
     def update_external_table(self, cursor, table, schema, incremental_load, historical_load):
         if historical_load:
             table_name = table + "hist"
         else:
             table_name = table
-        try:
-            print(f"Trying to create table {table} in schema {schema}...")
-            if incremental_load:
-                cursor.execute(sql.SQL(
-                    "CREATE TABLE {2}.{3} AS SELECT * FROM {1}.{0} limit 5")
-                    .format(
-                    *map(sql.Identifier, (table, schema + 'ext', schema, table_name))
-                ))
-            else:
-                cursor.execute(sql.SQL(
-                    "CREATE TABLE {2}.{3} AS SELECT * FROM {1}.{0} WHERE date_partition=(select max(date_partition) from {1}.{0}) limit 5")
-                    .format(
-                    *map(sql.Identifier, (table, schema + 'ext', schema, table_name))
-                ))
-        except Exception as e:
-            print(e)
-            print(f"Table {table} in schema {schema} already exists...")
-
         external_schema = schema + "ext"
-        external_columns_types = self.get_external_columns_types(cursor, table_name, external_schema)
-        existing_columns_types = self.get_columms_types(cursor, table_name, schema)
-        self.align_schema(cursor, schema, table_name, existing_columns_types, external_columns_types)
+        target = sql.SQL("{}.{}").format(sql.Identifier(schema), sql.Identifier(table_name))
+        external = sql.SQL("{}.{}").format(sql.Identifier(external_schema), sql.Identifier(table))
+        latest_partition = sql.SQL(" WHERE date_partition=(select max(date_partition) from {})").format(external)
+        created = False
+        if not self.table_exists(cursor, table_name, schema):
+            print(f"Creating table {table_name} in schema {schema}...")
+            cursor.execute(sql.SQL("CREATE TABLE {} AS SELECT * FROM {}{} limit 5").format(
+                target, external, sql.SQL("") if incremental_load else latest_partition)
+            )
+            created = True
+
+        external_columns_types = self.get_external_columns_types(table)
+        schema_key = f"state/redshift/{schema}/{table_name}.schema.json"
+        schema_fingerprint = fingerprint(external_columns_types)
+        if created or self.read_schema_fingerprint(schema_key) != schema_fingerprint:
+            existing_columns_types = self.get_columms_types(cursor, table_name, schema)
+            self.align_schema(cursor, schema, table_name, existing_columns_types, external_columns_types)
+            self.write_schema_fingerprint(schema_key, schema_fingerprint)
+        else:
+            print(f"Schema of {external_schema}.{table} is unchanged, skipping the schema alignment")
 
         print("Truncating table")
-        cursor.execute(sql.SQL("TRUNCATE {}.{}").format(
-            sql.Identifier(schema), sql.Identifier(table_name))
-        )
+        cursor.execute(sql.SQL("TRUNCATE {}").format(target))
         print("Updating table")
-        fields = '"'+'", "'.join(list(external_columns_types.keys()))+'"'
-        if incremental_load:
-            cursor.execute(sql.SQL(
-                f"INSERT INTO {schema}.{table_name}({fields}) SELECT {fields} FROM {external_schema}.{table}"
-            ))
-        else:
-            cursor.execute(sql.SQL(
-                f"INSERT INTO {schema}.{table_name}({fields}) SELECT {fields} FROM {external_schema}.{table} WHERE date_partition=(select max(date_partition) from {external_schema}.{table})"
-            ))
+        fields = sql.SQL(", ").join(map(sql.Identifier, external_columns_types.keys()))
+        cursor.execute(sql.SQL("INSERT INTO {0}({1}) SELECT {1} FROM {2}{3}").format(
+            target, fields, external, sql.SQL("") if incremental_load else latest_partition)
+        )
+
+    def read_schema_fingerprint(self, key):
+        try:
+            obj = boto3.client("s3").get_object(Bucket=self.get_bucket(), Key=key)
+        except botocore.exceptions.ClientError:
+            return None
+        return json.loads(obj["Body"].read())["fingerprint"]
+
+    def write_schema_fingerprint(self, key, schema_fingerprint):
+        body = json.dumps({"fingerprint": schema_fingerprint})
+        boto3.client("s3").put_object(Bucket=self.get_bucket(), Key=key, Body=body.encode("utf8"))
 
     def create_external_schema_if_not_exists(self, cursor, schema, glue_database):
         cursor.execute(sql.SQL(
             f"CREATE EXTERNAL SCHEMA IF NOT EXISTS {schema + 'ext'} FROM DATA CATALOG DATABASE '{glue_database}' iam_role "
-            f"'arn:aws:iam::433320668742:role/cdo-redshift-export-{self.environment}-role' CREATE EXTERNAL DATABASE IF NOT "
+            f"'{self.get_iam_role()}' CREATE EXTERNAL DATABASE IF NOT "
             "EXISTS;"))
 
+    def get_iam_role(self):
+        return f"arn:aws:iam::433320668742:role/cdo-redshift-export-{self.environment}-role"
+
+    def get_bucket(self):
+        return 'cdo-datalake-prd' if self.environment == 'prd' else 'cdo-datalake-dev-bphcob'
+
     def redshift_connection_params(self, db_user, region, database, environment) -> Dict[str, str]:
         def get_cluster_creds(db_user, cluster_id, region, database):
             redshiftClient = boto3.Session(region_name=region).client("redshift") # when not local
             #redshiftClient = boto3.client('redshift') # new to do local testing
             return redshiftClient.get_cluster_credentials(DbUser=db_user, ClusterIdentifier=cluster_id, DbName=database)
 
-        store = AwsParameterStore(region_name=region)
-        endpoint = store.get_param(f"/redshift/{environment}/endpoint")
-        credentials = get_cluster_creds(db_user, endpoint.split(".")[0], region, database)
-        return {
-            "endpoint": endpoint,
-            "username": credentials["DbUser"],
-            "password": credentials["DbPassword"],
-        }
+        def fetch():
+            store = AwsParameterStore(region_name=region)
+            endpoint = store.get_param(f"/redshift/{environment}/endpoint")
+            credentials = get_cluster_creds(db_user, endpoint.split(".")[0], region, database)
+            return {
+                "endpoint": endpoint,
+                "username": credentials["DbUser"],
+                "password": credentials["DbPassword"],
+                "expiration": credentials["Expiration"],
+            }
+
+        # The endpoint and the temporary credentials are reused until shortly before they expire
+        return getCredentials((db_user, database, environment), fetch)
 
     def get_db_user(self, project):
         return f"{project}_rs_user"
@@ -119,49 +332,36 @@ class redshiftExporter:
         return table.lower() in ["issue"]
 
     def add_column(self, cursor, table, schema, name, type):
-        cursor.execute(sql.SQL(
-            f"""    
-                alter table {schema}.{table}
-                add column "{name}" {type};
-                """)
+        cursor.execute(sql.SQL("alter table {}.{} add column {} {}").format(
+            sql.Identifier(schema), sql.Identifier(table), sql.Identifier(name), sql.SQL(type))
         )
 
     def remove_column(self, cursor, table, schema, name):
-        cursor.execute(sql.SQL(
-            f"""alter table {schema}.{table}
-                drop column "{name}";
-                """)
+        cursor.execute(sql.SQL("alter table {}.{} drop column {}").format(
+            sql.Identifier(schema), sql.Identifier(table), sql.Identifier(name))
         )
 
-    def get_external_columns_types(self, cursor, external_table, external_schema) -> dict:
-        cursor.execute(sql.SQL(
-            f"""    
-        select
-        columnname,
-        external_type
-        from svv_external_columns
-        where
-        tablename = '{external_table}' and 
-        schemaname = '{external_schema}';
-        """)
+    def widen_column(self, cursor, table, schema, name, type):
+        cursor.execute(sql.SQL("alter table {}.{} alter column {} type {}").format(
+            sql.Identifier(schema), sql.Identifier(table), sql.Identifier(name), sql.SQL(type))
         )
-        result = cursor.fetchall()
-        return dict(result)
+
+    def get_external_columns_types(self, external_table) -> dict:
+        import awswrangler as wr
+
+        # Reads the Glue catalog directly, Spectrum's svv_external_columns mirrors the same table
+        columns_types = wr.catalog.get_table_types(database=self.glue_database, table=external_table)
+        if columns_types is None:
+            raise ValueError(f"Table {external_table} does not exist in the Glue database {self.glue_database}")
+        return columns_types
 
     def get_columms_types(self, cursor, table, schema) -> dict:
-        cursor.execute(sql.SQL(
-            f"""    
-        select 
-       column_name,
-       data_type
-        from information_schema.columns
-        where
-        table_name = '{table}' and 
-        table_schema = '{schema}';
-        """)
+        cursor.execute(
+            "select column_name, data_type, character_maximum_length, numeric_precision, numeric_scale "
+            "from information_schema.columns where table_schema = %s and table_name = %s "
+            "order by ordinal_position", (schema, table)
         )
-        result = cursor.fetchall()
-        return dict(result)
+        return {row[0]: catalogType(*row[1:]) for row in cursor.fetchall()}
 
     def parse_column_list(self, column_details, keys):
         for i in range(0, len(column_details)):
@@ -170,42 +370,35 @@ class redshiftExporter:
         return column_details
 
     def align_schema(self, cursor, schema, table, existing_columns_types, external_columns_types):
-        existing_columns_list = list(existing_columns_types.keys())
-        external_columns_list = list(external_columns_types.keys())
-
-        cols_to_add = list(set(external_columns_list) - set(existing_columns_list))
-        cols_to_remove = list(set(existing_columns_list) - set(external_columns_list))
-        cols_to_type_check = list(set(existing_columns_list) & set(external_columns_list))
-
-        print("cols_to_add")
-        print(cols_to_add)
-        print("cols to remove")
-        print(cols_to_remove)
-        print("cols to typecheck")
-        print(cols_to_type_check)
-
-        for col in cols_to_add:
-            type = self.get_rs_type(external_columns_types[col])
-            self.add_column(cursor, table, schema, col, type)
-
-        for col in cols_to_remove:
-            self.remove_column(cursor, table, schema, col)
-
-        for col in cols_to_type_check:
-            external_type = self.get_rs_type(external_columns_types[col])
-            existing_type = existing_columns_types[col]
-
-            if external_type != existing_type:
-                print(external_type)
-                print(existing_type)
-                print(f"Changing type of col {col}")
+        external_columns_types = {col: self.get_rs_type(type) for col, type in external_columns_types.items()}
+        diff = SchemaDiff(existing_columns_types, external_columns_types)
+        print(diff)
+        if diff.is_empty():
+            return
+
+        conn = cursor.connection
+        autocommit = conn.autocommit
+        try:
+            conn.autocommit = False
+            for col, type in diff.add:
+                self.add_column(cursor, table, schema, col, type)
+            for col in diff.remove:
                 self.remove_column(cursor, table, schema, col)
-                self.add_column(cursor, table, schema, col, external_type)
+            for col, type in diff.replace:
+                print(f"Changing type of col {col} to {type}")
+                self.remove_column(cursor, table, schema, col)
+                self.add_column(cursor, table, schema, col, type)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = autocommit
 
-    def get_rs_type(self, type):
-        type_dict = {
-            "string": "character varying",
-            "double": "double precision"
-        }
+        # ALTER COLUMN ... TYPE can't run inside a transaction block
+        for col, type in diff.widen:
+            print(f"Widening col {col} to {type}")
+            self.widen_column(cursor, table, schema, col, type)
 
-        return type_dict.get(type, type)
\ No newline at end of file
+    def get_rs_type(self, type):
+        return redshiftType(type)
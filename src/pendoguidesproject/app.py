@@ -1,14 +1,12 @@
 import argparse
 import logging
 import sys
+from contextlib import nullcontext
 
-from pendoguidesproject.jobs import entrypoint
-
-# this import is required to discover the jobs
-# noinspection PyUnresolvedReferences
-from pendoguidesproject.jobs import ingest
-from pendoguidesproject.jobs import transform
-
+from pendoguidesproject.jobs import entrypoint, job_options, loadJob
+from pendoguidesproject.metrics import report
+from pendoguidesproject.profiling import PROFILERS, profileName, profiled
+from pendoguidesproject.runner import runInProcess
 
 
 def main():
@@ -28,13 +26,135 @@ def main():
         help="jobs that need to be executed",
         required=True,
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        type=int,
+        default=1,
+        help="number of worker processes for jobs that support sharded execution",
+    )
+    parser.add_argument(
+        "--full-refresh",
+        dest="full_refresh",
+        action="store_true",
+        help="ignore incremental watermarks and reprocess the full history",
+    )
+    parser.add_argument(
+        "--extraction",
+        dest="extraction",
+        choices=["query", "unload", "stream"],
+        default="query",
+        help="how jobs extract from Redshift: a client-side query, an UNLOAD to Parquet on S3 or a server-side cursor",
+    )
+    parser.add_argument(
+        "--storage-format",
+        dest="storage_format",
+        choices=["parquet", "csv"],
+        default="parquet",
+        help="file format of the raw and clean datasets on S3, csv is the legacy format",
+    )
+    parser.add_argument(
+        "--incremental",
+        dest="incremental",
+        action="store_true",
+        help="only process the events since the previous run, continuing from its persisted state",
+    )
+    parser.add_argument(
+        "--verify",
+        dest="verify",
+        action="store_true",
+        help="compare incremental processing with a full recompute on a sample before running",
+    )
+    parser.add_argument(
+        "--join",
+        dest="join",
+        choices=["redshift", "pandas"],
+        default="redshift",
+        help="where clean joins the Salesforce sources: pushed down into one Redshift query or in pandas",
+    )
+    parser.add_argument(
+        "--engine",
+        dest="engine",
+        choices=["pandas", "spark"],
+        default="pandas",
+        help="what transform and clean compute with: pandas or Spark, local[*] unless spark_master is set",
+    )
+    parser.add_argument(
+        "--metrics-path",
+        dest="metrics_path",
+        help="local path or s3:// key to write the JSON metrics record of the run to",
+    )
+    parser.add_argument(
+        "--statsd",
+        dest="statsd",
+        help="host:port of a StatsD agent to send the stage metrics to as gauges",
+    )
+    parser.add_argument(
+        "--prometheus-textfile",
+        dest="prometheus_textfile",
+        help="path of a node exporter textfile to write the stage metrics to",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        choices=PROFILERS,
+        help="profile every job with cProfile or a sampling profiler, writing a pstats dump and collapsed stacks",
+    )
+    parser.add_argument(
+        "--profile-output",
+        dest="profile_output",
+        default="profiles",
+        help="local directory or s3://bucket/prefix the profiles are written to",
+    )
+    parser.add_argument(
+        "--profile-top",
+        dest="profile_top",
+        type=int,
+        default=25,
+        help="number of hotspots by cumulative time to log per profiled job",
+    )
+    parser.add_argument(
+        "--runner",
+        dest="runner",
+        choices=["sequential", "inprocess"],
+        default="sequential",
+        help="run the jobs one after the other through S3, or in one process handing datasets over in memory",
+    )
     args = parser.parse_args()
     logging.info(f"Using args: {args}")
 
+    options = {
+        "workers": args.workers,
+        "full_refresh": args.full_refresh,
+        "extraction": args.extraction,
+        "storage_format": args.storage_format,
+        "incremental": args.incremental,
+        "verify": args.verify,
+        "join": args.join,
+        "engine": args.engine,
+    }
+
+    def run_job(job_name):
+        job = loadJob(job_name)
+        # Without --profile the job runs unwrapped
+        profiler = profiled(args.profile, profileName(job_name, args.date), args.profile_output, args.profile_top) if args.profile else nullcontext()
+        with profiler:
+            job(args.env, args.date, **job_options(job, options))
+
+    # Only the modules of the selected jobs are imported, unknown jobs fail before any job runs
     for job_name in args.jobs:
-        logging.info(f"Executing job {job_name}")
-        job = entrypoint.all[job_name]
-        job(args.env, args.date)
+        loadJob(job_name)
+    try:
+        if args.runner == "inprocess":
+            runInProcess(args.jobs, run_job, entrypoint.datasets)
+        else:
+            for job_name in args.jobs:
+                logging.info(f"Executing job {job_name}")
+                run_job(job_name)
+    finally:
+        # Failed runs report too, their failing stage is marked as failed
+        report(args.metrics_path, args.statsd, args.prometheus_textfile, env=args.env, date=args.date, jobs=args.jobs)
 
 
 if __name__ == "__main__":
@@ -1,32 +1,163 @@
+import json
 import logging
+import os
+import random
+import threading
+import time
 import boto3
+import botocore
 
 logger = logging.getLogger(__name__)
 
+# GetParameters accepts at most 10 names per call
+BATCH_SIZE = 10
+# Errors retrying won't fix
+PERMANENT_ERRORS = {"ParameterNotFound", "ParameterVersionNotFound", "AccessDeniedException", "ValidationException"}
+
+# Shared across every AwsParameterStore of the process
+clients = {}
+cache = {}
+lock = threading.Lock()
+
+
 class AwsParameterStore():
     """
     Retrieve or store values from/into the AWS Parameter Store.
+
+    Values are cached in-process for ttl seconds, and optionally in an encrypted file (cache_path,
+    encrypted with the Fernet key cache_key) so that separate processes of a job share them too.
     """
 
-    def __init__(self, region_name: str = "us-east-1"):
-        self.ssm = boto3.client("ssm", region_name=region_name, verify=None)
+    def __init__(
+        self, region_name: str = "us-east-1", ttl: float = 300, retries: int = 5, cache_path: str = None, cache_key: str = None
+    ):
+        self.region_name = region_name
+        self.ssm = get_client(region_name)
+        self.ttl = ttl
+        self.retries = retries
+        self.cache_path = cache_path
+        self.cache_key = cache_key or os.environ.get("parameter_cache_key")
+        if cache_path and not self.cache_key:
+            raise ValueError("An on-disk parameter cache needs a cache_key to encrypt it with")
 
     def get_param(self, name: str) -> str:
+        cached = self.get_params_cached([name])
+        if name in cached:
+            return cached[name]
         # aws will randomly drop ssm requests
         try:
-            value = self.ssm.get_parameter(Name=name, WithDecryption=True)["Parameter"]["Value"]
+            value = self.retry(self.ssm.get_parameter, Name=name, WithDecryption=True)["Parameter"]["Value"]
+            self.store({name: str(value)})
             return str(value)
         except Exception as e:
             logger.warning(f"AwsParameterStore::get_param:{name}: Caught exception {e}")
             raise e
 
+    def get_params(self, names) -> dict:
+        """
+        Resolves several parameters at once, from the cache or with as few GetParameters calls as possible.
+        Raises a KeyError listing the parameters that don't exist.
+        """
+        values = self.get_params_cached(names)
+        missing = [name for name in dict.fromkeys(names) if name not in values]
+        fetched = {}
+        invalid = []
+        for start in range(0, len(missing), BATCH_SIZE):
+            response = self.retry(self.ssm.get_parameters, Names=missing[start:start + BATCH_SIZE], WithDecryption=True)
+            fetched.update({parameter["Name"]: str(parameter["Value"]) for parameter in response["Parameters"]})
+            invalid += response.get("InvalidParameters", [])
+        self.store(fetched)
+        if invalid:
+            logger.warning(f"AwsParameterStore::get_params: Parameters not found {invalid}")
+            raise KeyError(invalid)
+        values.update(fetched)
+        return {name: values[name] for name in names}
+
     def set_param(
         self, param: str, value: str, overwrite: bool = False, secure: bool = False
     ) -> None:
         param_type = "SecureString" if secure else "String"
         try:
             # aws will randomly drop ssm requests
-            self.ssm.put_parameter(Name=param, Value=value, Type=param_type, Overwrite=overwrite)
+            self.retry(self.ssm.put_parameter, Name=param, Value=value, Type=param_type, Overwrite=overwrite)
         except Exception as e:
             logger.warning("AwsParameterStore::set_param: Caught exception")
-            raise e
\ No newline at end of file
+            raise e
+        with lock:
+            cache.pop((self.region_name, param), None)
+        if self.cache_path:
+            disk = self.read_disk_cache()
+            disk.pop(param, None)
+            self.write_disk_cache(disk)
+
+    def retry(self, call, **kwargs):
+        """Calls SSM with jittered exponential backoff, ssm throttles and drops requests under load."""
+        for attempt in range(self.retries + 1):
+            try:
+                return call(**kwargs)
+            except botocore.exceptions.ClientError as e:
+                if e.response.get("Error", {}).get("Code") in PERMANENT_ERRORS or attempt == self.retries:
+                    raise
+            except botocore.exceptions.BotoCoreError:
+                if attempt == self.retries:
+                    raise
+            delay = random.uniform(0, min(10.0, 0.1 * 2 ** attempt))
+            logger.info(f"AwsParameterStore::retry: Attempt {attempt + 1} failed, retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+    def get_params_cached(self, names) -> dict:
+        now = time.time()
+        values = {}
+        with lock:
+            for name in names:
+                value, expires = cache.get((self.region_name, name), (None, 0))
+                if expires > now:
+                    values[name] = value
+        if self.cache_path and len(values) < len(set(names)):
+            disk = self.read_disk_cache()
+            for name in names:
+                if name not in values and name in disk and disk[name][1] > now:
+                    values[name] = disk[name][0]
+                    with lock:
+                        cache[(self.region_name, name)] = tuple(disk[name])
+        return values
+
+    def store(self, values: dict) -> None:
+        if not values:
+            return
+        expires = time.time() + self.ttl
+        with lock:
+            for name, value in values.items():
+                cache[(self.region_name, name)] = (value, expires)
+        if self.cache_path:
+            disk = self.read_disk_cache()
+            disk.update({name: (value, expires) for name, value in values.items()})
+            self.write_disk_cache(disk)
+
+    def read_disk_cache(self) -> dict:
+        from cryptography.fernet import Fernet, InvalidToken
+
+        try:
+            with open(self.cache_path, "rb") as f:
+                return json.loads(Fernet(self.cache_key).decrypt(f.read()))
+        except (FileNotFoundError, InvalidToken, ValueError):
+            return {}
+
+    def write_disk_cache(self, disk: dict) -> None:
+        from cryptography.fernet import Fernet
+
+        now = time.time()
+        disk = {name: entry for name, entry in disk.items() if entry[1] > now}
+        # Write next to the cache and rename, so concurrent readers never see a partial file
+        path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(os.open(path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600), "wb") as f:
+            f.write(Fernet(self.cache_key).encrypt(json.dumps(disk).encode("utf8")))
+        os.replace(path, self.cache_path)
+
+
+def get_client(region_name: str):
+    # boto3 clients are thread safe, creating one is not cheap
+    with lock:
+        if region_name not in clients:
+            clients[region_name] = boto3.client("ssm", region_name=region_name, verify=None)
+        return clients[region_name]
@@ -1,142 +1,584 @@
 import logging
-import requests
-from typing import Optional
-import time
 import pandas as pd
-import boto3
-from authlib.integrations.requests_client import OAuth2Session
-from pendoguidesproject.secrets import Secrets
-from pendoguidesproject.config import SecretsConfig
 from pendoguidesproject.jobs import entrypoint
 from pendoguidesproject.Redshift import redshiftExporter
-import io
-from io import StringIO
+from pendoguidesproject.storage import readDataset, writeDataset
+from pendoguidesproject.metrics import stage
+from pendoguidesproject.readiness import waitForCredentials
+from pendoguidesproject.extraction import extractConcurrently, selectQuery
+from pendoguidesproject.dtypes import PENDO_ACTIVITY_DTYPES, compact
+from pendoguidesproject.transformations.activity import SALESFORCE_COLUMNS, joinActivity, joinTestDriveLeads, testDriveLeadsQuery
+from pendoguidesproject.transformations.status import asOf, personalisedStatus
 import os
-import psycopg2
-from datetime import datetime
-import pytz
+from functools import partial
 
+# The raw datasets clean reads besides Redshift, by source name
+RAW_DATASETS = {"groups": "groups", "dgc_users": "dgc_users", "assets": "asset"}
+# The order ingestData returns the sources in
+SOURCES = ["groups", "dgc_users", "pendo_activity", "pendo_usage", "salesforcecampaign", "salesforcecampaignmember", "lead", "contact", "account", "assets"]
+# The account columns cleanAccount dropped, the selects request exactly the columns it kept (see accountColumns)
+ACCOUNT_NULL_COLUMNS = [
+    '__index_level_0__',
+    'bi_business_objects__c',
+    'product_connect__c',
+    'rkpi2_deleted_from_rain_king__c',
+    'use_case_big_data_analytics__c',
+    'product_helpdesk__c',
+    'run_as_current_user__c',
+    'product_gdpr_accelerator__c',
+    'account_counter__c',
+    'product_professional_services__c',
+    'use_case_data_catalog_dictionary__c',
+    'fferpcore_is_billing_address_validated__c',
+    'account_owner_active__c',
+    'netsuite_conn_push_to_net_suite__c',
+    'use_case_business_glossary__c',
+    'activity_total_scored__c',
+    'scoring_matrix_model_1__c',
+    'product_coaching_services__c',
+    'has_open_opps__c',
+    'one_time_trigger_12_11__c',
+    'product_reference_data__c',
+    'use_case_data_quality__c',
+    'bi_tableau__c',
+    'bi_oracle_obiee__c',
+    'data_citizens_2016__c',
+    'data_governance__c',
+    'at_risk__c',
+    'data_citizens_2017__c',
+    'test_program_master_agreement__c',
+    'product_dictionary__c',
+    'netsuite_conn_celigo_update__c',
+    'annual_revenue_scored__c',
+    'product_policy_manager__c',
+    'connect_purchased__c',
+    'use_case_issue_management__c',
+    'bi_sharepoint__c',
+    'last_activity_scored__c',
+    'number_of_activities_leads__c',
+    'valid_evaluation_licenses__c',
+    'amount_of_opps__c',
+    'bi_cognos__c',
+    'use_case_reference_data__c',
+    'netsuite_conn_sync_in_progress__c',
+    'product_author_users__c',
+    'use_case_regulatory_reporting__c',
+    'business_unit_scoring__c',
+    'power_of_one__c',
+    'industry_scored__c',
+    'number_of_open_opps__c',
+    'employees_scored__c',
+    'ft500__c',
+    'go_live_award__c',
+    'product_concurrent_users__c',
+    'netsuite_conn_pushed_from_opportunity__c',
+    'of_new_business_opps__c',
+    'product_catalog__c',
+    'number_of_activities_total__c',
+    'cloud__c',
+    'referenceable__c',
+    'use_case_data_sharing_agreements__c',
+    'scoring_matrix_model_2__c',
+    'bi_spotfire__c',
+    'bi_microsoft_bi__c',
+    'use_case_report_certification__c',
+    'risk_audit_compliance_regulatory__c',
+    'data_management__c',
+    'bi_qlikview__c',
+    'analytics__c',
+    'my_team__c',
+    'number_of_open_renewals__c',
+    'use_case_financial_compliance_bcbs_239__c',
+    'fferpcore_is_shipping_address_validated__c',
+    'use_case_critical_data_elements__c',
+    'inside_view_sic_description__c',
+    'upp__c',
+    'customer_recruitment_notes__c',
+    'customer_health_index__c',
+    'description',
+    'number_of_support_contacts__c',
+    'inside_view_sic__c',
+    'integration_points__c',
+    'use_case_other_use_case__c',
+    'last_modified_by_id',
+    'connect_informatica_dq_idq__c',
+    'fferpcore_validated_shipping_city__c',
+    'fferpcore_validated_shipping_country__c',
+    'aba_routing__c',
+    'team__c',
+    'connect_informatica_mdm__c',
+    'connect_ab_initio__c',
+    'd_b_industry_description__c',
+    'qbdialer_last_call_time__c',
+    'connect_in_production__c',
+    'logo_usage_external__c',
+    'shipping_postal_code',
+    'best_eloqua_score__c',
+    'project_manager__c',
+    'price_increase__c',
+    'pendo_events__c',
+    'community_customer_story__c',
+    'auto_renewal__c',
+    'primary_country__c',
+    'customer_termination_reason_long_text__c',
+    'billing_geocode_accuracy',
+    'customer_success_manager__c',
+    'engagio_status__c',
+    'rrpu_alert_message__c',
+    'zendesk_account_manager__c',
+    'analyst_report_participation__c',
+    'phone',
+    'currency_iso_code',
+    'integration_engineer__c',
+    'system_modstamp',
+    'renewal_price_increase__c',
+    'connection_received_id',
+    'fferpcore_validated_billing_country__c',
+    'meetups_leader__c',
+    'customer_start_quarter__c',
+    'x5_1_migration_comment__c',
+    'open_report_in_tableau__c',
+    'industry_group__c',
+    'unengaged_partners__c',
+    'pendo_last_visit__c',
+    'in_production__c',
+    'case_study_created__c',
+    'supporting_sales_rep__c',
+    'nip_band__c',
+    'test_field__c',
+    'lifecycle__c',
+    'secondary_at_risk_reason__c',
+    'rkpi2_rk_retrieval_flag__c',
+    'jigsaw_company_id',
+    'requested_account_owner__c',
+    'photo_url',
+    'shipping_city',
+    'no_of_employees__c',
+    'reason_for_production_delay__c',
+    'collibra_executive_sponsor__c',
+    'bizible2_engagement_score__c',
+    'latest_product_version__c',
+    'roadmap_qbr_positioned__c',
+    'billing_state_code',
+    'master_record_id',
+    'champion__c',
+    'case_study_file_attached_to_account__c',
+    'name_usage_external__c',
+    'primary_state__c',
+    'customer_health_index_reason__c',
+    'fferpcore_validated_shipping_postal_code__c',
+    'customer_story__c',
+    'created_by_id',
+    'status_protect_expand__c',
+    'shipping_geocode_accuracy',
+    'account_annual_revenue__c',
+    'name_usage_internal__c',
+    'pendo_time_on_site_in_minutes__c',
+    'fax',
+    'id',
+    'shipping_street',
+    'executive_cadence_meetings__c',
+    'customer_termination_reason__c',
+    'inside_view_naics__c',
+    'customer_end_quarter__c',
+    'inside_view_industry__c',
+    'rkpi2_rk_default_visibility__c',
+    'deployment_type__c',
+    'outreach_september_candidates__c',
+    'test__c',
+    'nip_health_index__c',
+    'name',
+    'account_created_by_role__c',
+    'miscellaneous_engagements__c',
+    'date_of_first_purchase__c',
+    'bi_other__c',
+    'rk_state__c',
+    'x5_1_migration_status__c',
+    'inside_view__c',
+    'primary_at_risk_reason__c',
+    'partner_stage__c',
+    'fferpcore_validated_billing_city__c',
+    'connect_ibm_reference_data_management__c',
+    'discover_org_industry__c',
+    'shipping_country_code',
+    'netsuite_conn_credit_hold__c',
+    'connect_ibm_business_glossary__c',
+    'billing_city',
+    'fferpcore_validated_shipping_street__c',
+    'attributes_url',
+    'account_owner_role__c',
+    'data_privacy_addendum__c',
+    'customer_start_year__c',
+    'i_sell_os_key_id__c',
+    'sdr_name__c',
+    'connect_global_i_ds__c',
+    'journey_stage__c',
+    'qbdialer_time_zone_sid_key__c',
+    'd_b_duns_number__c',
+    'record_type_id',
+    'fferpcore_validated_billing_street__c',
+    'collibra_customer_success_manager_name__c',
+    'sub_industry__c',
+    'd_b_employees__c',
+    'target_account__c',
+    'use_case__c',
+    'legal_name__c',
+    'pendo_usage_trending__c',
+    'termination_for_convenience__c',
+    'd_b_industry_code__c',
+    'date_partition',
+    'customer_executive_sponsor__c',
+    'at_risk_notes__c',
+    'cam__c',
+    'connect_informatica_imm__c',
+    'speaking_engagement__c',
+    'connect_service_now__c',
+    'connect_other__c',
+    'enablement_status__c',
+    'fferpcore_validated_shipping_state__c',
+    'revenue_segment__c',
+    'liability_cap__c',
+    'shipping_state',
+    'exception_reason__c',
+    'go_live_award_purchase_order__c',
+    'type_and_target__c',
+    'current_instance__c',
+    'customer_start_fy_quarter__c',
+    'msa_entity__c',
+    'netsuite_conn_channel_tier__c',
+    'parent_id',
+    'inside_view_naics_description__c',
+    'netsuite_conn_net_suite_id__c',
+    'shipping_country',
+    'requested_at_risk_status__c',
+    'connect_ibm_information_analyzer__c',
+    'termination_for_convenience_notes__c',
+    'jigsaw',
+    'speaking_engagement_notes__c',
+    'previous_journey_stage__c',
+    'go_live_award_recipient__c',
+    'cam_notes__c',
+    'connect_oracle_drm__c',
+    'connect_use_cases__c',
+    'permission_to_use_logo_name__c',
+    'market__c',
+    'fferpcore_validated_billing_postal_code__c',
+    'billing_contact__c',
+    'customer_story_notes__c',
+    'owner_id',
+    'requested_account_owner_lookup__c',
+    'dgc_platform__c',
+    'fferpcore_validated_billing_state__c',
+    'current_state__c',
+    'certified_rangers__c',
+    'renewal_quarter__c',
+    'go_live_award_delivery_name_and_address__c',
+    'connect_informatica_rdm__c',
+    'shipping_state_code',
+    'junior_ae__c',
+    'attributes_type',
+    'license_type__c',
+    'billing_state',
+    'pendo_days_active__c',
+    'at_risk_status__c',
+    'netsuite_conn_net_suite_sync_err__c',
+    'account_transfer_notes__c',
+    'seller__c',
+    'fferpcore_exemption_certificate__c',
+    'pendo_visitors__c',
+    'created_by_role__c',
+    'account_owner_s_manager__c',
+    'product_expert__c',
+    'connection_sent_id',
+    'sdr__c',
+    'connect_oracle_edq__c',
+    'awards__c',
+    'team_static__c',
+    'dozisf_zoom_info_first_updated__c',
+    'lean_data_tag__c',
+    'partner_account__c',
+    'lean_data_reporting_customer__c',
+    'hot__c',
+    'at_risk_next_steps__c',
+    'advocate_hub_referrer_account__c',
+    'fferpcore_tax_code1__c',
+    'reference_program_participant__c',
+    'fferpcore_sales_tax_status__c',
+    'fferpcore_tax_code3__c',
+    'lean_data_reporting_target_account__c',
+    'advocate_hub_referral_source__c',
+    'ultimate_parent_account_id__c',
+    'del_us_region_1__c',
+    'fferpcore_tax_code2__c',
+    'territory_disrupted__c',
+    'connect_use_cases_other__c',
+    'target_account_emea_2020__c',
+    'fferpcore_vat_status__c',
+    'territory_owner_update__c',
+    'foreign_government__c',
+    'is_customer_portal',
+    'potential_target_account__c',
+    'outreach_cadence__c',
+    'stp_migration_lead__c',
+    'ecustoms_im_status__c',
+    'cam_migration_notes__c',
+    'fferpcore_output_vat_code__c',
+    'c_data_drivers_currently_in_trial__c',
+    'migration_to_cloud_stage__c',
+    'has_known_advocates__c',
+    'fferpcore_vat_registration_number__c',
+    'customer_success_role__c',
+    'abm_account__c',
+    'ecustoms_screening_trigger__c',
+    'tax_exempt__c',
+    'renewal_notice__c',
+    'resource_assignment__c',
+    'lean_data_reporting_has_opportunity__c',
+    'fferpcore_tax_country_code__c',
+    'set_custom_split__c',
+    'lean_data_ld_email_domain__c',
+    'lean_data_ld_email_domains__c',
+    'lean_data_scenario_2_owner__c',
+    'ffbf_payment_priority__c',
+    'authorized_services_subcontractor__c',
+    'advocate_hub_referral_id__c',
+    'lean_data_search__c',
+    'cam_manager__c',
+    'fferpcore_materialized_shipping_address_validated__c',
+    'lean_data_sla__c',
+    'stp_estimated_migration_quarter__c',
+    'ffbf_bank_bic__c',
+    'ffbf_payment_routing_method__c',
+    'qbdialer_related_contact_last_call_time__c',
+    'active_vs_original_arr_discrep__c',
+    'stp_owner__c',
+    'customer_account__c',
+    'big_bet_account_2020__c',
+    'state__c',
+    'lean_data_scenario_1_owner__c',
+    'lid_linked_in_company_id__c',
+    'tableau_instance_name__c',
+    'msa_id__c',
+    'lean_data_scenario_3_owner__c',
+    'renewal_manager__c',
+    'advocate_hub_referrer_company__c',
+    'collibra_executive_sponsor_secondary__c',
+    'dozisf_zoom_info_id__c',
+    'partner_capabilities__c',
+    'xdel_perpetual__c',
+    'ffbf_account_particulars__c',
+    'advocate_hub_referrer_name__c',
+    'opportunity_40__c',
+    'transfer_approval_status__c',
+    'open_renewal_original_arr__c',
+    'inside_view_sub_industries__c',
+    'advocate_hub_referrer_contact__c',
+    'dozisf_zoom_info_last_updated__c',
+    'sic_desc',
+    'ffbf_payment_code__c',
+    'ecustoms_rps_status__c',
+    'lean_data_scenario_4_owner__c',
+    'fferpcore_materialized_billing_address_validated__c',
+    'account_plan_review_status__c',
+    'matched_status__c',
+    'account_plan_link__c',
+    'lean_data_reporting_target_account_number__c',
+    'advocate_hub_referrer_email__c',
+    'sic',
+    'ffbf_payment_country_iso__c',
+    'payment_terms__c',
+    'authorized_reseller__c',
+    'collibra_csm__c',
+    'customer_sales_rep__c',
+    'known_company_policies__c',
+    'education_credits_used__c',
+    'education_credits_purchased__c',
+    'zendesk_organization_name__c',
+    'partner_tier__c',
+    'stp_migration_story__c',
+    'gcp_contact__c',
+    'aws_contact__c',
+    'zoom_info_postal_code__c',
+    'zoom_info_street__c',
+    'zoom_info_country__c',
+    'zoom_info_industry__c',
+    'zoom_info_state__c',
+    'zoom_info_city__c',
+    'sbqq_co_termination_event__c',
+    'sbqq_preserve_bundle__c',
+    'sbqq_tax_exempt__c',
+    'sbqq_renewal_model__c',
+    'sbqq_renewal_pricing_method__c',
+    'sbqq_default_opportunity__c',
+    'sbqq_co_termed_contracts_combined__c',
+    'sbqq_contract_co_termination__c',
+    'sbqq_asset_quantities_combined__c',
+    'sbqq_ignore_parent_contracted_prices__c',
+    'sbqq_price_hold_end__c',
+    'tax_exempt_letter_attached__c',
+    'ultimate__c',
+    'territory__c',
+    'ultimate_parent_account__c',
+    'abn_vat_number__c',
+    'partner_contract_name__c',
+    'strategic_partner__c',
+    'customer_summary__c',
+    'presales_manager__c',
+    'zoom_info_employees__c',
+    'zoom_info_description__c',
+    'account_natural_name__c',
+    'customer_documents__c',
+    'has_integrator_products__c',
+    'website',
+]
 
-@entrypoint("clean") # change name to process, put in master
-def run(env: str, date: str):
+
+@entrypoint(
+    "clean",
+    inputs=["redshift:salesforce", "redshift:productusage", "redshift:university", "raw/testdriveanalysis"],
+    outputs=["clean/testdriveanalysis"],
+) # change name to process, put in master
+def run(env: str, date: str, extraction: str = "query", storage_format: str = "parquet", join: str = "redshift",
+        engine: str = "pandas"):
     os.environ["environment"] = env
-    # Sleep timer
-    time.sleep(5)
+    os.environ["extraction"] = extraction
+    os.environ["storage_format"] = storage_format
+    # Wait for the container's AWS credentials
+    waitForCredentials()
     # Create activity data
-    completeLeft, status, pendo_usage, assets = createActivityData()
+    with stage("activity"):
+        completeLeft, status, pendo_usage, assets = createActivityData(date, join, engine)
     # Create and export usage data
-    createUsageData(completeLeft, pendo_usage, assets, status)
+    with stage("usage"):
+        if engine == "spark":
+            createUsageDataSpark(completeLeft, pendo_usage, assets, status, date)
+        else:
+            createUsageData(completeLeft, pendo_usage, assets, status, date)
     # Complete extra ingestions
-    ingestUniversity()
-    ingestAllCampaigns()
+    with stage("university"):
+        ingestUniversity(date)
+    with stage("campaigns"):
+        ingestAllCampaigns(date)
 
-def createUsageData(completeLeft, pendo_usage, assets, status):
-    # Merge with pendo usage
-    usage = pd.merge(completeLeft, pendo_usage, left_on="usr_id", right_on="pu_visitorid", how="inner")
-    # Merge with asset names
-    usage = pd.merge(usage, assets, left_on="pu_parameter", right_on="as_asset_id", how="left")
-    # Add status
-    usage = pd.merge(usage, status, on="lead_uuid_c", how="left")
+def createUsageData(completeLeft, pendo_usage, assets, status, date=None):
+    with stage("merge", rows_in=len(pendo_usage)) as span:
+        # Merge with pendo usage
+        usage = pd.merge(completeLeft, pendo_usage, left_on="usr_id", right_on="pu_visitorid", how="inner")
+        # Merge with asset names
+        usage = pd.merge(usage, assets, left_on="pu_parameter", right_on="as_asset_id", how="left")
+        # Add status
+        usage = pd.merge(usage, status, on="lead_uuid_c", how="left")
+        span.rows_out = len(usage)
     # Export
-    writeToCSVToS3(usage, "usage")
+    with stage("write", rows_in=len(usage)):
+        writeDataset(usage, "clean/testdriveanalysis", "usage", date=date)
     return usage
 
-def createActivityData():
-    # Perform ingestions
-    groups, dgc_users, pendo_activity, pendo_usage, salesforcecampaign, salesforcecampaignmember, lead, contact, account, assets = ingestData()
-    # Clean
-    account = cleanAccount(account)
-    salesforcecampaign = cleanCampaign(salesforcecampaign)
-    # Merge lead and contact
-    lead = lead[["lead_id", "lead_lean_data_reporting_matched_account_c", "lead_uuid_c"]]
-    contact = contact[["ctct_id", "ctct_account_id", "ctct_uuid_c"]]
-    contact.columns = ["lead_id", "lead_lean_data_reporting_matched_account_c", "lead_uuid_c"]
-    lead = pd.concat([lead, contact], axis=0)
-    # Merge campaign and campaignmember data
-    new = pd.merge(salesforcecampaign, salesforcecampaignmember, left_on="sfc_name", right_on="sfcm_campaign_name_text", how="inner")
-    # Merge lead/contact with campaignmember
-    new = pd.merge(new, lead, left_on="sfcm_lead_or_contact_id", right_on="lead_id", how="inner")
-    # Merge with account
-    new = pd.merge(account, new, left_on="acc_account_id_long_version__c", right_on="lead_lean_data_reporting_matched_account_c", how="right")
-    # Merge with dgc users
-    completeLeft = pd.merge(new, dgc_users, left_on="lead_uuid_c", right_on="usr_id", how="inner")
-    # Merge with activity data
-    activity = pd.merge(completeLeft, pendo_activity, left_on="usr_id", right_on="pa_visitorid", how="left")
+def createActivityData(date=None, join="redshift", engine="pandas"):
+    if join == "redshift":
+        # Redshift joins the Salesforce sources, only the test-drive leads and their activity are fetched
+        with stage("extract"):
+            groups, dgc_users, pendo_activity, pendo_usage, new, assets = ingestTestDriveLeads()
+        salesforce = None
+    else:
+        # Perform ingestions
+        with stage("extract"):
+            groups, dgc_users, pendo_activity, pendo_usage, salesforcecampaign, salesforcecampaignmember, lead, contact, account, assets = ingestData()
+        salesforce = (salesforcecampaign, salesforcecampaignmember, lead, contact, account)
+        new = None
+    if engine == "spark":
+        return createActivityDataSpark(new, salesforce, dgc_users, pendo_activity, pendo_usage, assets, date)
+    if salesforce is not None:
+        # Merge campaign, campaignmember, lead/contact and account
+        with stage("merge_leads", rows_in=len(salesforcecampaignmember)) as span:
+            new = joinTestDriveLeads(*salesforce)
+            span.rows_out = len(new)
+    # Merge with dgc users and activity data
+    with stage("merge_activity", rows_in=len(pendo_activity)) as span:
+        completeLeft, activity = joinActivity(new, dgc_users, pendo_activity)
+        span.rows_out = len(activity)
     # Add status
-    status = addPersonalisedStatus(activity)
-    activity = pd.merge(activity, status, on="lead_uuid_c", how="left")
+    with stage("status", rows_in=len(activity)) as span:
+        status = addPersonalisedStatus(activity, asOf(date))
+        activity = pd.merge(activity, status, on="lead_uuid_c", how="left")
+        span.rows_out = len(status)
     # Export
-    writeToCSVToS3(activity, "activity")
+    with stage("write", rows_in=len(activity)):
+        writeDataset(activity, "clean/testdriveanalysis", "activity", date=date)
     return completeLeft, status, pendo_usage, assets
 
-def addPersonalisedStatus(activity):
-    new = activity[["usr_createdOn", "lead_uuid_c", "pa_numminutes"]]
-    # Get total usage per user
-    new["total_minutes"] = new.groupby(["lead_uuid_c"])["pa_numminutes"].transform(sum)
-    # Clean
-    new = new.drop_duplicates(subset=['lead_uuid_c'])
-    # Create message
-    now = datetime.now(pytz.timezone('utc'))
-    testDriveStatus = []
-    for index, row in new.iterrows():
-        start = pd.to_datetime(row["usr_createdOn"], unit='ms', utc = True)
-        if (row["total_minutes"] == 0) & ((now - start).days > 7):
-            testDriveStatus.append("Wasted test-drive (not logged in after a week)")
-        elif ((row["total_minutes"] > 0)) & ((now - start).days >= 7):
-            testDriveStatus.append("Test-drive period is over and was used")
-        elif ((row["total_minutes"] > 0)) & ((now - start).days < 7):
-            testDriveStatus.append("Test-drive in progress")
-        elif (not(row["total_minutes"] > 0)) & ((now - start).days >= 3):
-            testDriveStatus.append("At very high risk (not logged in after 72 hours)")
-        elif (not(row["total_minutes"] > 0)) & ((now - start).days >= 2):
-            testDriveStatus.append("At high risk (not logged in after 48 hours)")
-        elif (not(row["total_minutes"] > 0)) & ((now - start).days >= 1):
-            testDriveStatus.append("At risk (not logged in after 24 hours)")
-        elif (not(row["total_minutes"] > 0)) & ((now - start).days == 0):
-            testDriveStatus.append("Registered less than 24 hours ago and no usage")
-        else:
-            testDriveStatus.append("Problem")
-    # Clean
-    testDriveStatus = pd.DataFrame(testDriveStatus)
-    testDriveStatus.columns = ["act_status"]
-    new = new.reset_index(drop = True)
-    testDriveStatus = testDriveStatus.reset_index(drop = True)
-    status = pd.concat([new, testDriveStatus], axis = 1)
-    status = status[["lead_uuid_c", "act_status"]]
-    return status
+def createActivityDataSpark(new, salesforce, dgc_users, pendo_activity, pendo_usage, assets, date=None):
+    """
+    The merges and status of createActivityData on Spark, from the same extracts. Spark evaluates lazily, so
+    the merges are measured in the write stage that collects the activity.
+
+    :param new: The test-drive leads joined by Redshift, None when salesforce is given
+    :param salesforce: The campaign, campaign member, lead, contact and account extracts to join in Spark
+    :return: completeLeft, status, pendo_usage and assets as Spark DataFrames for createUsageDataSpark
+    """
+    # pyspark is only imported by runs with --engine spark
+    from pendoguidesproject.common.spark import fromPandas, getSpark
+    from pendoguidesproject.transformations.spark_activity import USER_ORDER, joinActivitySpark, joinTestDriveLeadsSpark, merge, personalisedStatusSpark
+
+    spark = getSpark()
+    if salesforce is not None:
+        # Merge campaign, campaignmember, lead/contact and account
+        new = joinTestDriveLeadsSpark(*(fromPandas(spark, frame) for frame in salesforce))
+    else:
+        new = fromPandas(spark, new)
+    # Merge with dgc users and activity data, the leads are merged again for the usage
+    completeLeft, activity = joinActivitySpark(new, fromPandas(spark, dgc_users), fromPandas(spark, pendo_activity))
+    completeLeft = completeLeft.cache()
+    # Add status
+    status = personalisedStatusSpark(activity, asOf(date)).cache()
+    activity = merge(activity.drop(USER_ORDER), status, "lead_uuid_c", how="left")
+    # Export
+    with stage("write") as span:
+        activity = activity.toPandas()
+        span.rows_out = len(activity)
+        writeDataset(activity, "clean/testdriveanalysis", "activity", date=date)
+    return completeLeft, status, fromPandas(spark, pendo_usage), fromPandas(spark, assets)
+
+def createUsageDataSpark(completeLeft, pendo_usage, assets, status, date=None):
+    from pendoguidesproject.transformations.spark_activity import joinUsageSpark
 
-def ingestAllCampaigns():
+    # Merge with pendo usage, asset names and status
+    with stage("write") as span:
+        usage = joinUsageSpark(completeLeft, pendo_usage, assets, status).toPandas()
+        span.rows_out = len(usage)
+        writeDataset(usage, "clean/testdriveanalysis", "usage", date=date)
+    return usage
+
+def addPersonalisedStatus(activity, as_of=None):
+    # Classify every lead against the status rules, counting days up to the run date
+    return personalisedStatus(activity, as_of)
+
+def ingestAllCampaigns(date=None):
     # Engine
     importer = redshiftExporter("testdriveanalysis", "", False)
-    con = importer.import_data()
-    con.set_isolation_level("ISOLATION_LEVEL_AUTOCOMMIT")
-    # Ingest campaign data
-    sql = "select * from salesforce.campaign"
-    salesforcecampaign = pd.read_sql_query(sql, con)
-    # Ingest campaign member data
-    sql = "select * from salesforce.campaign_member"
-    salesforcecampaignmember = pd.read_sql_query(sql, con)
+    with importer.connection() as con:
+        # Ingest campaign data
+        sql = "select * from salesforce.campaign"
+        salesforcecampaign = importer.read_query(con, sql)
+        # Ingest campaign member data
+        sql = "select * from salesforce.campaign_member"
+        salesforcecampaignmember = importer.read_query(con, sql)
     # Merge
     all_campaigns = pd.merge(salesforcecampaign, salesforcecampaignmember, left_on="name", right_on="campaign_name_text", how="left")
     # Clean
     all_campaigns = all_campaigns[["campaign_id", "campaign_name_text", "first_responded_date", "start_date", "email"]]
     # Write to S3
-    writeToCSVToS3(all_campaigns, "all_campaigns")
-    # Close connection
-    con.close()
+    writeDataset(all_campaigns, "clean/testdriveanalysis", "all_campaigns", date=date)
 
-def ingestUniversity():
+def ingestUniversity(date=None):
     # Engine
     importer = redshiftExporter("testdriveanalysis", "", False)
-    con = importer.import_data()
-    con.set_isolation_level("ISOLATION_LEVEL_AUTOCOMMIT")
-    # Ingest campaign data
-    sql = "select name, status, username from university.enrollments"
-    enrollments = pd.read_sql_query(sql, con)
+    with importer.connection() as con:
+        # Ingest campaign data
+        sql = "select name, status, username from university.enrollments"
+        enrollments = importer.read_query(con, sql)
     # Write to S3
-    writeToCSVToS3(enrollments, "enrollments")
-    # Close connection
-    con.close()
+    writeDataset(enrollments, "clean/testdriveanalysis", "enrollments", date=date)
 
 def enhanceReadability(groups, dgc_users, pendo_activity, pendo_usage, salesforcecampaign, salesforcecampaignmember, lead, contact, account, assets):
     groups = groups.add_prefix('gr_')
@@ -152,493 +594,76 @@ def enhanceReadability(groups, dgc_users, pendo_activity, pendo_usage, salesforc
     return groups, dgc_users, pendo_activity, pendo_usage, salesforcecampaign, salesforcecampaignmember, lead, contact, account, assets
 
 def ingestData():
-    pendo_activity, pendo_usage = ingestPendo()
-    salesforcecampaign, salesforcecampaignmember, lead, contact, account = ingestSalesforce()
-    groups = readCSVFromS3("groups")
-    dgc_users = readCSVFromS3("dgc_users")
-    assets = readCSVFromS3("asset")
-    # Enhance readability
-    groups, dgc_users, pendo_activity, pendo_usage, salesforcecampaign, salesforcecampaignmember, lead, contact, account, assets = enhanceReadability(groups, dgc_users, pendo_activity, pendo_usage, salesforcecampaign, salesforcecampaignmember, lead, contact, account, assets)
-    return groups, dgc_users, pendo_activity, pendo_usage, salesforcecampaign, salesforcecampaignmember, lead, contact, account, assets
-
-def ingestSalesforce():
     # Engine
     importer = redshiftExporter("testdriveanalysis", "", False)
-    con = importer.import_data()
-    con.set_isolation_level("ISOLATION_LEVEL_AUTOCOMMIT")
-    # Ingest campaign data
-    sql = "select * from salesforce.campaign where name = 'GBL-21-Q1-TDR-Test-Drive'"
-    salesforcecampaign = pd.read_sql_query(sql, con)
-    # Ingest campaign member data
-    sql = "select * from salesforce.campaign_member where campaign_name_text = 'GBL-21-Q1-TDR-Test-Drive'"
-    salesforcecampaignmember = pd.read_sql_query(sql, con)
-    # Ingest lead data
-    sql = "select * from salesforce.lead"
-    lead = pd.read_sql_query(sql, con)
-    # Ingest contact data
-    sql = "select * from salesforce.contact"
-    contact = pd.read_sql_query(sql, con)
-    # Ingest account data
-    sql = "select * from salesforce.account"
-    account = pd.read_sql_query(sql, con)
-    # Close connection
-    con.close()
-    return salesforcecampaign, salesforcecampaignmember, lead, contact, account
+    # Every source is independent, run the queries and downloads concurrently
+    sources = {name: partial(queryRedshift, importer, sql) for name, sql in {**pendoQueries(), **salesforceQueries()}.items()}
+    sources["account"] = partial(queryAccount, importer)
+    sources.update({name: partial(readDataset, "raw/testdriveanalysis", dataset, format="csv") for name, dataset in RAW_DATASETS.items()})
+    data = extractConcurrently(sources)
+    for name in ["pendo_activity", "pendo_usage"]:
+        data[name] = compact(data[name], name, PENDO_ACTIVITY_DTYPES)
+    # Enhance readability
+    return enhanceReadability(*(data[name] for name in SOURCES))
 
-def ingestPendo():
-    INSTANCE_NAME = "test-drive.collibra.com"
+def ingestTestDriveLeads():
     # Engine
     importer = redshiftExporter("testdriveanalysis", "", False)
-    con = importer.import_data()
-    con.set_isolation_level("ISOLATION_LEVEL_AUTOCOMMIT")
-    # Ingest pendo activity
-    sql = "select * from productusage.pendo_activity where instanceid LIKE '%" + INSTANCE_NAME + "%' and date >= '2021-04-12'"
-    pendo_activity = pd.read_sql_query(sql, con)
-    # Ingest pendo usage
-    sql = "select * from productusage.pendo_usage where instanceid LIKE '%" + INSTANCE_NAME + "%' and date >= '2021-04-12'"
-    pendo_usage = pd.read_sql_query(sql, con)
-    # Close connection
-    con.close()
-    return pendo_activity, pendo_usage
+    with importer.connection() as con:
+        cursor = con.cursor()
+        member_columns = importer.get_column_order(cursor, "campaign_member", "salesforce")
+        account_columns = accountColumns(importer, cursor)
+    leads = testDriveLeadsQuery(member_columns, account_columns)
+    queries = pendoQueries()
+    # Only the activity of the test-drive leads can join, missing visitors match missing leads in pd.merge
+    queries["pendo_activity"] += f' and (visitorid in (select "lead_uuid_c" from ({leads}) leads) or visitorid is null)'
+    sources = {name: partial(queryRedshift, importer, sql) for name, sql in queries.items()}
+    sources["new"] = partial(queryRedshift, importer, leads)
+    sources.update({name: partial(readDataset, "raw/testdriveanalysis", dataset, format="csv") for name, dataset in RAW_DATASETS.items()})
+    data = extractConcurrently(sources)
+    for name in ["pendo_activity", "pendo_usage"]:
+        data[name] = compact(data[name], name, PENDO_ACTIVITY_DTYPES)
+    # Enhance readability, the leads come prefixed
+    return (
+        data["groups"].add_prefix('gr_'),
+        data["dgc_users"].add_prefix('usr_'),
+        data["pendo_activity"].add_prefix('pa_'),
+        data["pendo_usage"].add_prefix('pu_'),
+        data["new"],
+        data["assets"].add_prefix('as_'),
+    )
 
-def writeToCSVToS3(dataset, description):
-    env = os.environ["environment"]
-    csv_buffer = StringIO()
-    dataset.to_csv(csv_buffer, index=False)
-    s3_resource = boto3.resource('s3')
-    s3_resource.Object(get_bucket(env), f"clean/testdriveanalysis/{description}.csv").put(Body=csv_buffer.getvalue())
+def queryRedshift(importer, sql):
+    with importer.connection() as con:
+        return importer.read_query(con, sql)
 
-def readCSVFromS3(description):
-    env = os.environ["environment"]
-    bucket = get_bucket(env)
-    key = f"raw/testdriveanalysis/{description}.csv"
-    s3_resource = boto3.client('s3')
-    obj = s3_resource.get_object(Bucket=bucket, Key=key)
-    df = pd.read_csv(io.BytesIO(obj['Body'].read()), encoding='utf8')
-    return df
+def salesforceQueries():
+    return {
+        # Ingest campaign data
+        "salesforcecampaign": selectQuery("salesforce.campaign", SALESFORCE_COLUMNS["salesforcecampaign"], "name = 'GBL-21-Q1-TDR-Test-Drive'"),
+        # Ingest campaign member data
+        "salesforcecampaignmember": selectQuery("salesforce.campaign_member", where="campaign_name_text = 'GBL-21-Q1-TDR-Test-Drive'"),
+        # Ingest lead data
+        "lead": selectQuery("salesforce.lead", SALESFORCE_COLUMNS["lead"]),
+        # Ingest contact data
+        "contact": selectQuery("salesforce.contact", SALESFORCE_COLUMNS["contact"]),
+    }
 
-def get_bucket(env: str):
-    return 'cdo-datalake-prd' if env == 'prd' else 'cdo-datalake-dev-bphcob'
+def queryAccount(importer):
+    # Ingest account data
+    with importer.connection() as con:
+        return importer.read_query(con, selectQuery("salesforce.account", accountColumns(importer, con.cursor())))
 
-def cleanAccount(account):
-    # Selection of all columns with a null value, fixed, to be reviewed,
-    toBeDropped = [
-     'acc___index_level_0__',
-     'acc_bi_business_objects__c',
-     'acc_product_connect__c',
-     'acc_rkpi2_deleted_from_rain_king__c',
-     'acc_use_case_big_data_analytics__c',
-     'acc_product_helpdesk__c',
-     'acc_run_as_current_user__c',
-     'acc_product_gdpr_accelerator__c',
-     'acc_account_counter__c',
-     'acc_product_professional_services__c',
-     'acc_use_case_data_catalog_dictionary__c',
-     'acc_fferpcore_is_billing_address_validated__c',
-     'acc_account_owner_active__c',
-     'acc_netsuite_conn_push_to_net_suite__c',
-     'acc_use_case_business_glossary__c',
-     'acc_activity_total_scored__c',
-     'acc_scoring_matrix_model_1__c',
-     'acc_product_coaching_services__c',
-     'acc_has_open_opps__c',
-     'acc_one_time_trigger_12_11__c',
-     'acc_product_reference_data__c',
-     'acc_use_case_data_quality__c',
-     'acc_bi_tableau__c',
-     'acc_bi_oracle_obiee__c',
-     'acc_data_citizens_2016__c',
-     'acc_data_governance__c',
-     'acc_at_risk__c',
-     'acc_data_citizens_2017__c',
-     'acc_test_program_master_agreement__c',
-     'acc_product_dictionary__c',
-     'acc_netsuite_conn_celigo_update__c',
-     'acc_annual_revenue_scored__c',
-     'acc_product_policy_manager__c',
-     'acc_connect_purchased__c',
-     'acc_use_case_issue_management__c',
-     'acc_bi_sharepoint__c',
-     'acc_last_activity_scored__c',
-     'acc_number_of_activities_leads__c',
-     'acc_valid_evaluation_licenses__c',
-     'acc_amount_of_opps__c',
-     'acc_bi_cognos__c',
-     'acc_use_case_reference_data__c',
-     'acc_netsuite_conn_sync_in_progress__c',
-     'acc_product_author_users__c',
-     'acc_use_case_regulatory_reporting__c',
-     'acc_business_unit_scoring__c',
-     'acc_power_of_one__c',
-     'acc_industry_scored__c',
-     'acc_number_of_open_opps__c',
-     'acc_employees_scored__c',
-     'acc_ft500__c',
-     'acc_go_live_award__c',
-     'acc_product_concurrent_users__c',
-     'acc_netsuite_conn_pushed_from_opportunity__c',
-     'acc_of_new_business_opps__c',
-     'acc_product_catalog__c',
-     'acc_number_of_activities_total__c',
-     'acc_cloud__c',
-     'acc_referenceable__c',
-     'acc_use_case_data_sharing_agreements__c',
-     'acc_scoring_matrix_model_2__c',
-     'acc_bi_spotfire__c',
-     'acc_bi_microsoft_bi__c',
-     'acc_use_case_report_certification__c',
-     'acc_risk_audit_compliance_regulatory__c',
-     'acc_data_management__c',
-     'acc_bi_qlikview__c',
-     'acc_analytics__c',
-     'acc_my_team__c',
-     'acc_number_of_open_renewals__c',
-     'acc_use_case_financial_compliance_bcbs_239__c',
-     'acc_fferpcore_is_shipping_address_validated__c',
-     'acc_use_case_critical_data_elements__c',
-     'acc_inside_view_sic_description__c',
-     'acc_upp__c',
-     'acc_customer_recruitment_notes__c',
-     'acc_customer_health_index__c',
-     'acc_description',
-     'acc_number_of_support_contacts__c',
-     'acc_inside_view_sic__c',
-     'acc_integration_points__c',
-     'acc_use_case_other_use_case__c',
-     'acc_last_modified_by_id',
-     'acc_connect_informatica_dq_idq__c',
-     'acc_fferpcore_validated_shipping_city__c',
-     'acc_fferpcore_validated_shipping_country__c',
-     'acc_aba_routing__c',
-     'acc_team__c',
-     'acc_connect_informatica_mdm__c',
-     'acc_connect_ab_initio__c',
-     'acc_d_b_industry_description__c',
-     'acc_qbdialer_last_call_time__c',
-     'acc_connect_in_production__c',
-     'acc_logo_usage_external__c',
-     'acc_shipping_postal_code',
-     'acc_best_eloqua_score__c',
-     'acc_project_manager__c',
-     'acc_price_increase__c',
-     'acc_pendo_events__c',
-     'acc_community_customer_story__c',
-     'acc_auto_renewal__c',
-     'acc_primary_country__c',
-     'acc_customer_termination_reason_long_text__c',
-     'acc_billing_geocode_accuracy',
-     'acc_customer_success_manager__c',
-     'acc_engagio_status__c',
-     'acc_rrpu_alert_message__c',
-     'acc_zendesk_account_manager__c',
-     'acc_analyst_report_participation__c',
-     'acc_phone',
-     'acc_currency_iso_code',
-     'acc_integration_engineer__c',
-     'acc_system_modstamp',
-     'acc_renewal_price_increase__c',
-     'acc_connection_received_id',
-     'acc_fferpcore_validated_billing_country__c',
-     'acc_meetups_leader__c',
-     'acc_customer_start_quarter__c',
-     'acc_x5_1_migration_comment__c',
-     'acc_open_report_in_tableau__c',
-     'acc_industry_group__c',
-     'acc_unengaged_partners__c',
-     'acc_pendo_last_visit__c',
-     'acc_in_production__c',
-     'acc_case_study_created__c',
-     'acc_supporting_sales_rep__c',
-     'acc_nip_band__c',
-     'acc_test_field__c',
-     'acc_lifecycle__c',
-     'acc_secondary_at_risk_reason__c',
-     'acc_rkpi2_rk_retrieval_flag__c',
-     'acc_jigsaw_company_id',
-     'acc_requested_account_owner__c',
-     'acc_photo_url',
-     'acc_shipping_city',
-     'acc_no_of_employees__c',
-     'acc_reason_for_production_delay__c',
-     'acc_collibra_executive_sponsor__c',
-     'acc_bizible2_engagement_score__c',
-     'acc_latest_product_version__c',
-     'acc_roadmap_qbr_positioned__c',
-     'acc_billing_state_code',
-     'acc_master_record_id',
-     'acc_champion__c',
-     'acc_case_study_file_attached_to_account__c',
-     'acc_name_usage_external__c',
-     'acc_primary_state__c',
-     'acc_customer_health_index_reason__c',
-     'acc_fferpcore_validated_shipping_postal_code__c',
-     'acc_customer_story__c',
-     'acc_created_by_id',
-     'acc_status_protect_expand__c',
-     'acc_shipping_geocode_accuracy',
-     'acc_account_annual_revenue__c',
-     'acc_name_usage_internal__c',
-     'acc_pendo_time_on_site_in_minutes__c',
-     'acc_fax',
-     'acc_id',
-     'acc_shipping_street',
-     'acc_executive_cadence_meetings__c',
-     'acc_customer_termination_reason__c',
-     'acc_inside_view_naics__c',
-     'acc_customer_end_quarter__c',
-     'acc_inside_view_industry__c',
-     'acc_rkpi2_rk_default_visibility__c',
-     'acc_deployment_type__c',
-     'acc_outreach_september_candidates__c',
-     'acc_test__c',
-     'acc_nip_health_index__c',
-     'acc_name',
-     'acc_account_created_by_role__c',
-     'acc_miscellaneous_engagements__c',
-     'acc_date_of_first_purchase__c',
-     'acc_bi_other__c',
-     'acc_rk_state__c',
-     'acc_x5_1_migration_status__c',
-     'acc_inside_view__c',
-     'acc_primary_at_risk_reason__c',
-     'acc_partner_stage__c',
-     'acc_fferpcore_validated_billing_city__c',
-     'acc_connect_ibm_reference_data_management__c',
-     'acc_discover_org_industry__c',
-     'acc_shipping_country_code',
-     'acc_netsuite_conn_credit_hold__c',
-     'acc_connect_ibm_business_glossary__c',
-     'acc_billing_city',
-     'acc_fferpcore_validated_shipping_street__c',
-     'acc_attributes_url',
-     'acc_account_owner_role__c',
-     'acc_data_privacy_addendum__c',
-     'acc_customer_start_year__c',
-     'acc_i_sell_os_key_id__c',
-     'acc_sdr_name__c',
-     'acc_connect_global_i_ds__c',
-     'acc_journey_stage__c',
-     'acc_qbdialer_time_zone_sid_key__c',
-     'acc_d_b_duns_number__c',
-     'acc_record_type_id',
-     'acc_fferpcore_validated_billing_street__c',
-     'acc_collibra_customer_success_manager_name__c',
-     'acc_sub_industry__c',
-     'acc_d_b_employees__c',
-     'acc_target_account__c',
-     'acc_use_case__c',
-     'acc_legal_name__c',
-     'acc_pendo_usage_trending__c',
-     'acc_termination_for_convenience__c',
-     'acc_d_b_industry_code__c',
-     'acc_date_partition',
-     'acc_customer_executive_sponsor__c',
-     'acc_at_risk_notes__c',
-     'acc_cam__c',
-     'acc_connect_informatica_imm__c',
-     'acc_speaking_engagement__c',
-     'acc_connect_service_now__c',
-     'acc_connect_other__c',
-     'acc_enablement_status__c',
-     'acc_fferpcore_validated_shipping_state__c',
-     'acc_revenue_segment__c',
-     'acc_liability_cap__c',
-     'acc_shipping_state',
-     'acc_exception_reason__c',
-     'acc_go_live_award_purchase_order__c',
-     'acc_type_and_target__c',
-     'acc_current_instance__c',
-     'acc_customer_start_fy_quarter__c',
-     'acc_msa_entity__c',
-     'acc_netsuite_conn_channel_tier__c',
-     'acc_parent_id',
-     'acc_inside_view_naics_description__c',
-     'acc_netsuite_conn_net_suite_id__c',
-     'acc_shipping_country',
-     'acc_requested_at_risk_status__c',
-     'acc_connect_ibm_information_analyzer__c',
-     'acc_termination_for_convenience_notes__c',
-     'acc_jigsaw',
-     'acc_speaking_engagement_notes__c',
-     'acc_previous_journey_stage__c',
-     'acc_go_live_award_recipient__c',
-     'acc_cam_notes__c',
-     'acc_connect_oracle_drm__c',
-     'acc_connect_use_cases__c',
-     'acc_permission_to_use_logo_name__c',
-     'acc_market__c',
-     'acc_fferpcore_validated_billing_postal_code__c',
-     'acc_billing_contact__c',
-     'acc_customer_story_notes__c',
-     'acc_owner_id',
-     'acc_requested_account_owner_lookup__c',
-     'acc_dgc_platform__c',
-     'acc_fferpcore_validated_billing_state__c',
-     'acc_current_state__c',
-     'acc_certified_rangers__c',
-     'acc_renewal_quarter__c',
-     'acc_go_live_award_delivery_name_and_address__c',
-     'acc_connect_informatica_rdm__c',
-     'acc_shipping_state_code',
-     'acc_junior_ae__c',
-     'acc_attributes_type',
-     'acc_license_type__c',
-     'acc_billing_state',
-     'acc_pendo_days_active__c',
-     'acc_at_risk_status__c',
-     'acc_netsuite_conn_net_suite_sync_err__c',
-     'acc_account_transfer_notes__c',
-     'acc_seller__c',
-     'acc_fferpcore_exemption_certificate__c',
-     'acc_pendo_visitors__c',
-     'acc_created_by_role__c',
-     'acc_account_owner_s_manager__c',
-     'acc_product_expert__c',
-     'acc_connection_sent_id',
-     'acc_sdr__c',
-     'acc_connect_oracle_edq__c',
-     'acc_awards__c',
-     'acc_team_static__c',
-     'acc_dozisf_zoom_info_first_updated__c',
-     'acc_lean_data_tag__c',
-     'acc_partner_account__c',
-     'acc_lean_data_reporting_customer__c',
-     'acc_hot__c',
-     'acc_at_risk_next_steps__c',
-     'acc_advocate_hub_referrer_account__c',
-     'acc_fferpcore_tax_code1__c',
-     'acc_reference_program_participant__c',
-     'acc_fferpcore_sales_tax_status__c',
-     'acc_fferpcore_tax_code3__c',
-     'acc_lean_data_reporting_target_account__c',
-     'acc_advocate_hub_referral_source__c',
-     'acc_ultimate_parent_account_id__c',
-     'acc_del_us_region_1__c',
-     'acc_fferpcore_tax_code2__c',
-     'acc_territory_disrupted__c',
-     'acc_connect_use_cases_other__c',
-     'acc_target_account_emea_2020__c',
-     'acc_fferpcore_vat_status__c',
-     'acc_territory_owner_update__c',
-     'acc_foreign_government__c',
-     'acc_is_customer_portal',
-     'acc_potential_target_account__c',
-     'acc_outreach_cadence__c',
-     'acc_stp_migration_lead__c',
-     'acc_ecustoms_im_status__c',
-     'acc_cam_migration_notes__c',
-     'acc_fferpcore_output_vat_code__c',
-     'acc_c_data_drivers_currently_in_trial__c',
-     'acc_migration_to_cloud_stage__c',
-     'acc_has_known_advocates__c',
-     'acc_fferpcore_vat_registration_number__c',
-     'acc_customer_success_role__c',
-     'acc_abm_account__c',
-     'acc_ecustoms_screening_trigger__c',
-     'acc_tax_exempt__c',
-     'acc_renewal_notice__c',
-     'acc_resource_assignment__c',
-     'acc_lean_data_reporting_has_opportunity__c',
-     'acc_fferpcore_tax_country_code__c',
-     'acc_set_custom_split__c',
-     'acc_lean_data_ld_email_domain__c',
-     'acc_lean_data_ld_email_domains__c',
-     'acc_lean_data_scenario_2_owner__c',
-     'acc_ffbf_payment_priority__c',
-     'acc_authorized_services_subcontractor__c',
-     'acc_advocate_hub_referral_id__c',
-     'acc_lean_data_search__c',
-     'acc_cam_manager__c',
-     'acc_fferpcore_materialized_shipping_address_validated__c',
-     'acc_lean_data_sla__c',
-     'acc_stp_estimated_migration_quarter__c',
-     'acc_ffbf_bank_bic__c',
-     'acc_ffbf_payment_routing_method__c',
-     'acc_qbdialer_related_contact_last_call_time__c',
-     'acc_active_vs_original_arr_discrep__c',
-     'acc_stp_owner__c',
-     'acc_customer_account__c',
-     'acc_big_bet_account_2020__c',
-     'acc_state__c',
-     'acc_lean_data_scenario_1_owner__c',
-     'acc_lid_linked_in_company_id__c',
-     'acc_tableau_instance_name__c',
-     'acc_msa_id__c',
-     'acc_lean_data_scenario_3_owner__c',
-     'acc_renewal_manager__c',
-     'acc_advocate_hub_referrer_company__c',
-     'acc_collibra_executive_sponsor_secondary__c',
-     'acc_dozisf_zoom_info_id__c',
-     'acc_partner_capabilities__c',
-     'acc_xdel_perpetual__c',
-     'acc_ffbf_account_particulars__c',
-     'acc_advocate_hub_referrer_name__c',
-     'acc_opportunity_40__c',
-     'acc_transfer_approval_status__c',
-     'acc_open_renewal_original_arr__c',
-     'acc_inside_view_sub_industries__c',
-     'acc_advocate_hub_referrer_contact__c',
-     'acc_dozisf_zoom_info_last_updated__c',
-     'acc_sic_desc',
-     'acc_ffbf_payment_code__c',
-     'acc_ecustoms_rps_status__c',
-     'acc_lean_data_scenario_4_owner__c',
-     'acc_fferpcore_materialized_billing_address_validated__c',
-     'acc_account_plan_review_status__c',
-     'acc_matched_status__c',
-     'acc_account_plan_link__c',
-     'acc_lean_data_reporting_target_account_number__c',
-     'acc_advocate_hub_referrer_email__c',
-     'acc_sic',
-     'acc_ffbf_payment_country_iso__c',
-     'acc_payment_terms__c',
-     'acc_authorized_reseller__c',
-     'acc_collibra_csm__c',
-     'acc_customer_sales_rep__c',
-     'acc_known_company_policies__c',
-     'acc_education_credits_used__c',
-     'acc_education_credits_purchased__c',
-     'acc_zendesk_organization_name__c',
-     'acc_partner_tier__c',
-     'acc_stp_migration_story__c',
-     'acc_gcp_contact__c',
-     'acc_aws_contact__c',
-     'acc_zoom_info_postal_code__c',
-     'acc_zoom_info_street__c',
-     'acc_zoom_info_country__c',
-     'acc_zoom_info_industry__c',
-     'acc_zoom_info_state__c',
-     'acc_zoom_info_city__c',
-     'acc_sbqq_co_termination_event__c',
-     'acc_sbqq_preserve_bundle__c',
-     'acc_sbqq_tax_exempt__c',
-     'acc_sbqq_renewal_model__c',
-     'acc_sbqq_renewal_pricing_method__c',
-     'acc_sbqq_default_opportunity__c',
-     'acc_sbqq_co_termed_contracts_combined__c',
-     'acc_sbqq_contract_co_termination__c',
-     'acc_sbqq_asset_quantities_combined__c',
-     'acc_sbqq_ignore_parent_contracted_prices__c',
-     'acc_sbqq_price_hold_end__c',
-     'acc_tax_exempt_letter_attached__c',
-     'acc_ultimate__c',
-     'acc_territory__c',
-     'acc_ultimate_parent_account__c',
-     'acc_abn_vat_number__c',
-     'acc_partner_contract_name__c',
-     'acc_strategic_partner__c',
-     'acc_customer_summary__c',
-     'acc_presales_manager__c',
-     'acc_zoom_info_employees__c',
-     'acc_zoom_info_description__c',
-     'acc_account_natural_name__c',
-     'acc_customer_documents__c',
-     'acc_has_integrator_products__c',
-     'acc_website']
-    account = account.drop(toBeDropped, axis=1, errors= "ignore")
-    return account
+def accountColumns(importer, cursor):
+    # The columns of salesforce.account cleanAccount kept, in table order, the activity and usage datasets carry them
+    dropped = set(ACCOUNT_NULL_COLUMNS)
+    return [column for column in importer.get_column_order(cursor, "account", "salesforce") if column not in dropped]
 
-def cleanCampaign(salesforcecampaign):
-    # Campaign is only filtered on test-drive, so this info is not useful
-    salesforcecampaign = salesforcecampaign[["sfc_created_date", "sfc_id", "sfc_name", "sfc_start_date", "sfc_type"]]
-    return salesforcecampaign
+def pendoQueries():
+    INSTANCE_NAME = "test-drive.collibra.com"
+    return {
+        # Ingest pendo activity
+        "pendo_activity": "select * from productusage.pendo_activity where instanceid LIKE '%" + INSTANCE_NAME + "%' and date >= '2021-04-12'",
+        # Ingest pendo usage
+        "pendo_usage": "select * from productusage.pendo_usage where instanceid LIKE '%" + INSTANCE_NAME + "%' and date >= '2021-04-12'",
+    }
@@ -0,0 +1,86 @@
+import logging
+import os
+
+from pendoguidesproject.storage import datasetKey, get_bucket
+
+logger = logging.getLogger(__name__)
+
+# local[*] uses every core of the container, spark_master points the jobs at a cluster instead
+DEFAULT_MASTER = "local[*]"
+APP_NAME = "pendoguidesproject"
+# The columns readParquetPartitions orders the rows it reads by
+ORDER_COLUMNS = ["_partition", "_row"]
+
+
+def getSpark(app_name: str = APP_NAME):
+    """
+    The Spark session of the spark engine. The master comes from spark_master (default local[*]), extra packages
+    from spark_packages, e.g. org.apache.hadoop:hadoop-aws:3.2.0 when the image does not ship the s3a connector.
+    Timestamps are formatted in UTC, like pandas formats epoch milliseconds.
+    """
+    # pyspark and its JVM are only started by jobs that run with --engine spark
+    from pyspark.sql import SparkSession
+
+    builder = (
+        SparkSession.builder.appName(app_name)
+        .master(os.environ.get("spark_master", DEFAULT_MASTER))
+        .config("spark.sql.session.timeZone", "UTC")
+        .config("spark.sql.execution.arrow.pyspark.enabled", "true")
+        .config("spark.hadoop.fs.s3a.aws.credentials.provider", "com.amazonaws.auth.DefaultAWSCredentialsProviderChain")
+    )
+    packages = os.environ.get("spark_packages")
+    if packages:
+        builder = builder.config("spark.jars.packages", packages)
+    spark = builder.getOrCreate()
+    logger.info(f"Using Spark {spark.version} on {spark.sparkContext.master}")
+    return spark
+
+
+def datalakeRoot(env: str) -> str:
+    # datalake_root reads a local copy of the datalake instead of the bucket
+    return os.environ.get("datalake_root") or f"s3a://{get_bucket(env)}"
+
+
+def datasetPath(prefix: str, description: str, format: str = "parquet", date: str = None) -> str:
+    """The path Spark reads a dataset of the datalake from, the same key writeDataset writes it to."""
+    return f"{datalakeRoot(os.environ['environment']).rstrip('/')}/{datasetKey(prefix, description, format, date)}"
+
+
+def readParquetPartitions(spark, prefix: str, description: str, dates, columns=None):
+    """
+    Reads the given date_partition=YYYY-MM-DD partitions of a Parquet dataset. Ordering by ORDER_COLUMNS gives
+    the rows in the order readPartitions of storage concatenates them, without collecting them on one executor.
+
+    :return: The partitions, None when there are none
+    """
+    from pyspark.sql import functions as F
+
+    frames = []
+    for position, date in enumerate(dates):
+        # The partition files carry their own date_partition column, so partition discovery is disabled
+        frame = spark.read.option("recursiveFileLookup", "true").parquet(datasetPath(prefix, description, "parquet", date))
+        if columns is not None:
+            frame = frame.select(*columns)
+        # Row ids increase within every file split, the splits of a file are numbered in file order
+        frames.append(frame.withColumn(ORDER_COLUMNS[0], F.lit(position)).withColumn(ORDER_COLUMNS[1], F.monotonically_increasing_id()))
+    if len(frames) == 0:
+        return None
+    dataset = frames[0]
+    for frame in frames[1:]:
+        dataset = dataset.unionByName(frame)
+    return dataset
+
+
+def fromPandas(spark, frame):
+    """
+    A Spark DataFrame of a pandas extract. The schema comes from Arrow instead of sampling the rows, so empty
+    frames and columns without values (typed as strings) convert too and categoricals become their values.
+    """
+    import pyarrow as pa
+    from pyspark.sql.pandas.types import from_arrow_schema
+
+    fields = []
+    for field in pa.Schema.from_pandas(frame, preserve_index=False):
+        kind = field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+        fields.append(pa.field(field.name, pa.string() if pa.types.is_null(kind) else kind))
+    return spark.createDataFrame(frame, schema=from_arrow_schema(pa.schema(fields)))
@@ -0,0 +1,172 @@
+import datetime
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Refresh temporary cluster credentials this long before they expire
+CREDENTIALS_MARGIN = datetime.timedelta(minutes=2)
+# Connections idle for less than this are handed out without a round trip to the server
+LIVENESS_AFTER = 30.0
+
+pools = {}
+credentials = {}
+lock = threading.Lock()
+
+
+class CachedCredentials:
+    """
+    Caches temporary credentials, e.g. from redshift.get_cluster_credentials, until shortly before
+    the expiration the fetch function returns along with them.
+    """
+
+    def __init__(self, fetch, margin: datetime.timedelta = CREDENTIALS_MARGIN):
+        self.fetch = fetch
+        self.margin = margin
+        self.value = None
+        self.expiration = None
+        self.lock = threading.Lock()
+
+    def get(self) -> dict:
+        with self.lock:
+            if self.value is None or utcnow() >= self.expiration - self.margin:
+                self.value = self.fetch()
+                self.expiration = asUtc(self.value["expiration"])
+                logger.info(f"Fetched credentials valid until {self.expiration}")
+            return self.value
+
+
+class ConnectionPool:
+    """
+    Keeps idle psycopg2 connections around for reuse. Connections are checked for liveness when they
+    sat idle for a while and always go back to autocommit, the state get_connection creates them in.
+    With max_connections, acquire blocks while that many connections are handed out.
+    """
+
+    def __init__(self, connect, max_idle: int = 4, liveness_after: float = LIVENESS_AFTER, max_connections: int = None):
+        self.connect = connect
+        self.max_idle = max_idle
+        self.liveness_after = liveness_after
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_connections) if max_connections else None
+
+    def acquire(self):
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            return self.take()
+        except BaseException:
+            self.free_slot()
+            raise
+
+    def take(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn, released_at = self.idle.pop()
+            if isAlive(conn, check=time.monotonic() - released_at >= self.liveness_after):
+                return conn
+            logger.info("Dropping a dead pooled connection")
+            closeQuietly(conn)
+        return self.connect()
+
+    def release(self, conn) -> None:
+        self.free_slot()
+        if conn.closed:
+            return
+        try:
+            if not conn.autocommit:
+                conn.rollback()
+                conn.autocommit = True
+        except Exception:
+            closeQuietly(conn)
+            return
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def discard(self, conn) -> None:
+        self.free_slot()
+        closeQuietly(conn)
+
+    def free_slot(self) -> None:
+        if self.slots is not None:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            # The connection may be mid-statement or broken, don't hand it out again
+            self.discard(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close_all(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            closeQuietly(conn)
+
+
+def getPool(key, connect, **kwargs) -> ConnectionPool:
+    """Process-wide pool per key, e.g. (db_user, database, environment)."""
+    with lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(connect, **kwargs)
+        return pools[key]
+
+
+def getCredentials(key, fetch) -> dict:
+    """Process-wide credentials per key, fetched again shortly before they expire."""
+    with lock:
+        if key not in credentials:
+            credentials[key] = CachedCredentials(fetch)
+        cached = credentials[key]
+    return cached.get()
+
+
+def closeAll() -> None:
+    with lock:
+        all_pools = list(pools.values())
+    for pool in all_pools:
+        pool.close_all()
+
+
+def isAlive(conn, check: bool = True) -> bool:
+    if conn.closed:
+        return False
+    if not check:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("select 1")
+            cursor.fetchone()
+        return True
+    except Exception:
+        return False
+
+
+def closeQuietly(conn) -> None:
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def asUtc(timestamp: datetime.datetime) -> datetime.datetime:
+    # boto3 returns aware datetimes, treat naive ones as UTC
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=datetime.timezone.utc)
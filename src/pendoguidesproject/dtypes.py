@@ -0,0 +1,93 @@
+import logging
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Event types of pendo.guides_usage, other types found in the data are appended to the enum
+EVENT_TYPES = ["guideSeen", "guideAdvanced", "guideDismissed", "guideActivity", "guideSnoozed", "guideTimeout"]
+
+# Repeated ids are dictionary encoded, browsertime is epoch millis
+PENDO_DTYPES = {
+    "accountid": "category",
+    "guideid": "category",
+    "visitorid": "category",
+    "guidestepid": "category",
+    "type": "event_type",
+    "browsertime": "epoch_millis",
+}
+
+# productusage.pendo_activity and pendo_usage as clean extracts them
+PENDO_ACTIVITY_DTYPES = {
+    "visitorid": "category",
+    "accountid": "category",
+    "instanceid": "category",
+}
+
+
+def applyDtypes(frame: pd.DataFrame, plan: dict = PENDO_DTYPES) -> pd.DataFrame:
+    """Converts the columns of a frame that appear in a dtype plan, leaving the other columns untouched."""
+    frame = frame.copy()
+    for column, kind in plan.items():
+        if column not in frame.columns:
+            continue
+        if kind == "category":
+            frame[column] = frame[column].astype("category")
+        elif kind == "event_type":
+            frame[column] = eventTypes(frame[column])
+        elif kind == "epoch_millis":
+            frame[column] = epochMillis(frame[column])
+        else:
+            frame[column] = frame[column].astype(kind)
+    return frame
+
+
+def eventTypes(values: pd.Series) -> pd.Series:
+    unknown = sorted(set(values.dropna().astype(str)) - set(EVENT_TYPES))
+    if unknown:
+        logger.warning(f"Unknown pendo event types {unknown}, adding them to the enum")
+    return values.astype(pd.CategoricalDtype(EVENT_TYPES + unknown))
+
+
+def epochMillis(values: pd.Series) -> pd.Series:
+    # CSV hands browsertime back as float or object, missing values can't be int64
+    values = pd.to_numeric(values)
+    if values.isna().any():
+        logger.warning(f"{values.isna().sum()} missing browsertimes, keeping them as float64")
+        return values.astype("float64")
+    return values.astype("int64")
+
+
+def concatCompact(frames, **kwargs) -> pd.DataFrame:
+    """
+    pd.concat that keeps categoricals categorical, pandas falls back to object when their categories differ.
+    The categories of the frames are unified in place.
+    """
+    frames = list(frames)
+    if len(frames) > 1:
+        for column in frames[0].columns:
+            if all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames if column in frame):
+                categories = pd.Index([])
+                for frame in frames:
+                    categories = categories.append(frame[column].cat.categories[~frame[column].cat.categories.isin(categories)])
+                for frame in frames:
+                    frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames, **kwargs)
+
+
+def compact(frame: pd.DataFrame, stage: str, plan: dict = PENDO_DTYPES) -> pd.DataFrame:
+    """Applies a dtype plan to the frame of a stage, logging its memory before and after."""
+    compacted = applyDtypes(frame, plan)
+    memoryReport(stage, frame, compacted)
+    return compacted
+
+
+def memoryReport(stage: str, before, after) -> None:
+    """Logs the deep memory usage of a stage's frame before and after compaction, either may be a byte count."""
+    before_bytes, after_bytes = memoryBytes(before), memoryBytes(after)
+    ratio = before_bytes / after_bytes if after_bytes else float("inf")
+    logger.info(f"{stage}: {before_bytes / 2**20:.1f}MB -> {after_bytes / 2**20:.1f}MB ({ratio:.1f}x smaller)")
+
+
+def memoryBytes(frame) -> int:
+    return int(frame) if isinstance(frame, (int, float)) else int(frame.memory_usage(deep=True).sum())
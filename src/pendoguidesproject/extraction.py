@@ -0,0 +1,38 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pendoguidesproject.metrics import inContext
+
+logger = logging.getLogger(__name__)
+
+
+def extractConcurrently(sources: dict, workers: int = None) -> dict:
+    """
+    Runs independent, I/O-bound fetches (Redshift queries, S3 downloads) on a thread pool.
+
+    :param sources: The fetch function per source name, called without arguments
+    :param workers: The number of threads, one per source when None
+    :return: The result per source name, in the order of sources
+    """
+    def timed(name):
+        start = time.perf_counter()
+        result = sources[name]()
+        rows = f", {len(result)} rows" if hasattr(result, "__len__") else ""
+        logger.info(f"Extracted {name} in {time.perf_counter() - start:.2f}s{rows}")
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers or max(len(sources), 1)) as pool:
+        # The fetches count their rows and bytes into the stage that extracts them
+        futures = {name: pool.submit(inContext(timed), name) for name in sources}
+        results = {name: future.result() for name, future in futures.items()}
+    logger.info(f"Extracted {len(sources)} sources in {time.perf_counter() - start:.2f}s")
+    return results
+
+
+def selectQuery(table: str, columns=None, where: str = None) -> str:
+    """Builds the select of a source, only requesting its allow-listed columns when given."""
+    projection = ", ".join('"' + column.replace('"', '""') + '"' for column in columns) if columns else "*"
+    query = f"select {projection} from {table}"
+    return f"{query} where {where}" if where else query
@@ -1,15 +1,63 @@
+import functools
+import importlib
+import inspect
+from collections import namedtuple
+
+from pendoguidesproject.metrics import stage
+
+# The datasets a job reads and writes, e.g. raw/pendoguides or redshift:pendo.guides_usage
+JobDatasets = namedtuple("JobDatasets", ["inputs", "outputs"])
+# The module registering each job. Modules are only imported when one of their jobs runs, so a job never pays
+# for the dependencies of the others
+JOB_MODULES = {
+    "sample": "pendoguidesproject.jobs.sample",
+    "ingest": "pendoguidesproject.jobs.ingest",
+    "transform": "pendoguidesproject.jobs.transform",
+    "load": "pendoguidesproject.jobs.load",
+    "clean": "pendoguidesproject.clean",
+}
+
+
 def make_job_decorator():
     registry = {}
+    datasets = {}
 
-    def register(name):
+    def register(name, inputs=(), outputs=()):
         def inner(func):
-            registry[name] = func
+            registry[name] = instrumented(name, func)
+            datasets[name] = JobDatasets(tuple(inputs), tuple(outputs))
             return func
 
         return inner
 
     register.all = registry
+    register.datasets = datasets
     return register
 
 
+def instrumented(name, func):
+    """Runs a job inside a metrics stage of its name, so its sub-stages are recorded under it."""
+    @functools.wraps(func)
+    def job(*args, **kwargs):
+        with stage(name):
+            return func(*args, **kwargs)
+
+    return job
+
+
 entrypoint = make_job_decorator()
+
+
+def loadJob(name: str, register=entrypoint, modules: dict = JOB_MODULES):
+    """Imports the module of a job on first use and returns the registered job."""
+    if name not in register.all:
+        if name not in modules:
+            raise KeyError(f"Unknown job {name}, expected one of {sorted(modules)}")
+        importlib.import_module(modules[name])
+    return register.all[name]
+
+
+def job_options(job, options: dict) -> dict:
+    """Selects the options a job accepts as keyword arguments, so jobs without them keep running as job(env, date)."""
+    parameters = inspect.signature(job).parameters
+    return {name: value for name, value in options.items() if name in parameters}
@@ -1,63 +1,134 @@
 import logging
-import requests
-from typing import Optional
-import time
 import pandas as pd
 import boto3
-from authlib.integrations.requests_client import OAuth2Session
-from pendoguidesproject.secrets import Secrets
-from pendoguidesproject.config import SecretsConfig
 from pendoguidesproject.jobs import entrypoint
 from pendoguidesproject.Redshift import redshiftExporter
-import io
-from io import StringIO
+from pendoguidesproject.metrics import stage
+from pendoguidesproject.readiness import waitForCredentials
+from pendoguidesproject.storage import S3MultipartWriter, datasetKey, get_bucket, get_format, listPartitions, partitionDates, readDataset, waitForCheckpoints, writeDataset, writePartitions
 import os
-import psycopg2
-from datetime import datetime
-import pytz
-import awswrangler as wr
+import json
 
+RAW_PREFIX = "raw/pendoguides"
+WATERMARK_KEY = f"{RAW_PREFIX}/pendoguides.watermark.json"
 
-@entrypoint("ingest")
-def run(env: str, date: str):
+
+@entrypoint("ingest", inputs=["redshift:pendo.guides_usage"], outputs=[RAW_PREFIX])
+def run(env: str, date: str, full_refresh: bool = False, extraction: str = "query", storage_format: str = "parquet"):
     os.environ["environment"] = env
-    time.sleep(5)
+    os.environ["extraction"] = extraction
+    os.environ["storage_format"] = storage_format
+    waitForCredentials()
 
-    ingestData()
+    ingestData(full_refresh)
 
-def ingestData():
-    pendo_guides = ingestPendo()
-    writeToCSVToS3(pendo_guides,"pendoguides")
-    # Enhance readability
+def ingestData(full_refresh=False):
+    watermark = None if full_refresh else readWatermark()
+    if watermark is None and os.environ.get("extraction") == "stream":
+        logging.info("No watermark or full refresh requested, streaming all pendo guides to S3")
+        with stage("extract"):
+            latest = streamPendoToS3()
+        writeWatermark(latest)
+        return latest
+    if watermark is None:
+        logging.info("No watermark or full refresh requested, ingesting all pendo guides")
+        with stage("extract") as span:
+            pendo_guides = ingestPendo()
+            span.rows_out = len(pendo_guides)
+        with stage("write", rows_in=len(pendo_guides)):
+            writePartitions(pendo_guides, RAW_PREFIX, "pendoguides")
+    else:
+        logging.info(f"Ingesting pendo guides newer than watermark {watermark}")
+        with stage("extract") as span:
+            pendo_guides = ingestPendo(watermark)
+            span.rows_out = len(pendo_guides)
+        if len(pendo_guides) == 0:
+            logging.info("No new pendo guides since the watermark")
+            return pendo_guides
+        with stage("write", rows_in=len(pendo_guides)):
+            appendPartitions(pendo_guides, watermark)
+    # Only move the watermark once the events are safely written
+    writeWatermark(pendo_guides)
     return pendo_guides
 
-def ingestPendo():
+def ingestPendo(watermark=None):
     # Engine
     importer = redshiftExporter("pendoguides", "", False)
-    con = importer.import_data()
-    con.set_isolation_level("ISOLATION_LEVEL_AUTOCOMMIT")
-    # Ingest pendo guides
-    sql = "select * from pendo.guides_usage"
-    pendo_guides = pd.read_sql_query(sql, con)
-    # Close connection
-    con.close()
+    with importer.connection() as con:
+        # Ingest pendo guides
+        if watermark is None:
+            sql = "select * from pendo.guides_usage"
+            pendo_guides = importer.read_query(con, sql)
+        else:
+            # The date_partition bound lets Redshift skip older blocks, browsertime is the exact cut-off
+            sql = "select * from pendo.guides_usage where date_partition >= %(date_partition)s and browsertime > %(browsertime)s"
+            pendo_guides = importer.read_query(con, sql, params=watermark)
     return pendo_guides
 
-def writeToCSVToS3(dataset, description):
+def appendPartitions(pendo_guides, watermark):
+    # Only the partitions the new events fall into are rewritten
+    existing = set(listPartitions(RAW_PREFIX))
+    dates = partitionDates(pendo_guides["date_partition"])
+    for date, events in pendo_guides.groupby(dates, sort=True):
+        if date in existing:
+            written = readDataset(RAW_PREFIX, "pendoguides", date=date)
+            # Events past the watermark were appended by a run that failed before moving it, they are read again
+            written = written[written["browsertime"] <= watermark["browsertime"]]
+            events = pd.concat([written, events], ignore_index=True)
+        writeDataset(events, RAW_PREFIX, "pendoguides", date=date)
+
+def streamPendoToS3():
     env = os.environ["environment"]
-    csv_buffer = StringIO()
-    dataset.to_csv(csv_buffer)
-    s3_resource = boto3.resource('s3')
-    s3_resource.Object(get_bucket(env), f"raw/pendoguides/{description}.csv").put(Body=csv_buffer.getvalue())
+    # Engine
+    importer = redshiftExporter("pendoguides", "", False)
+    # Stream pendo guides in partition order, one multipart upload per partition, keeping only each batch's latest event
+    sql = "select * from pendo.guides_usage order by date_partition"
+    latest = []
+    writer = None
+    current = None
+    with importer.connection() as con:
+        try:
+            for batch in importer.stream_query(con, sql):
+                for date, events in batch.groupby(partitionDates(batch["date_partition"]), sort=True):
+                    if date != current:
+                        if writer is not None:
+                            writer.close()
+                        writer = S3MultipartWriter(
+                            get_bucket(env), datasetKey(RAW_PREFIX, "pendoguides", date=date), schema=batch.attrs.get("arrow_schema")
+                        )
+                        current = date
+                    if get_format() == "parquet":
+                        writer.write_parquet(events)
+                    else:
+                        writer.write_csv(events)
+                latest.append(batch[["browsertime", "date_partition"]].max())
+            if writer is not None:
+                writer.close()
+        except Exception:
+            if writer is not None:
+                writer.abort()
+            raise
+    return pd.DataFrame(latest).dropna()
+
+def readWatermark():
+    env = os.environ["environment"]
+    s3_client = boto3.client('s3')
+    try:
+        obj = s3_client.get_object(Bucket=get_bucket(env), Key=WATERMARK_KEY)
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(obj['Body'].read())
 
-def readCSVFromS3(description):
+def writeWatermark(pendo_guides):
+    if len(pendo_guides) == 0:
+        return
+    # Partitions handed to the next job in memory may still be on their way to S3
+    waitForCheckpoints()
     env = os.environ["environment"]
-    bucket = get_bucket(env)
-    key = f"raw/pendoguides/{description}.csv"
-    s3_resource = boto3.client('s3')
-    obj = s3_resource.get_object(Bucket=bucket, Key=key)
-    df = pd.read_csv(io.BytesIO(obj['Body'].read()), encoding='utf8')
-    return df
-
-def get_bucket(env: str):
-    return 'cdo-datalake-prd' if env == 'prd' else 'cdo-datalake-dev-bphcob'
+    watermark = {
+        "browsertime": int(pendo_guides["browsertime"].max()),
+        "date_partition": str(pendo_guides["date_partition"].max()),
+    }
+    logging.info(f"Moving watermark to {watermark}")
+    s3_resource = boto3.resource('s3')
+    s3_resource.Object(get_bucket(env), WATERMARK_KEY).put(Body=json.dumps(watermark))
@@ -1,50 +1,59 @@
-from time import sleep
+import argparse
 
 import pandas as pd
-import boto3
-from authlib.integrations.requests_client import OAuth2Session
-from pendoguidesproject.secrets import Secrets
-from pendoguidesproject.config import SecretsConfig
+
 from pendoguidesproject.jobs import entrypoint
 from pendoguidesproject.Redshift import redshiftExporter
-import io
-from io import StringIO
+from pendoguidesproject.metrics import report, stage
+from pendoguidesproject.readiness import waitForCredentials
+from pendoguidesproject.storage import get_bucket, listPartitions, readDataset, readPartitions
 import os
-import awswrangler as wr
 
-def export_activity():
-    # Get in cleaned data
-    activity = readCSVFromS3("pendoguides")
+@entrypoint("load", inputs=["clean/pendoguides", "clean/pendoguides_changes"], outputs=["redshift:pendoguides.guide_usage"])
+def run(env: str, date: str, storage_format: str = "parquet"):
+    os.environ["environment"] = env
+    os.environ["storage_format"] = storage_format
+    export_activity(date)
+
+def export_activity(date=None, mode="full"):
+    if mode == "upsert" and date is not None and listPartitions("clean/pendoguides_changes", date, date):
+        # Get in every clean partition the transform of the run date rewrote
+        with stage("read") as span:
+            dates = list(readDataset("clean/pendoguides_changes", "pendoguides", format="parquet", date=date)["date_partition"])
+            activity = pd.concat([readDataset("clean/pendoguides", "pendoguides", date=day) for day in dates], ignore_index=True)
+            span.rows_out = len(activity)
+        exporter = redshiftExporter("pendoguides", "guide_usage", False)
+        with stage("upsert", rows_in=len(activity)):
+            if exporter.replace_partitions(activity, dates):
+                return
+        print("Falling back to a full load")
+    # Get in cleaned data, every partition up to the run date
+    with stage("read") as span:
+        activity = readPartitions("clean/pendoguides", "pendoguides", end=date)
+        span.rows_out = len(activity)
     # Write back data
     writeToRedshift(activity, "guide_usage")
 
-def get_bucket(env: str):
-    return 'cdo-datalake-prd' if env == 'prd' else 'cdo-datalake-dev-bphcob'
-
-def readCSVFromS3(description):
-    env = os.environ["environment"]
-    bucket = get_bucket(env)
-    key = f"clean/pendoguides/{description}.csv"
-    s3_resource = boto3.client('s3')
-    obj = s3_resource.get_object(Bucket=bucket, Key=key)
-    df = pd.read_csv(io.BytesIO(obj['Body'].read()), encoding='utf8')
-    return df
-
 def writeToRedshift(df, description):
     env = os.environ["environment"]
     # Write to Glue
     os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
-    wr.s3.to_parquet(
-        df=df,
-        path="s3://" + get_bucket(os.environ["environment"]) + "/master/pendoguides/",
-        dataset=True,
-        database= "pendoguides" if env == "prd" else "pendoguides_dev",
-        table=description,
-        mode="overwrite",
-    )
+    # awswrangler takes seconds to import, only the full load pays for it
+    import awswrangler as wr
+
+    with stage("glue", rows_in=len(df)):
+        wr.s3.to_parquet(
+            df=df,
+            path="s3://" + get_bucket(os.environ["environment"]) + "/master/pendoguides/",
+            dataset=True,
+            database= "pendoguides" if env == "prd" else "pendoguides_dev",
+            table=description,
+            mode="overwrite",
+        )
     # Write to Redshift
-    exporter = redshiftExporter("pendoguides", description, False)
-    exporter.export()
+    with stage("redshift"):
+        exporter = redshiftExporter("pendoguides", description, False)
+        exporter.export()
 
 # import argparse
 # import logging
@@ -62,7 +71,19 @@ def writeToRedshift(df, description):
 #     export("pendoguides", "pendoguides", False)
 
 if __name__ == "__main__":
-    sleep(5)
+    parser = argparse.ArgumentParser(description="")
+    parser.add_argument("-d", "--date", dest="date", help="date in format YYYY-mm-dd")
+    parser.add_argument("--dataset", dest="dataset", help="dataset to export")
+    parser.add_argument(
+        "--mode", dest="mode", choices=["full", "upsert"], default="full",
+        help="full reloads the table from Spectrum, upsert replaces the partitions the transform of --date rewrote",
+    )
+    args = parser.parse_args()
+    waitForCredentials()
     print("inside main")
     # Export
-    export_activity()
+    try:
+        with stage("load"):
+            export_activity(args.date, args.mode)
+    finally:
+        report(job="load", env=os.environ.get("environment"), date=args.date)
@@ -1,5 +1,4 @@
 import logging
-import requests
 from typing import Optional
 
 from pendoguidesproject.jobs import entrypoint
@@ -24,6 +23,8 @@ def extract_data() -> Optional[str]:
     Gets the data from the open weather map api and returns the result.
     :return: The weather data
     """
+    import requests
+
     return requests.get(
         "https://samples.openweathermap.org/data/2.5/weather?q=Leuven&appid=b6907d289e10d714a6e88b30761fae22"
     )
@@ -1,39 +1,163 @@
 import pandas as pd
-import boto3
 
-from authlib.integrations.requests_client import OAuth2Session
-
-from pendoguidesproject.jobs.ingest import ingestPendo
-from pendoguidesproject.secrets import Secrets
-from pendoguidesproject.config import SecretsConfig
 from pendoguidesproject.jobs import entrypoint
-from pendoguidesproject.Redshift import redshiftExporter
-import io
-from io import StringIO
+from pendoguidesproject.transformations.sessionize import OUTPUT_COLUMNS, SessionState, closedAdvances, verifyIncremental, withoutClosedAdvances
+from pendoguidesproject.transformations.sharding import sessionizeIncrementalSharded, sessionizeSharded, shardByVisitor
+from pendoguidesproject.storage import listPartitions, partitionDates, readDataset, readPartitions, waitForCheckpoints, writeDataset, writePartitions
+from pendoguidesproject.transformations.timestamp_index import earliestAfter, latestBefore
+from pendoguidesproject.dtypes import PENDO_DTYPES, applyDtypes
+from pendoguidesproject.metrics import stage
 import os
-import awswrangler as wr
 
-import smtplib
-import datetime
+import logging
 from datetime import timedelta
-from datetime import date as dt
 from datetime import datetime
 
-@entrypoint("transform")
-def run(env: str, date: str):
+EVENT_COLUMNS = ["accountid", "guideid", "visitorid", "guidestepid", "type", "browsertime", "date_partition"]
+STATE_PREFIX = "state/pendoguides"
+# The dates of the clean partitions each run rewrote, by run date, load replaces those partitions in Redshift
+CHANGES_PREFIX = "clean/pendoguides_changes"
+# Share of the visitors and number of days --verify replays
+VERIFY_SHARDS = 100
+VERIFY_DAYS = 3
+# The dtypes of the sessionize output the spark engine hands back
+OUTPUT_DTYPES = {"account id": "category", "guideid": "category", "visitorid": "category", "guidestepid": "category"}
+
+@entrypoint("transform", inputs=["raw/pendoguides"], outputs=["clean/pendoguides", STATE_PREFIX, CHANGES_PREFIX])
+def run(env: str, date: str, workers: int = 1, storage_format: str = "parquet", full_refresh: bool = False,
+        incremental: bool = False, verify: bool = False, engine: str = "pandas"):
     os.environ["environment"] = env
-    # Get in pendo guide data
-    pendoguidesdata = readCSVFromS3("pendoguides")
+    os.environ["storage_format"] = storage_format
+    if engine == "spark":
+        if storage_format != "parquet" or incremental or verify:
+            raise ValueError("The spark engine only recomputes parquet datasets in full, without --incremental or --verify")
+        transformSpark(date, full_refresh)
+        return
+    if verify:
+        verifyTransform(date)
+    if incremental:
+        transformIncremental(date, workers, full_refresh)
+        return
+    # Get in pendo guide data up to the run date, only the columns time on guide needs
+    with stage("read") as span:
+        pendoguidesdata = readPartitions("raw/pendoguides", "pendoguides", end=date, columns=EVENT_COLUMNS, dtypes=PENDO_DTYPES)
+        span.rows_out = len(pendoguidesdata)
     pendoguidesdata["date_time"] = pd.to_datetime(pendoguidesdata["browsertime"], unit='ms')
 
     vid_list=get_visitorlist(pendoguidesdata)
     gid_list=get_guidelist(pendoguidesdata)
 
     #timeonGuide returns a datafram includes [guide id, visitor id, step id, time on guide,date partition]
-    df=timeonGuide(gid_list,vid_list ,pendoguidesdata)
-
-    #write the output dataframe in S3/clean
-    writeToCSVToS3(df,"pendoguides")
+    with stage("sessionize", rows_in=len(pendoguidesdata)) as span:
+        df=timeonGuide(gid_list,vid_list ,pendoguidesdata, workers)
+        span.rows_out = len(df)
+
+    #write the output dataframe in S3/clean, dismissals carry a timestamp and advances a partition date
+    df["date_partition"] = df["date_partition"].astype(str)
+    writeTimeOnGuide(df, date, full_refresh)
+
+def writeTimeOnGuide(df, date, full_refresh=False):
+    with stage("write", rows_in=len(df)):
+        if full_refresh:
+            dates = writePartitions(df, "clean/pendoguides", "pendoguides")
+        else:
+            writeDataset(df[partitionDates(df["date_partition"]) == date], "clean/pendoguides", "pendoguides", date=date)
+            dates = [date]
+        writeChanges(dates, date)
+
+def transformSpark(date, full_refresh=False):
+    # pyspark is only imported by runs with --engine spark
+    from pendoguidesproject.common.spark import getSpark, readParquetPartitions
+    from pendoguidesproject.transformations.spark_sessionize import sessionizeSpark
+
+    # Spark reads the raw partitions from S3, an ingest in this process may still be checkpointing them
+    waitForCheckpoints()
+    spark = getSpark()
+    dates = listPartitions("raw/pendoguides", end=date)
+    events = readParquetPartitions(spark, "raw/pendoguides", "pendoguides", dates, EVENT_COLUMNS)
+    # Spark evaluates lazily, reading the partitions is part of the sessionize stage
+    with stage("sessionize") as span:
+        df = sessionizeSpark(events).toPandas() if events is not None else pd.DataFrame(columns=OUTPUT_COLUMNS)
+        span.rows_out = len(df)
+    # Dismissals come formatted like the timestamps of the pandas engine
+    writeTimeOnGuide(applyDtypes(df, OUTPUT_DTYPES), date, full_refresh)
+
+def transformIncremental(date, workers=1, full_refresh=False):
+    previous = None if full_refresh else latestState(date)
+    if previous is None:
+        logging.info(f"No session state before {date}, sessionizing the full history")
+        pendoguidesdata = readPartitions("raw/pendoguides", "pendoguides", end=date, columns=EVENT_COLUMNS, dtypes=PENDO_DTYPES)
+        state = None
+    else:
+        logging.info(f"Continuing the sessions of {previous}, sessionizing the events up to {date}")
+        pendoguidesdata = readPartitions("raw/pendoguides", "pendoguides", start=nextDay(previous), end=date, columns=EVENT_COLUMNS, dtypes=PENDO_DTYPES)
+        state = readState(previous)
+
+    if len(pendoguidesdata) == 0:
+        # A quiet day: the sessions stay open as they are and the day gets an empty partition
+        logging.info(f"No new events up to {date}, carrying the session state forward")
+        with stage("write"):
+            writeDataset(pd.DataFrame(columns=OUTPUT_COLUMNS), "clean/pendoguides", "pendoguides", date=date)
+            writeChanges([date], date)
+            writeState(state or SessionState(), date)
+        return
+
+    # Advances without a seen that earlier runs wrote, which a new advance of their step supersedes
+    closed = closedAdvances(state or SessionState(), pendoguidesdata)
+    with stage("sessionize", rows_in=len(pendoguidesdata)) as span:
+        df, state = sessionizeIncrementalSharded(pendoguidesdata, state, workers)
+        span.rows_out = len(df)
+
+    # Only the partitions of the new events change, and the earlier partitions of the advances they supersede
+    df["date_partition"] = df["date_partition"].astype(str)
+    days = partitionDates(df["date_partition"])
+    with stage("write", rows_in=len(df)):
+        written = sorted(set(partitionDates(pendoguidesdata["date_partition"])) | set(days) | {date})
+        for day in written:
+            writeDataset(df[days == day], "clean/pendoguides", "pendoguides", date=day)
+        closed_days = sorted(set(partitionDates(closed["open_date"])))
+        for day in closed_days:
+            partition = readDataset("clean/pendoguides", "pendoguides", date=day)
+            writeDataset(withoutClosedAdvances(partition, closed), "clean/pendoguides", "pendoguides", date=day)
+        writeChanges(set(written) | set(closed_days), date)
+        # The state goes last, a failed run is retried from the previous state
+        writeState(state, date)
+
+def verifyTransform(date):
+    # Compare incremental runs with a full recompute on a hash sample of the visitors
+    pendoguidesdata = readPartitions("raw/pendoguides", "pendoguides", end=date, columns=EVENT_COLUMNS, dtypes=PENDO_DTYPES)
+    sample = shardByVisitor(pendoguidesdata, VERIFY_SHARDS)[0]
+    dates = sorted(set(partitionDates(sample["date_partition"])))[-VERIFY_DAYS:]
+    if len(dates) == 0:
+        logging.info("No sampled events to verify incremental time on guide with")
+        return
+    mismatches = verifyIncremental(sample, dates)
+    if len(mismatches) > 0:
+        raise ValueError(f"Incremental time on guide differs from a full recompute on {mismatches}")
+    logging.info(f"Incremental time on guide matches a full recompute on {dates} for {len(sample)} sampled events")
+
+def latestState(date):
+    dates = listPartitions(STATE_PREFIX, end=previousDay(date))
+    return dates[-1] if len(dates) > 0 else None
+
+def readState(date):
+    guides = readDataset(STATE_PREFIX, "guides", format="parquet", date=date)
+    steps = readDataset(STATE_PREFIX, "steps", format="parquet", date=date)
+    return SessionState(guides, steps)
+
+def writeState(state, date):
+    writeDataset(state.guides, STATE_PREFIX, "guides", format="parquet", date=date)
+    writeDataset(state.steps, STATE_PREFIX, "steps", format="parquet", date=date)
+
+def writeChanges(dates, date):
+    changes = pd.DataFrame({"date_partition": sorted(dates)}, dtype=object)
+    writeDataset(changes, CHANGES_PREFIX, "pendoguides", format="parquet", date=date)
+
+def previousDay(date):
+    return (datetime.strptime(date, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+
+def nextDay(date):
+    return (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
 
 def get_visitorlist(pendoguidesdata):
      vid_list = list(set(pendoguidesdata["visitorid"]))
@@ -44,100 +168,12 @@ def get_guidelist(pendoguidesdata):
     return gid_list
 
 def findHighest(lst, target):
-    if len(lst)==0:
-        return target
-    max_element = min(pd.to_numeric(lst))
-    if target < min(pd.to_numeric(lst)):
-        return target
-    for e in lst:
-        if int(e) > max_element and int(e) < target:
-            max_element = int(e)
-
-    return max_element
+    return latestBefore(lst, target)
 
 def findLowest(lst, target):
-    max_element = max(pd.to_numeric(lst))
-
-    for e in lst:
-        if int(e) < max_element and int(e) > target:
-            max_element=int(e)
-    return max_element
-
-
-def timeonGuide(gid_list, vid_list,pendoguidesdata):
-    output = []
-    for gid in gid_list:
-        selected_gid = pendoguidesdata[pendoguidesdata["guideid"] == gid]
-
-        for vid in vid_list:
-
-            select_vid = selected_gid[selected_gid["visitorid"] == vid]
-
-            # gid_list = list(set(select["guideid"]))
-            gsid_list = list(set(select_vid["guidestepid"]))
-            type_list = list(set(select_vid["type"]))
-            dismissed = list(set(select_vid["type"]))
-
-            total = 0
-            s = 0
-
-            seen = select_vid.loc[select_vid["type"] == "guideSeen"]["browsertime"]
-            dismissed = select_vid.loc[select_vid["type"] == "guideDismissed"]["browsertime"]
-
-            for x in dismissed:
-                gs = list(select_vid.loc[select_vid["browsertime"] == x]["guidestepid"])[0]
-                accountID = list(select_vid.loc[select_vid["browsertime"] == x]["accountid"])[0]
-                date = list(select_vid.loc[select_vid["browsertime"] == x]["date_time"])[0]
-                output.append([accountID,gid, vid, gs, ((x - findHighest(seen, x)) / 1000), date])
-                total += (x - findHighest(seen, x)) / 1000
-
-            # total=sum(output)/1000
-            advance_list = list(select_vid.loc[select_vid["type"] == "guideAdvanced"]["browsertime"])
-
-            for gsid in gsid_list:
-                m = 0
-                select_gsid = select_vid.loc[(select_vid["guidestepid"] == gsid)]
-                seen = pd.to_numeric(list(select_gsid.loc[select_gsid["type"] == "guideSeen"]["browsertime"]))
-                dismissed = pd.to_numeric(list(select_gsid.loc[select_gsid["type"] == "guideDismissed"]["browsertime"]))
-                advance = pd.to_numeric(list(select_gsid.loc[select_gsid["type"] == "guideAdvanced"]["browsertime"]))
-                activity = pd.to_numeric(list(select_gsid.loc[select_gsid["type"] == "guideActivity"]["browsertime"]))
-
-                if len(advance) > 0:
-                    for a in advance:
-                        highest_seen = findHighest(seen, a)
-                        lowest_advanced = findLowest(advance, highest_seen)
-                        date = list(select_gsid.loc[select_gsid["browsertime"] == a]["date_partition"])[0]
-
-                        if lowest_advanced == a:
-                            m += (int(a) - int(findHighest(seen, a))) / 1000
-                            output.append([accountID,gid, vid, gsid, m, date])
-
-                if len(activity) > 0 and len(dismissed) == 0 and len(advance) == 0:
-                    for a in activity:
-                        m += (int(a) - int(findHighest(seen, a))) / 1000
-
-                total += m
-                # output.append([gsid,m])
-
-    df = pd.DataFrame.from_records(output, columns=["account id","guideid", "visitorid", "guidestepid", "time on guide", "date_partition"])
-    return df
-
-
-def writeToCSVToS3(dataset, description):
-    env = os.environ["environment"]
-    csv_buffer = StringIO()
-    dataset.to_csv(csv_buffer, index=False)
-    s3_resource = boto3.resource('s3')
-    s3_resource.Object(get_bucket(env), f"clean/pendoguides/{description}.csv").put(Body=csv_buffer.getvalue())
-
-def get_bucket(env: str):
-    return 'cdo-datalake-prd' if env == 'prd' else 'cdo-datalake-dev-bphcob'
-
-def readCSVFromS3(description):
-    env = os.environ["environment"]
-    bucket = get_bucket(env)
-    key = f"raw/pendoguides/{description}.csv"
-    s3_resource = boto3.client('s3')
-    obj = s3_resource.get_object(Bucket=bucket, Key=key)
-    df = pd.read_csv(io.BytesIO(obj['Body'].read()), encoding='utf8')
-    return df
+    return earliestAfter(lst, target)
+
+
+def timeonGuide(gid_list, vid_list, pendoguidesdata, workers=1):
+    selected = pendoguidesdata[pendoguidesdata["guideid"].isin(gid_list) & pendoguidesdata["visitorid"].isin(vid_list)]
+    return sessionizeSharded(selected, workers)
@@ -0,0 +1,209 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import resource
+import socket
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "pendoguides"
+
+
+class Span:
+    """
+    The measurements of one job or sub-stage. Wall and CPU time are measured around the stage, rows and
+    counters are set by the code inside it, peak RSS is the process high-water mark when the stage ends.
+    """
+
+    def __init__(self, name: str, parent=None, rows_in: int = None):
+        self.name = name
+        self.parent = parent
+        self.path = f"{parent.path}/{name}" if parent is not None else name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.counters = {}
+        self.status = "running"
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_bytes = None
+        self.started = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def count(self, name: str, value) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self, status: str) -> None:
+        self.status = status
+        self.wall_seconds = time.perf_counter() - self._wall
+        self.cpu_seconds = time.process_time() - self._cpu
+        self.peak_rss_bytes = peakRss()
+
+    def to_dict(self) -> dict:
+        return {
+            "stage": self.path,
+            "status": self.status,
+            "started": self.started,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            **self.counters,
+        }
+
+
+class Recorder:
+    """
+    Collects the spans of a run. Spans nest along the context they were opened in: a thread only continues the
+    span of the code that started it when it runs in a copy of its context (see inContext), any other thread
+    starts a root span. Counters outside every span are dropped. A finished span adds its counters to its parent.
+    """
+
+    def __init__(self):
+        self.run_id = uuid.uuid4().hex
+        self.spans = []
+        self.lock = threading.Lock()
+        self.span = contextvars.ContextVar(f"span_{self.run_id}", default=None)
+
+    def current(self):
+        return self.span.get()
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int = None):
+        span = Span(name, self.current(), rows_in)
+        token = self.span.set(span)
+        status = "failed"
+        try:
+            yield span
+            status = "ok"
+        finally:
+            span.finish(status)
+            self.span.reset(token)
+            with self.lock:
+                self.spans.append(span)
+                if span.parent is not None:
+                    for counter, value in span.counters.items():
+                        span.parent.count(counter, value)
+
+    def count(self, name: str, value) -> None:
+        span = self.current()
+        if span is not None:
+            with self.lock:
+                span.count(name, value)
+
+    def record(self, **labels) -> dict:
+        with self.lock:
+            stages = [span.to_dict() for span in self.spans]
+        return {"run_id": self.run_id, **labels, "stages": stages}
+
+
+recorder = Recorder()
+
+
+def stage(name: str, rows_in: int = None):
+    """
+    Measures a job or a sub-stage of it, nested stages are recorded under the path of their parents.
+
+        with stage("sessionize", rows_in=len(events)) as span:
+            output = sessionize(events)
+            span.rows_out = len(output)
+    """
+    return recorder.stage(name, rows_in)
+
+
+def count(name: str, value) -> None:
+    """Adds to a counter of the current stage, e.g. s3_bytes_read or redshift_rows_read."""
+    recorder.count(name, value)
+
+
+def inContext(function):
+    """
+    Wraps a function for a thread pool so it runs in a copy of the caller's context, its counters and stages
+    then go to the caller's span, e.g. pool.submit(inContext(fetch)). Wrap once per submit, a context can only
+    be entered by one thread at a time.
+    """
+    return functools.partial(contextvars.copy_context().run, function)
+
+
+def reset() -> Recorder:
+    global recorder
+    recorder = Recorder()
+    return recorder
+
+
+def peakRss() -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def report(path: str = None, statsd: str = None, prometheus_textfile: str = None, **labels) -> dict:
+    """
+    Emits the metrics record of the run: always as one JSON log line, optionally as a JSON file (a local path
+    or s3://bucket/key), as StatsD gauges (host:port) and as a Prometheus node exporter textfile.
+    """
+    record = recorder.record(**labels)
+    body = json.dumps(record, default=str)
+    logger.info(f"Metrics {body}")
+    if path:
+        writeText(path, body)
+    if statsd:
+        sendStatsd(statsd, record)
+    if prometheus_textfile:
+        writeText(prometheus_textfile, prometheusText(record))
+    return record
+
+
+def metricValues(record: dict):
+    """The numeric measurements of every stage of a record, as (stage, metric, value)."""
+    for span in record["stages"]:
+        for metric, value in span.items():
+            if metric not in ("stage", "status", "started") and isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield span["stage"], metric, value
+
+
+def statsdLines(record: dict):
+    return [f"{PREFIX}.{stage.replace('/', '.')}.{metric}:{value}|g" for stage, metric, value in metricValues(record)]
+
+
+def sendStatsd(address: str, record: dict) -> None:
+    host, port = address.rsplit(":", 1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for line in statsdLines(record):
+            sock.sendto(line.encode("utf8"), (host, int(port)))
+    except OSError as e:
+        # Metrics are best effort, they never fail a run
+        logger.warning(f"Could not send metrics to StatsD at {address}: {e}")
+    finally:
+        sock.close()
+
+
+def prometheusText(record: dict) -> str:
+    lines = []
+    for stage, metric, value in metricValues(record):
+        name = f"{PREFIX}_stage_{metric}"
+        lines.append(f'{name}{{stage="{stage}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def writeText(path: str, text: str) -> None:
+    if path.startswith("s3://"):
+        import boto3
+
+        bucket, key = path[len("s3://"):].split("/", 1)
+        boto3.resource("s3").Object(bucket, key).put(Body=text.encode("utf8"))
+        return
+    # The node exporter may read the textfile at any moment, so it is replaced atomically
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        f.write(text)
+    os.replace(temporary, path)
@@ -0,0 +1,165 @@
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PROFILERS = ["cprofile", "sampling"]
+# Seconds between two samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+
+
+class Sampler(threading.Thread):
+    """
+    Samples the Python stacks of every other thread of the process at an interval. Unlike cProfile it does
+    not slow down the calls it measures, at the cost of missing what runs between two samples.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                self.stacks[(names.get(ident, str(ident)),) + tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def collapsed(self) -> str:
+        """The samples in the collapsed stack format of flamegraph.pl and speedscope, root first."""
+        lines = []
+        for (thread, *stack), samples in sorted(self.stacks.items()):
+            frames = [thread] + [frameLabel(function) for function in stack]
+            lines.append(f"{';'.join(frames)} {samples}")
+        return "\n".join(lines) + "\n"
+
+    def stats(self) -> dict:
+        """
+        The samples in the marshalled dict format of cProfile dumps, so pstats, snakeviz and gprof2dot read them:
+        {function: (primitive calls, calls, own time, cumulative time, {caller: (..., own time, cumulative time)})}.
+        Call counts are sample counts.
+        """
+        own, cumulative, edges = Counter(), Counter(), Counter()
+        for (thread, *stack), samples in self.stacks.items():
+            if not stack:
+                continue
+            own[stack[-1]] += samples
+            # Recursive functions count once per sample
+            for function in set(stack):
+                cumulative[function] += samples
+            for caller, callee in set(zip(stack, stack[1:])):
+                edges[(caller, callee)] += samples
+        callers = {function: {} for function in cumulative}
+        for (caller, callee), samples in edges.items():
+            callers[callee][caller] = (samples, samples, own[callee] * self.interval, samples * self.interval)
+        return {
+            function: (samples, samples, own[function] * self.interval, samples * self.interval, callers[function])
+            for function, samples in cumulative.items()
+        }
+
+
+def frameLabel(function) -> str:
+    filename, line, name = function
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def collapsedFromStats(stats: pstats.Stats) -> str:
+    """
+    The caller;callee edges of a cProfile run with their own time in microseconds. cProfile does not record full
+    stacks, so a flame graph of it is two frames deep; the sampling profiler records complete stacks.
+    """
+    lines = []
+    for callee, (_, _, _, _, callers) in sorted(stats.stats.items()):
+        for caller, edge in sorted(callers.items()):
+            micros = int(edge[2] * 1e6)
+            if micros > 0:
+                lines.append(f"{frameLabel(caller)};{frameLabel(callee)} {micros}")
+    return "\n".join(lines) + "\n"
+
+
+def hotspots(stats: pstats.Stats, top: int) -> str:
+    output = io.StringIO()
+    stats.stream = output
+    stats.sort_stats("cumulative").print_stats(top)
+    return output.getvalue()
+
+
+@contextmanager
+def profiled(profiler: str, name: str, output: str = "profiles", top: int = 25):
+    """
+    Profiles the block with cProfile or the sampling profiler, then writes {name}.pstats and {name}.collapsed to
+    output (a local directory or s3://bucket/prefix) and logs the top hotspots by cumulative time. Only the
+    calling process is profiled, not the worker processes of sharded jobs.
+    """
+    if profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler {profiler}, expected one of {PROFILERS}")
+    if profiler == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+    else:
+        sampler = Sampler()
+        sampler.start()
+    try:
+        yield
+    finally:
+        if profiler == "cprofile":
+            profile.disable()
+            profile.create_stats()
+            dump = marshal.dumps(profile.stats)
+            stats = pstats.Stats(profile)
+            collapsed = collapsedFromStats(stats)
+        else:
+            sampler.stop()
+            dump = marshal.dumps(sampler.stats())
+            stats = statsFromDump(dump)
+            collapsed = sampler.collapsed()
+        prefix = f"{output.rstrip('/')}/{name}"
+        writeOutput(f"{prefix}.pstats", dump)
+        writeOutput(f"{prefix}.collapsed", collapsed.encode("utf8"))
+        logger.info(f"Profiled {name} with {profiler}, wrote {prefix}.pstats and {prefix}.collapsed\n{hotspots(stats, top)}")
+
+
+def statsFromDump(dump: bytes) -> pstats.Stats:
+    stats = pstats.Stats()
+    stats.stats = marshal.loads(dump)
+    stats.get_top_level_stats()
+    return stats
+
+
+def profileName(job: str, date: str) -> str:
+    return f"{job}-{date}-{time.strftime('%Y%m%dT%H%M%S')}"
+
+
+def writeOutput(path: str, body: bytes) -> None:
+    if path.startswith("s3://"):
+        import boto3
+
+        bucket, key = path[len("s3://"):].split("/", 1)
+        boto3.resource("s3").Object(bucket, key).put(Body=body)
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(body)
@@ -0,0 +1,48 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# How long a job waits for its environment before failing
+READY_TIMEOUT = 60.0
+MAX_INTERVAL = 5.0
+
+
+def waitUntilReady(check, description: str, timeout: float = READY_TIMEOUT, interval: float = 0.2) -> None:
+    """
+    Polls a readiness check with exponential backoff, returning as soon as it passes instead of sleeping a fixed time.
+
+    :param check: Returns True when ready, exceptions count as not ready
+    :param description: What is waited for, for the logs
+    :param timeout: Seconds to wait before raising a TimeoutError
+    :param interval: Seconds before the first retry, doubled up to MAX_INTERVAL
+    """
+    start = time.monotonic()
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            if check():
+                logger.info(f"{description} ready after {time.monotonic() - start:.2f}s")
+                return
+            reason = "not ready"
+        except Exception as e:
+            reason = repr(e)
+        remaining = timeout - (time.monotonic() - start)
+        if remaining <= 0:
+            raise TimeoutError(f"{description} not ready after {attempts} attempts in {timeout}s: {reason}")
+        logger.info(f"Waiting for {description}: {reason}")
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, MAX_INTERVAL)
+
+
+def credentialsAvailable() -> bool:
+    import boto3
+
+    credentials = boto3.Session().get_credentials()
+    return credentials is not None and bool(credentials.get_frozen_credentials().access_key)
+
+
+def waitForCredentials(timeout: float = READY_TIMEOUT) -> None:
+    """Waits until AWS credentials resolve, the container role may take a moment to be served after start."""
+    waitUntilReady(credentialsAvailable, "AWS credentials", timeout)
@@ -0,0 +1,67 @@
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+def jobDependencies(job_names, datasets: dict) -> dict:
+    """
+    The jobs each job waits for: the jobs given before it that write a dataset it reads or writes, or read a
+    dataset it writes. Jobs without declared datasets run in order with every other job.
+
+    :param job_names: The jobs in the order they were given
+    :param datasets: The JobDatasets per job name, as declared in @entrypoint
+    :return: The names of the jobs each job depends on
+    """
+    def declared(name):
+        return name in datasets and bool(datasets[name].inputs or datasets[name].outputs)
+
+    dependencies = {}
+    for position, name in enumerate(job_names):
+        earlier = job_names[:position]
+        if not declared(name):
+            dependencies[name] = list(earlier)
+            continue
+        inputs, outputs = set(datasets[name].inputs), set(datasets[name].outputs)
+        dependencies[name] = [
+            other for other in earlier
+            if not declared(other) or set(datasets[other].outputs) & (inputs | outputs) or set(datasets[other].inputs) & outputs
+        ]
+    return dependencies
+
+
+def runInProcess(job_names, run_job, datasets: dict) -> None:
+    """
+    Runs a chain of jobs in this process, e.g. ingest transform load. The datasets a job writes are handed to the
+    jobs after it in memory and checkpointed to S3 in the background. Jobs that don't depend on each other run
+    concurrently, a job whose dependency failed is not run.
+
+    :param job_names: The jobs in the order they were given
+    :param run_job: Runs a job by name
+    :param datasets: The JobDatasets per job name, as declared in @entrypoint
+    """
+    # storage pulls in pandas, boto3 and pyarrow, single jobs that don't need them don't import them
+    from pendoguidesproject.storage import inMemoryHandoff
+
+    job_names = list(dict.fromkeys(job_names))
+    dependencies = jobDependencies(job_names, datasets)
+    logger.info(f"Running {job_names} in process, waiting for {dependencies}")
+
+    def after(name, futures):
+        for future in futures:
+            future.result()
+        logger.info(f"Executing job {name}")
+        run_job(name)
+
+    with inMemoryHandoff():
+        # Dependencies are always submitted first, so a job only waits for jobs that already hold a thread
+        with ThreadPoolExecutor(max_workers=len(job_names), thread_name_prefix="job") as pool:
+            futures = {}
+            for name in job_names:
+                # Every job runs in a context of its own, so its stage is a root and concurrent jobs don't nest
+                futures[name] = pool.submit(contextvars.Context().run, after, name, [futures[dependency] for dependency in dependencies[name]])
+            wait(futures.values())
+        for name, future in futures.items():
+            if future.exception() is not None:
+                raise RuntimeError(f"Job {name} failed") from future.exception()
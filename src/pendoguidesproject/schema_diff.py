@@ -0,0 +1,92 @@
+import hashlib
+import json
+import re
+
+VARCHAR = "character varying"
+
+# Glue/Spectrum type names as information_schema.columns reports them on the Redshift table
+EXTERNAL_TYPES = {
+    "string": VARCHAR,
+    "varchar": VARCHAR,
+    "char": "character",
+    "double": "double precision",
+    "float": "real",
+    "int": "integer",
+    "tinyint": "smallint",
+    "decimal": "numeric",
+    "timestamp": "timestamp without time zone",
+}
+
+
+def redshiftType(external_type: str) -> str:
+    """Maps an external column type, e.g. varchar(64) or decimal(10,2), onto its Redshift type."""
+    match = re.match(r"^\s*([a-z ]+?)\s*(\(.*\))?\s*$", external_type.lower())
+    if match is None:
+        return external_type
+    name, arguments = match.groups()
+    return EXTERNAL_TYPES.get(name, name) + (arguments.replace(" ", "") if arguments else "")
+
+
+def catalogType(data_type: str, length=None, precision=None, scale=None) -> str:
+    """Formats a row of information_schema.columns the way redshiftType formats external types."""
+    if data_type in (VARCHAR, "character") and length is not None:
+        return f"{data_type}({int(length)})"
+    if data_type == "numeric" and precision is not None:
+        return f"numeric({int(precision)},{int(scale or 0)})"
+    return data_type
+
+
+def splitType(column_type: str):
+    name, _, arguments = column_type.partition("(")
+    return name, arguments.rstrip(")")
+
+
+def fingerprint(columns: dict) -> str:
+    """Order-independent hash of a {column: type} schema."""
+    return hashlib.sha256(json.dumps(sorted(columns.items())).encode("utf8")).hexdigest()
+
+
+class SchemaDiff:
+    """
+    The DDL that aligns a Redshift table with its external table, both given as {column: Redshift type}.
+
+    VARCHAR columns whose length grows are widened in place, the only type change Redshift supports
+    with ALTER COLUMN. Any other type change has to drop and re-add the column.
+    """
+
+    def __init__(self, existing: dict, external: dict):
+        self.add = [(column, column_type) for column, column_type in external.items() if column not in existing]
+        self.remove = [column for column in existing if column not in external]
+        self.widen = []
+        self.replace = []
+        for column, column_type in external.items():
+            if column not in existing:
+                continue
+            change = self.compare(existing[column], column_type)
+            if change == "widen":
+                self.widen.append((column, column_type))
+            elif change == "replace":
+                self.replace.append((column, column_type))
+
+    @staticmethod
+    def compare(existing_type: str, external_type: str):
+        existing_name, existing_length = splitType(existing_type)
+        external_name, external_length = splitType(external_type)
+        if existing_name != external_name:
+            return "replace"
+        if existing_name == VARCHAR:
+            # A string without length fits whatever VARCHAR the table already has
+            if not external_length or external_length == existing_length:
+                return None
+            if not existing_length or int(external_length) < int(existing_length):
+                return None
+            return "widen"
+        if external_length and existing_length and external_length != existing_length:
+            return "replace"
+        return None
+
+    def is_empty(self) -> bool:
+        return not (self.add or self.remove or self.widen or self.replace)
+
+    def __repr__(self):
+        return f"SchemaDiff(add={self.add}, remove={self.remove}, widen={self.widen}, replace={self.replace})"
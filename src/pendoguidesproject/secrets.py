@@ -1,8 +1,21 @@
 import boto3
 import hvac
 import os
+import threading
+import time
+
+# Refetch secrets and re-authenticate this many seconds before their lease runs out
+EXPIRY_MARGIN = 30
+# Cache duration for secrets without a lease, e.g. KV version 2
+DEFAULT_TTL = 300
 
 class Secrets:
+    """
+    Vault client that authenticates once per token TTL and caches secrets for their lease duration.
+
+    The token is renewed in the background while it is renewable, so a long running job keeps using the
+    same token instead of logging in again through AWS IAM.
+    """
 
     __vaultClient = None
     config = None
@@ -10,31 +23,77 @@ class Secrets:
     def __init__(self):
         self.vaultClient = client = hvac.Client()
 
-    def __init__(self, config):
+    def __init__(self, config, renew=True, default_ttl=DEFAULT_TTL):
         self.config = config
         self.vaultClient = client = hvac.Client(config.vaultUrl)
+        self.renew = renew
+        self.default_ttl = default_ttl
+        self.token_expires = 0
+        self.secrets = {}
+        self.lock = threading.RLock()
+        self.renewal = None
 
     def __authenticate_vault(self):
-        if not self.vaultClient.is_authenticated():
+        with self.lock:
+            # A cached token is trusted until shortly before its TTL, is_authenticated() would cost a round trip
+            if self.vaultClient.token and time.time() < self.token_expires:
+                return
             print("Authenticating to Vault")
             session = boto3._get_default_session() # new for local setup
             credentials = session.get_credentials()
 
 
-            self.vaultClient.auth_aws_iam(
+            response = self.vaultClient.auth.aws.iam_login(
                 credentials.access_key
                 ,credentials.secret_key
                 ,credentials.token
                 ,mount_point=self.config.vaultAWSAuthMountPath
                 ,role=self.config.vaultAWSAuthRole
             )
+            self.__token_acquired(response["auth"])
+
+    def __token_acquired(self, auth):
+        self.token_expires = refresh_at(auth["lease_duration"])
+        if self.renew and auth.get("renewable") and auth["lease_duration"] > 0:
+            self.__schedule_renewal(auth["lease_duration"] * 2 / 3)
+
+    def __schedule_renewal(self, delay):
+        if self.renewal is not None:
+            self.renewal.cancel()
+        self.renewal = threading.Timer(delay, self.__renew_token)
+        self.renewal.daemon = True
+        self.renewal.start()
+
+    def __renew_token(self):
+        with self.lock:
+            try:
+                response = self.vaultClient.auth.token.renew_self()
+                self.__token_acquired(response["auth"])
+            except Exception as e:
+                # The next access logs in again
+                print(f"Renewing the Vault token failed: {e}")
+                self.token_expires = 0
+
+    def close(self):
+        if self.renewal is not None:
+            self.renewal.cancel()
+            self.renewal = None
 
     def get(self,name,engine="secret"):
+        path = engine+"/"+name
+        with self.lock:
+            cached = self.secrets.get(path)
+            if cached is not None and time.time() < cached[1]:
+                return cached[0]
+
         self.__authenticate_vault()
 
-        print("Trying to acquire lease on secret "+engine+"/"+name)
-        response = self.vaultClient.read(engine+"/"+name)
-        if "data" in response:
+        print("Trying to acquire lease on secret "+path)
+        response = self.vaultClient.read(path)
+        if response and "data" in response:
+            lease_duration = response.get("lease_duration") or self.default_ttl
+            with self.lock:
+                self.secrets[path] = (response["data"], refresh_at(lease_duration))
             return response["data"]
 
         return None
@@ -45,7 +104,11 @@ class Secrets:
         print("Trying to list secrets in "+engine+"/")
         response = self.vaultClient.list(engine)
 
-        if "data" in response:
+        if response and "data" in response:
             return response["data"]
 
         return None
+
+def refresh_at(lease_duration):
+    # Short leases keep two thirds of their duration instead of the full margin
+    return time.time() + lease_duration - min(EXPIRY_MARGIN, lease_duration / 3)
@@ -0,0 +1,323 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pendoguidesproject.dtypes import applyDtypes, concatCompact, memoryBytes, memoryReport
+from pendoguidesproject.metrics import count, inContext
+
+logger = logging.getLogger(__name__)
+
+# S3 requires every part but the last to be at least 5MB
+PART_SIZE = 8 * 1024 * 1024
+# Creating clients from boto3's default session is not thread safe
+session_lock = threading.Lock()
+# Set while jobs run in one process, see inMemoryHandoff
+handoff = None
+CHECKPOINT_WORKERS = 4
+
+
+class S3MultipartWriter:
+    """
+    Streams bytes into an S3 object through a multipart upload, holding at most one part in memory.
+    """
+
+    def __init__(self, bucket: str, key: str, part_size: int = PART_SIZE, s3_client=None, schema: pa.Schema = None):
+        self.s3 = s3_client or boto3.client("s3")
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = io.BytesIO()
+        self.upload_id = None
+        self.parts = []
+        self.rows = 0
+        self.header_written = False
+        self.parquet_writer = None
+        self.schema = schema
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data: bytes) -> None:
+        self.buffer.write(data)
+        if self.buffer.tell() >= self.part_size:
+            self.flush()
+
+    def write_csv(self, df: pd.DataFrame, index: bool = False) -> None:
+        """Appends a batch as CSV, writing the header once and continuing the row index across batches."""
+        if index:
+            df = df.copy()
+            df.index = pd.RangeIndex(self.rows, self.rows + len(df))
+        self.write(df.to_csv(index=index, header=not self.header_written).encode("utf8"))
+        self.header_written = True
+        self.rows += len(df)
+
+    def write_parquet(self, df: pd.DataFrame) -> None:
+        """
+        Appends a batch as a Parquet row group. Without a schema passed to the writer the first batch fixes it,
+        so a column that is only null in the first batch can't hold values later.
+        """
+        if self.parquet_writer is None:
+            schema = self.schema if self.schema is not None else pa.Schema.from_pandas(df, preserve_index=False)
+            self.parquet_writer = pq.ParquetWriter(PartSink(self), schema, compression="snappy")
+        table = pa.Table.from_pandas(df, schema=self.parquet_writer.schema, preserve_index=False)
+        self.parquet_writer.write_table(table)
+        self.rows += len(df)
+
+    def flush(self) -> None:
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=self.buffer.getvalue()
+        )
+        count("s3_bytes_written", self.buffer.tell())
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.buffer = io.BytesIO()
+
+    def close(self) -> None:
+        if self.parquet_writer is not None:
+            # Writes the Parquet footer into the buffer
+            self.parquet_writer.close()
+            self.parquet_writer = None
+        if self.upload_id is None:
+            # Everything fit in a single part, a plain put is cheaper
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=self.buffer.getvalue())
+            count("s3_bytes_written", self.buffer.tell())
+            return
+        if self.buffer.tell() > 0:
+            self.flush()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+        )
+        logger.info(f"Uploaded {self.rows} rows in {len(self.parts)} parts to s3://{self.bucket}/{self.key}")
+
+    def abort(self) -> None:
+        if self.upload_id is not None:
+            logger.warning(f"Aborting multipart upload to s3://{self.bucket}/{self.key}")
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class PartSink:
+    """File-like view of a S3MultipartWriter for pyarrow, closing it leaves the upload open."""
+
+    def __init__(self, writer: S3MultipartWriter):
+        self.writer = writer
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.writer.write(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class DatasetHandoff:
+    """
+    Hands the datasets one job writes to the jobs after it in the same process. Written frames are kept in memory
+    and read back without a copy, their S3 writes continue in the background as checkpoints.
+    """
+
+    def __init__(self, workers: int = CHECKPOINT_WORKERS):
+        self.frames = {}
+        self.pending = []
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="checkpoint")
+
+    def put(self, key, frame: pd.DataFrame, checkpoint) -> None:
+        with self.lock:
+            self.frames[key] = frame
+            self.pending.append(self.pool.submit(inContext(checkpoint)))
+
+    def get(self, key):
+        with self.lock:
+            return self.frames.get(key)
+
+    def dates(self, prefix: str):
+        with self.lock:
+            return {date for key_prefix, _, date in self.frames if key_prefix == prefix and date is not None}
+
+    def wait(self) -> None:
+        """Blocks until every checkpoint written so far is on S3, raising the error of a failed one."""
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    def close(self) -> None:
+        try:
+            self.wait()
+        finally:
+            self.pool.shutdown()
+
+
+@contextmanager
+def inMemoryHandoff(workers: int = CHECKPOINT_WORKERS):
+    """
+    Within the block datasets are handed between jobs in memory and checkpointed to S3 asynchronously, the block
+    only exits once every checkpoint is written. A frame must not be modified after it is written.
+    """
+    global handoff
+    handoff = DatasetHandoff(workers)
+    try:
+        yield handoff
+    finally:
+        current, handoff = handoff, None
+        current.close()
+
+
+def waitForCheckpoints() -> None:
+    """Waits for the asynchronous checkpoints of an in-process run, e.g. before moving a watermark past them."""
+    if handoff is not None:
+        handoff.wait()
+
+
+def get_bucket(env: str):
+    return 'cdo-datalake-prd' if env == 'prd' else 'cdo-datalake-dev-bphcob'
+
+
+def get_format(format: str = None) -> str:
+    return format or os.environ.get("storage_format", "parquet")
+
+
+def partitionPrefix(prefix: str, date: str = None) -> str:
+    return f"{prefix}/date_partition={date}" if date else prefix
+
+
+def partitionDates(values: pd.Series) -> pd.Series:
+    # Partition values come as dates, timestamps or strings, the day is always the first 10 characters
+    return values.astype(str).str[:10]
+
+
+def datasetKey(prefix: str, description: str, format: str = None, date: str = None) -> str:
+    return f"{partitionPrefix(prefix, date)}/{description}.{get_format(format)}"
+
+
+def writeDataset(dataset: pd.DataFrame, prefix: str, description: str, format: str = None, date: str = None) -> None:
+    """
+    Writes a dataset of the datalake, e.g. raw/pendoguides or clean/testdriveanalysis.
+
+    :param dataset: The dataframe to write
+    :param prefix: The zone and dataset the description belongs to
+    :param description: The name of the object within the dataset
+    :param format: parquet (typed, snappy compressed) or the legacy csv, defaults to --storage-format
+    :param date: Writes the date_partition=YYYY-MM-DD partition of the dataset instead of its single object
+    """
+    env = os.environ["environment"]
+    format = get_format(format)
+
+    def upload():
+        buffer = io.BytesIO()
+        if format == "parquet":
+            dataset.to_parquet(buffer, compression="snappy", index=False)
+        else:
+            buffer.write(dataset.to_csv(index=False).encode("utf8"))
+        with session_lock:
+            s3_resource = boto3.resource('s3')
+        s3_resource.Object(get_bucket(env), datasetKey(prefix, description, format, date)).put(Body=buffer.getvalue())
+        count("s3_bytes_written", buffer.tell())
+
+    if handoff is not None:
+        handoff.put((prefix, description, date), dataset, upload)
+    else:
+        upload()
+
+
+def writePartitions(dataset: pd.DataFrame, prefix: str, description: str, column: str = "date_partition", format: str = None):
+    """Splits a dataset on the day of its partition column and writes every day as its own partition."""
+    dates = partitionDates(dataset[column])
+    for date, partition in dataset.groupby(dates, sort=True):
+        writeDataset(partition, prefix, description, format, date)
+    return sorted(set(dates))
+
+
+def readDataset(prefix: str, description: str, columns=None, format: str = None, date: str = None) -> pd.DataFrame:
+    """
+    Reads a dataset of the datalake, only loading the given columns when a projection is passed.
+
+    :param prefix: The zone and dataset the description belongs to
+    :param description: The name of the object within the dataset
+    :param columns: The columns to read, all columns when None
+    :param format: parquet (typed, snappy compressed) or the legacy csv, defaults to --storage-format
+    :param date: Reads the date_partition=YYYY-MM-DD partition of the dataset instead of its single object
+    :return: The dataset
+    """
+    if handoff is not None:
+        frame = handoff.get((prefix, description, date))
+        if frame is not None:
+            return frame[columns] if columns is not None else frame.copy(deep=False)
+    env = os.environ["environment"]
+    format = get_format(format)
+    with session_lock:
+        s3_client = boto3.client('s3')
+    obj = s3_client.get_object(Bucket=get_bucket(env), Key=datasetKey(prefix, description, format, date))
+    body = io.BytesIO(obj['Body'].read())
+    count("s3_bytes_read", len(body.getbuffer()))
+    if format == "parquet":
+        return pd.read_parquet(body, columns=columns)
+    df = pd.read_csv(body, encoding='utf8', usecols=columns)
+    # Older runs wrote the pandas index along with the raw csv
+    return df.drop(columns=["Unnamed: 0"], errors="ignore")
+
+
+def listPartitions(prefix: str, start: str = None, end: str = None):
+    """Lists the dates of the date_partition=YYYY-MM-DD partitions of a dataset, optionally within [start, end]."""
+    env = os.environ["environment"]
+    with session_lock:
+        s3_client = boto3.client('s3')
+    paginator = s3_client.get_paginator("list_objects_v2")
+    dates = []
+    for page in paginator.paginate(Bucket=get_bucket(env), Prefix=f"{prefix}/date_partition=", Delimiter="/"):
+        for common_prefix in page.get("CommonPrefixes", []):
+            dates.append(common_prefix["Prefix"].rstrip("/").split("date_partition=")[-1])
+    if handoff is not None:
+        # Partitions written in this process may not be checkpointed yet
+        dates = set(dates) | handoff.dates(prefix)
+    return sorted(date for date in dates if (start is None or date >= start) and (end is None or date <= end))
+
+
+def readPartitions(prefix: str, description: str, start: str = None, end: str = None, columns=None, format: str = None,
+                   dtypes: dict = None) -> pd.DataFrame:
+    """
+    Reads the partitions of a dataset within [start, end], an open bound reads from the first or up to the last.
+    With a dtype plan every partition is compacted right after it is read, so the uncompacted dataset is never
+    held in memory at once.
+    """
+    partitions = []
+    raw_bytes = 0
+    for date in listPartitions(prefix, start, end):
+        partition = readDataset(prefix, description, columns, format, date)
+        if dtypes:
+            raw_bytes += memoryBytes(partition)
+            partition = applyDtypes(partition, dtypes)
+        partitions.append(partition)
+    if len(partitions) == 0:
+        # A range without partitions, e.g. a day without events, still has the columns and dtypes of the dataset
+        empty = pd.DataFrame(columns=columns)
+        return applyDtypes(empty, dtypes) if dtypes else empty
+    dataset = concatCompact(partitions, ignore_index=True)
+    if dtypes:
+        memoryReport(f"Read {len(partitions)} partitions of {prefix}", raw_bytes, dataset)
+    return dataset
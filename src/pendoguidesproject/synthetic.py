@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+
+from pendoguidesproject.transformations.activity import CAMPAIGN_NAME
+
+START = "2021-05-01"
+DAY_MS = 86400000
+
+
+def ids(prefix: str, count: int, codes) -> pd.Categorical:
+    # Building the strings once per distinct id keeps 10M event frames cheap to generate
+    return pd.Categorical.from_codes(codes, [f"{prefix}-{i:08x}" for i in range(count)])
+
+
+def guidesUsage(events: int = 10000, visitors: int = None, guides: int = 40, steps: int = 5, days: int = 7,
+                seed: int = 0, start: str = START) -> pd.DataFrame:
+    """
+    Seeded synthetic pendo.guides_usage events. Every guide session of a visitor walks through one or more
+    steps: a guideSeen, sometimes a guideActivity, then a guideAdvanced, or a guideDismissed on the step it
+    is abandoned at.
+
+    :param events: The number of events
+    :param visitors: The number of visitors, one per 50 events when None
+    :param guides: The number of guides
+    :param steps: The maximum number of steps of a guide session
+    :param days: The number of days the sessions start in, sessions late on the last day spill into the next
+    :param seed: The random seed, the same seed gives the same events
+    :param start: The first day
+    :return: The events with categorical ids, in no particular order like the Redshift table
+    """
+    rng = np.random.RandomState(seed)
+    visitors = visitors or max(events // 50, 1)
+    accounts = max(visitors // 20, 1)
+    # Every step emits two or three events, so this many steps always covers the events
+    total_steps = events // 2 + 1
+    lengths = rng.randint(1, steps + 1, size=total_steps)
+    lengths = lengths[:np.searchsorted(np.cumsum(lengths), total_steps) + 1]
+    sessions = len(lengths)
+
+    # Popular visitors and guides see more sessions
+    session_visitor = np.minimum(rng.zipf(1.3, size=sessions) - 1, visitors - 1)
+    session_visitor = rng.permutation(visitors)[session_visitor]
+    session_guide = np.minimum(rng.zipf(1.5, size=sessions) - 1, guides - 1)
+    session_start = pd.Timestamp(start, tz="UTC").value // 10**6 + rng.randint(0, days * DAY_MS, size=sessions)
+    session_dismissed = rng.rand(sessions) < 0.3
+
+    step_session = np.repeat(np.arange(sessions), lengths)
+    first_step = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    step_index = np.arange(len(step_session)) - first_step
+    dwell = rng.randint(1000, 120000, size=len(step_session))
+    # Steps follow each other, a step starts after the dwell times of the steps before it in its session
+    elapsed = np.cumsum(dwell) - dwell
+    step_start = session_start[step_session] + elapsed - elapsed[first_step]
+    step_last = step_index == lengths[step_session] - 1
+    step_events = 2 + (rng.rand(len(step_session)) < 0.3)
+
+    event_step = np.repeat(np.arange(len(step_session)), step_events)
+    position = np.arange(len(event_step)) - np.repeat(np.cumsum(step_events) - step_events, step_events)
+    closing = position == step_events[event_step] - 1
+    dismissed = closing & step_last[event_step] & session_dismissed[step_session[event_step]]
+    types = np.where(position == 0, 0, np.where(closing, np.where(dismissed, 2, 1), 3))
+    offset = np.where(position == 0, 0, np.where(closing, dwell[event_step], dwell[event_step] // 2))
+    browsertime = step_start[event_step] + offset
+
+    order = rng.permutation(len(event_step))[:events]
+    event_step = event_step[order]
+    session = step_session[event_step]
+    visitor = session_visitor[session]
+    guide = session_guide[session]
+    frame = pd.DataFrame({
+        "accountid": ids("account", accounts, visitor % accounts),
+        "guideid": ids("guide", guides, guide),
+        "visitorid": ids("visitor", visitors, visitor),
+        "guidestepid": ids("step", guides * steps, guide * steps + step_index[event_step]),
+        "type": pd.Categorical.from_codes(types[order], ["guideSeen", "guideAdvanced", "guideDismissed", "guideActivity"]),
+        "browsertime": browsertime[order].astype(np.int64),
+    })
+    frame["date_partition"] = pd.to_datetime(frame["browsertime"], unit="ms").dt.strftime("%Y-%m-%d")
+    return frame
+
+
+def testDriveTables(leads: int = 1000, seed: int = 0, start: str = START) -> dict:
+    """
+    Seeded synthetic side tables of clean, unprefixed and keyed by the source names of clean.ingestData:
+    the test-drive campaign with its members, their leads, contacts and accounts, the DGC users they
+    signed up as and their Pendo activity and usage.
+    """
+    rng = np.random.RandomState(seed)
+    start_ms = pd.Timestamp(start, tz="UTC").value // 10**6
+    people = [f"person-{i:08x}" for i in range(leads)]
+    uuids = [f"visitor-{i:08x}" for i in range(leads)]
+    accounts = [f"account-{i:08x}" for i in range(max(leads // 10, 1))]
+    is_lead = rng.rand(leads) < 0.6
+    matched = rng.choice(accounts, size=leads).astype(object)
+    matched[rng.rand(leads) < 0.1] = None
+
+    members = rng.rand(leads) < 0.8
+    campaign_names = np.where(rng.rand(leads) < 0.9, CAMPAIGN_NAME, "GBL-21-Q1-Webinar").astype(object)
+    signed_up = rng.rand(leads) < 0.9
+    activity_rows = leads * 5
+    activity_visitor = rng.randint(0, leads, size=activity_rows)
+    return {
+        "salesforcecampaign": pd.DataFrame({
+            "created_date": ["2021-01-01", "2021-01-02"],
+            "id": ["campaign-0", "campaign-1"],
+            "name": [CAMPAIGN_NAME, "GBL-21-Q1-Webinar"],
+            "start_date": ["2021-01-15", "2021-01-16"],
+            "type": ["Trial", "Webinar"],
+        }),
+        "salesforcecampaignmember": pd.DataFrame({
+            "id": [f"member-{i:08x}" for i in np.flatnonzero(members)],
+            "campaign_name_text": campaign_names[members],
+            "lead_or_contact_id": np.array(people, dtype=object)[members],
+            "email": [f"{person}@example.com" for person in np.array(people)[members]],
+        }),
+        "lead": pd.DataFrame({
+            "id": np.array(people, dtype=object)[is_lead],
+            "lean_data_reporting_matched_account_c": matched[is_lead],
+            "uuid_c": np.array(uuids, dtype=object)[is_lead],
+        }),
+        "contact": pd.DataFrame({
+            "id": np.array(people, dtype=object)[~is_lead],
+            "account_id": matched[~is_lead],
+            "uuid_c": np.array(uuids, dtype=object)[~is_lead],
+        }),
+        "account": pd.DataFrame({
+            "account_id_long_version__c": accounts,
+            "name": [f"Account {i}" for i in range(len(accounts))],
+            "industry": rng.choice(["Banking", "Pharma", "Retail", "Public"], size=len(accounts)),
+        }),
+        "dgc_users": pd.DataFrame({
+            "id": np.array(uuids, dtype=object)[signed_up],
+            "createdOn": start_ms + rng.randint(0, 30 * DAY_MS, size=int(signed_up.sum())),
+        }),
+        "pendo_activity": pd.DataFrame({
+            "visitorid": np.array(uuids, dtype=object)[activity_visitor],
+            "numminutes": rng.choice([0, 0, 1, 5, 30], size=activity_rows).astype(float),
+            "date": pd.to_datetime(start_ms + rng.randint(0, 30 * DAY_MS, size=activity_rows), unit="ms").strftime("%Y-%m-%d"),
+        }),
+        "pendo_usage": pd.DataFrame({
+            "visitorid": np.array(uuids, dtype=object)[activity_visitor],
+            "parameter": [f"asset-{i:04x}" for i in rng.randint(0, 100, size=activity_rows)],
+        }),
+        "assets": pd.DataFrame({"asset_id": [f"asset-{i:04x}" for i in range(100)], "name": [f"Asset {i}" for i in range(100)]}),
+        "groups": pd.DataFrame({"id": ["group-0", "group-1"], "name": ["Test drive", "Internal"]}),
+    }
@@ -0,0 +1,89 @@
+import pandas as pd
+
+CAMPAIGN_NAME = "GBL-21-Q1-TDR-Test-Drive"
+# The columns createActivityData uses of each Salesforce source
+SALESFORCE_COLUMNS = {
+    "salesforcecampaign": ["created_date", "id", "name", "start_date", "type"],
+    "lead": ["id", "lean_data_reporting_matched_account_c", "uuid_c"],
+    "contact": ["id", "account_id", "uuid_c"],
+}
+
+
+def cleanCampaign(salesforcecampaign):
+    # Campaign is only filtered on test-drive, so this info is not useful
+    salesforcecampaign = salesforcecampaign[["sfc_created_date", "sfc_id", "sfc_name", "sfc_start_date", "sfc_type"]]
+    return salesforcecampaign
+
+
+def joinTestDriveLeads(salesforcecampaign, salesforcecampaignmember, lead, contact, account):
+    """
+    The pandas join graph of the test-drive leads: campaign, its members, the lead or contact behind
+    each member and the account matched to it. The frames carry the prefixes of enhanceReadability.
+    """
+    salesforcecampaign = cleanCampaign(salesforcecampaign)
+    # Merge lead and contact
+    lead = lead[["lead_id", "lead_lean_data_reporting_matched_account_c", "lead_uuid_c"]]
+    contact = contact[["ctct_id", "ctct_account_id", "ctct_uuid_c"]]
+    contact.columns = ["lead_id", "lead_lean_data_reporting_matched_account_c", "lead_uuid_c"]
+    lead = pd.concat([lead, contact], axis=0)
+    # Merge campaign and campaignmember data
+    new = pd.merge(salesforcecampaign, salesforcecampaignmember, left_on="sfc_name", right_on="sfcm_campaign_name_text", how="inner")
+    # Merge lead/contact with campaignmember
+    new = pd.merge(new, lead, left_on="sfcm_lead_or_contact_id", right_on="lead_id", how="inner")
+    # Merge with account
+    return pd.merge(account, new, left_on="acc_account_id_long_version__c", right_on="lead_lean_data_reporting_matched_account_c", how="right")
+
+
+def joinActivity(new, dgc_users, pendo_activity):
+    """
+    Joins the test-drive leads to the DGC users they signed up as, then to their Pendo activity.
+
+    :return: The leads with a DGC user and the leads with their activity rows, leads without activity keep one row
+    """
+    # Merge with dgc users
+    completeLeft = pd.merge(new, dgc_users, left_on="lead_uuid_c", right_on="usr_id", how="inner")
+    # Merge with activity data
+    activity = pd.merge(completeLeft, pendo_activity, left_on="usr_id", right_on="pa_visitorid", how="left")
+    return completeLeft, activity
+
+
+def testDriveLeadsQuery(member_columns, account_columns) -> str:
+    """
+    Compiles joinTestDriveLeads into one query, returning the same prefixed columns in the same order.
+
+    pd.merge matches missing keys with each other, so every join condition is NULL-safe.
+
+    :param member_columns: The columns of salesforce.campaign_member
+    :param account_columns: The columns of salesforce.account to select
+    """
+    lead, contact = SALESFORCE_COLUMNS["lead"], SALESFORCE_COLUMNS["contact"]
+    projection = ",\n    ".join(
+        [f'a.{quote(column)} as {quote("acc_" + column)}' for column in account_columns]
+        + [f'c.{quote(column)} as {quote("sfc_" + column)}' for column in SALESFORCE_COLUMNS["salesforcecampaign"]]
+        + [f'm.{quote(column)} as {quote("sfcm_" + column)}' for column in member_columns]
+        + [f'l.{quote(column)} as {quote("lead_" + column)}' for column in lead]
+    )
+    return f"""with campaign as (
+    select {", ".join(map(quote, SALESFORCE_COLUMNS["salesforcecampaign"]))} from salesforce.campaign where name = '{CAMPAIGN_NAME}'
+), member as (
+    select * from salesforce.campaign_member where campaign_name_text = '{CAMPAIGN_NAME}'
+), leads as (
+    select {", ".join(map(quote, lead))} from salesforce.lead
+    union all
+    select {", ".join(f"{quote(c)} as {quote(l)}" for c, l in zip(contact, lead))} from salesforce.contact
+)
+select
+    {projection}
+from campaign c
+join member m on {nullSafeEquals("c", "name", "m", "campaign_name_text")}
+join leads l on {nullSafeEquals("m", "lead_or_contact_id", "l", "id")}
+left join salesforce.account a on {nullSafeEquals("a", "account_id_long_version__c", "l", "lean_data_reporting_matched_account_c")}"""
+
+
+def quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+def nullSafeEquals(left, left_column, right, right_column) -> str:
+    left, right = f"{left}.{quote(left_column)}", f"{right}.{quote(right_column)}"
+    return f"({left} = {right} or ({left} is null and {right} is null))"
@@ -0,0 +1,220 @@
+import numpy as np
+import pandas as pd
+
+from pendoguidesproject.transformations.timestamp_index import TimestampIndex
+
+OUTPUT_COLUMNS = ["account id", "guideid", "visitorid", "guidestepid", "time on guide", "date_partition"]
+GUIDE_KEYS = ["guideid", "visitorid"]
+STEP_KEYS = ["guideid", "visitorid", "guidestepid"]
+GUIDE_STATE_COLUMNS = GUIDE_KEYS + ["last_seen"]
+STEP_STATE_COLUMNS = STEP_KEYS + ["last_seen", "last_advance", "total", "open_date"]
+
+
+class SessionState:
+    """
+    Open-session state carried between incremental runs: the last guideSeen per (guide, visitor), and the
+    last guideSeen, last guideAdvanced and running time on guide per (guide, visitor, step). open_date is the
+    partition of a step's last paired advance when no guideSeen preceded it, a later advance supersedes it.
+    """
+
+    def __init__(self, guides: pd.DataFrame = None, steps: pd.DataFrame = None):
+        self.guides = guides if guides is not None else emptyState(GUIDE_STATE_COLUMNS)
+        self.steps = steps if steps is not None else emptyState(STEP_STATE_COLUMNS)
+        if "open_date" not in self.steps.columns:
+            # State written before open_date was tracked
+            self.steps = self.steps.assign(open_date=None)
+
+    def advance(self, events, advanced):
+        """Folds a run's events and paired advances into the state of the next run."""
+        seen = events[events["type"] == "guideSeen"]
+        guides = seen.groupby(GUIDE_KEYS, observed=True)["browsertime"].max().rename("last_seen").reset_index()
+        guides = concatState(self.guides, guides).groupby(GUIDE_KEYS, observed=True)["last_seen"].max().reset_index()
+
+        events = events.dropna(subset=["guidestepid"])
+        steps = pd.concat([
+            events[events["type"] == "guideSeen"].groupby(STEP_KEYS, observed=True)["browsertime"].max().rename("last_seen"),
+            events[events["type"] == "guideAdvanced"].groupby(STEP_KEYS, observed=True)["browsertime"].max().rename("last_advance"),
+            advanced.groupby(STEP_KEYS, observed=True)["time on guide"].last().rename("total"),
+            # An empty string closes the open advance of a step that advanced again, "last" would skip a null
+            openAdvances(events, advanced).set_index(STEP_KEYS)["open_date"].fillna(""),
+        ], axis=1)
+        steps.index.names = STEP_KEYS
+        # The running time on guide of this run already includes the previous total
+        steps = concatState(self.steps, steps.reset_index()).groupby(STEP_KEYS, observed=True).agg(
+            last_seen=("last_seen", "max"), last_advance=("last_advance", "max"), total=("total", "last"),
+            open_date=("open_date", "last"),
+        ).reset_index()
+        # replace("", None) forward-fills on pandas < 1.4, mask sets the closed advances to null
+        steps["open_date"] = steps["open_date"].mask(steps["open_date"] == "", None)
+        return SessionState(guides[GUIDE_STATE_COLUMNS], steps[STEP_STATE_COLUMNS])
+
+
+def openAdvances(events, advanced):
+    """
+    The partition date of the last paired advance of every step that advanced in a run, when no guideSeen
+    preceded it. A full recompute only keeps such an advance while it is the last advance of its step.
+    """
+    stepped = events.loc[events["type"] == "guideAdvanced", STEP_KEYS].drop_duplicates()
+    last = advanced.drop_duplicates(subset=STEP_KEYS, keep="last")
+    # Without an earlier seen the advance is paired with itself
+    unseen = last[last["seen_time"] == last["browsertime"]]
+    return pd.merge(stepped, unseen[STEP_KEYS].assign(open_date=unseen["date_partition"].astype(str)), on=STEP_KEYS, how="left")
+
+
+def closedAdvances(state: SessionState, pendoguidesdata):
+    """
+    The advances without a guideSeen that earlier runs wrote and an advance of the same step in the new
+    events supersedes. A full recompute no longer keeps them, so incremental runs remove them again.
+
+    :return: The step keys and the open_date partition of the superseded advances
+    """
+    open_steps = state.steps.dropna(subset=["open_date"])
+    advances = pendoguidesdata.loc[pendoguidesdata["type"] == "guideAdvanced"].dropna(subset=STEP_KEYS + ["browsertime"])
+    closed = pd.merge(textKeys(open_steps), textKeys(advances[STEP_KEYS]).drop_duplicates(), on=STEP_KEYS)
+    return closed[STEP_KEYS + ["open_date"]]
+
+
+def withoutClosedAdvances(output, closed):
+    """Drops the superseded advances of closedAdvances from output rows written by an earlier run."""
+    rows = textKeys(output[STEP_KEYS]).assign(date_partition=output["date_partition"].astype(str).to_numpy())
+    superseded = closed.rename(columns={"open_date": "date_partition"}).drop_duplicates()
+    matched = pd.merge(rows, superseded, on=STEP_KEYS + ["date_partition"], how="left", indicator=True)["_merge"] == "both"
+    return output[~matched.to_numpy()]
+
+
+def textKeys(frame):
+    # Keys read back from a dataset may be categorical or object, compare them as strings
+    return frame.astype({key: str for key in STEP_KEYS})
+
+
+def emptyState(columns):
+    state = pd.DataFrame(columns=columns)
+    return state.astype({column: "float64" for column in ["last_seen", "last_advance", "total"] if column in columns})
+
+
+def concatState(previous, current):
+    if len(previous) == 0:
+        return current
+    return pd.concat([previous, current], ignore_index=True)
+
+
+def sessionize(pendoguidesdata):
+    """Pairs guide events with the guideSeen that opened them, sorting the events only once.
+
+    Dismissals are paired with the latest earlier guideSeen of the same (guide, visitor), advances
+    with the latest earlier guideSeen of the same (guide, visitor, step). Only the first advance
+    after a seen counts, and the time on guide of a step accumulates over its advances.
+
+    :param pendoguidesdata: The raw pendo.guides_usage events
+    :return: A dataframe with [account id, guide id, visitor id, step id, time on guide, date partition]
+    """
+    output, _ = sessionizeIncremental(pendoguidesdata)
+    return output
+
+
+def sessionizeIncremental(pendoguidesdata, state: SessionState = None):
+    """
+    Sessionizes only the new events, continuing the sessions left open in the state of the previous run.
+
+    :param pendoguidesdata: The raw pendo.guides_usage events since the previous run
+    :param state: The state of the previous run, None to start from scratch
+    :return: The sessionize output rows of the new events and the state for the next run
+    """
+    state = state or SessionState()
+    events = pendoguidesdata.dropna(subset=GUIDE_KEYS + ["browsertime"]).reset_index(drop=True)
+    if len(events) == 0:
+        # Nothing to pair, and the merges can't match the dtypes of an untyped empty frame
+        return pd.DataFrame(columns=OUTPUT_COLUMNS), state
+    events["event_order"] = np.arange(len(events))
+
+    dismissed = pairDismissed(events, state)
+    advanced = pairAdvanced(events, state)
+
+    output = pd.concat([dismissed, advanced], ignore_index=True)
+    output = output.sort_values(["event_order"], kind="mergesort").reset_index(drop=True)
+    return output[OUTPUT_COLUMNS], state.advance(events, advanced)
+
+
+def pairDismissed(events, state):
+    seen = eventTimes(events, "guideSeen", GUIDE_KEYS, "seen_time")
+    if len(state.guides) > 0:
+        prior = state.guides.rename(columns={"last_seen": "seen_time"}).astype({"seen_time": np.int64})
+        seen = pd.concat([prior, seen.astype({"seen_time": np.int64})], ignore_index=True).sort_values("seen_time")
+    dismissed = events.loc[events["type"] == "guideDismissed", GUIDE_KEYS + ["browsertime", "event_order"]]
+    # Latest seen strictly before the dismissal, the dismissal itself when there is none
+    paired = pd.merge_asof(
+        dismissed.sort_values("browsertime"), seen, left_on="browsertime", right_on="seen_time",
+        by=GUIDE_KEYS, allow_exact_matches=False, direction="backward",
+    )
+    paired["seen_time"] = paired["seen_time"].fillna(paired["browsertime"])
+    # Step and account are taken from the first event of the guide and visitor at that browsertime
+    paired = pd.merge(paired, firstEventAt(events, GUIDE_KEYS), on=GUIDE_KEYS + ["browsertime"], how="left")
+    paired["time on guide"] = (paired["browsertime"] - paired["seen_time"]) / 1000
+    paired["date_partition"] = pd.to_datetime(paired["browsertime"], unit="ms")
+    return paired.rename(columns={"accountid": "account id"})
+
+
+def pairAdvanced(events, state):
+    events = events.dropna(subset=["guidestepid"])
+    seen = stepIndex(events, "guideSeen", state.steps, "last_seen")
+    advances = stepIndex(events, "guideAdvanced", state.steps, "last_advance")
+    paired = events.loc[events["type"] == "guideAdvanced", STEP_KEYS + ["browsertime", "event_order"]].copy()
+    # Latest seen strictly before the advance, the advance itself when there is none
+    paired["seen_time"] = seen.latestBefore(paired, paired["browsertime"])
+    # Earliest advance strictly after that seen, the last advance of the step when there is none
+    paired["next_advance"] = advances.earliestAfter(paired, paired["seen_time"])
+    # Only the first advance following a seen closes a session
+    paired = paired[paired["next_advance"] == paired["browsertime"]].copy()
+    paired["duration"] = (paired["browsertime"] - paired["seen_time"]) / 1000
+    # Time on guide keeps accumulating from where the previous run left the step, adding in the same order
+    # as a full recompute would
+    paired = pd.merge(paired, state.steps[STEP_KEYS + ["total"]], on=STEP_KEYS, how="left")
+    first = ~paired.duplicated(subset=STEP_KEYS)
+    paired.loc[first, "duration"] = paired.loc[first, "total"].fillna(0) + paired.loc[first, "duration"]
+    paired["time on guide"] = paired.groupby(STEP_KEYS, observed=True)["duration"].cumsum()
+    paired = pd.merge(paired, firstEventAt(events, STEP_KEYS), on=STEP_KEYS + ["browsertime"], how="left")
+    return paired.rename(columns={"accountid": "account id"})
+
+
+def stepIndex(events, event_type, steps, column):
+    selected = events.loc[events["type"] == event_type, STEP_KEYS + ["browsertime"]]
+    prior = steps.dropna(subset=[column])
+    keys = pd.concat([prior[STEP_KEYS], selected[STEP_KEYS]], ignore_index=True)
+    times = np.concatenate([prior[column].to_numpy(dtype=np.int64), selected["browsertime"].to_numpy(dtype=np.int64)])
+    return TimestampIndex(keys, times)
+
+
+def eventTimes(events, event_type, keys, name):
+    selected = events.loc[events["type"] == event_type, keys + ["browsertime"]]
+    return selected.rename(columns={"browsertime": name}).sort_values(name)
+
+
+def firstEventAt(events, keys):
+    columns = [column for column in ["guidestepid", "accountid", "date_partition"] if column not in keys]
+    first = events.drop_duplicates(subset=keys + ["browsertime"], keep="first")
+    return first[keys + ["browsertime"] + columns]
+
+
+def verifyIncremental(pendoguidesdata, dates):
+    """
+    Replays the given partition dates one incremental run at a time and compares the output of every run
+    with a full recompute of all events up to that date.
+
+    :param pendoguidesdata: The raw pendo.guides_usage events, e.g. a sample of visitors
+    :param dates: The YYYY-MM-DD partitions to replay incrementally, in order
+    :return: The dates whose incremental output differs from the full recompute
+    """
+    days = pendoguidesdata["date_partition"].astype(str).str[:10]
+    _, state = sessionizeIncremental(pendoguidesdata[days < dates[0]])
+    mismatches = []
+    for date in dates:
+        incremental, state = sessionizeIncremental(pendoguidesdata[days == date], state)
+        full = sessionize(pendoguidesdata[days <= date])
+        full = full[full["date_partition"].astype(str).str[:10] == date]
+        if not comparable(incremental).equals(comparable(full)):
+            mismatches.append(date)
+    return mismatches
+
+
+def comparable(output):
+    return output.astype({"date_partition": str}).reset_index(drop=True)
@@ -0,0 +1,59 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from pendoguidesproject.transformations.sessionize import OUTPUT_COLUMNS, SessionState, sessionizeIncremental
+
+
+def shardIds(values: pd.Series, shards: int) -> np.ndarray:
+    """The shard of every row by the hash of its value, categoricals only hash their categories."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Code -1 is a missing value, sessionize drops the events without a visitor anyway
+        categories = pd.Series(list(values.cat.categories.astype(str)) + ["nan"])
+        hashes = pd.util.hash_pandas_object(categories, index=False).to_numpy()[values.cat.codes.to_numpy()]
+    else:
+        hashes = pd.util.hash_pandas_object(values.astype(str), index=False).to_numpy()
+    return hashes % shards
+
+
+def shardByVisitor(pendoguidesdata, shards: int):
+    """Hash-partitions the events on visitorid, every visitor's events end up in exactly one shard."""
+    shard_ids = shardIds(pendoguidesdata["visitorid"], shards)
+    return [pendoguidesdata[shard_ids == shard] for shard in range(shards)]
+
+
+def sessionizeFrames(frames):
+    events, guides, steps = frames
+    return sessionizeIncremental(events, SessionState(guides, steps))
+
+
+def sessionizeSharded(pendoguidesdata, workers: int = 1):
+    """
+    Runs sessionize on visitor shards in a process pool. The workers are spawned, not forked: the in-process
+    runner has job, checkpoint and boto3 threads whose locks a forked child would inherit held. Every worker
+    receives its own shard, pickled, instead of the whole frame.
+
+    :param pendoguidesdata: The raw pendo.guides_usage events
+    :param workers: The number of worker processes
+    :return: The sessionize output of all shards, concatenated in shard order
+    """
+    output, _ = sessionizeIncrementalSharded(pendoguidesdata, workers=workers)
+    return output
+
+
+def sessionizeIncrementalSharded(pendoguidesdata, state: SessionState = None, workers: int = 1):
+    """Runs sessionizeIncremental on visitor shards of both the events and the state of the previous run."""
+    if workers <= 1:
+        return sessionizeIncremental(pendoguidesdata, state)
+
+    state = state or SessionState()
+    shards = zip(*(shardByVisitor(frame, workers) for frame in [pendoguidesdata, state.guides, state.steps]))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = list(pool.map(sessionizeFrames, shards))
+
+    output = pd.concat([output for output, _ in results], ignore_index=True)[OUTPUT_COLUMNS]
+    guides = pd.concat([shard_state.guides for _, shard_state in results], ignore_index=True)
+    steps = pd.concat([shard_state.steps for _, shard_state in results], ignore_index=True)
+    return output, SessionState(guides, steps)
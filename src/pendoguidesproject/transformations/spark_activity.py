@@ -0,0 +1,90 @@
+from pyspark.sql import functions as F
+
+from pendoguidesproject.transformations.status import DEFAULT_STATUS, STATUS_RULES
+
+DAY_MS = 86400000
+# The row number of each DGC user in its extract, pandas takes the signup of the first one matching a lead
+USER_ORDER = "_usr_row"
+
+
+def merge(left, right, left_on: str, right_on: str = None, how: str = "inner"):
+    """
+    pd.merge as a Spark join: missing keys match each other like in pandas, the columns of the left side come
+    before the columns of the right side and a key both sides share by name is kept once.
+    """
+    if right_on is None or right_on == left_on:
+        shared = f"_right_{left_on}"
+        right = right.withColumnRenamed(left_on, shared)
+        joined = left.join(right, left[left_on].eqNullSafe(right[shared]), how)
+        return joined.select(*[left[column] for column in left.columns], *[right[column] for column in right.columns if column != shared])
+    joined = left.join(right, left[left_on].eqNullSafe(right[right_on]), how)
+    return joined.select(*[left[column] for column in left.columns], *[right[column] for column in right.columns])
+
+
+def joinTestDriveLeadsSpark(salesforcecampaign, salesforcecampaignmember, lead, contact, account):
+    """joinTestDriveLeads on Spark DataFrames with the prefixes of enhanceReadability."""
+    salesforcecampaign = salesforcecampaign.select("sfc_created_date", "sfc_id", "sfc_name", "sfc_start_date", "sfc_type")
+    # Merge lead and contact
+    lead = lead.select("lead_id", "lead_lean_data_reporting_matched_account_c", "lead_uuid_c")
+    contact = contact.select(
+        F.col("ctct_id").alias("lead_id"),
+        F.col("ctct_account_id").alias("lead_lean_data_reporting_matched_account_c"),
+        F.col("ctct_uuid_c").alias("lead_uuid_c"),
+    )
+    lead = lead.unionByName(contact)
+    # Merge campaign and campaignmember data
+    new = merge(salesforcecampaign, salesforcecampaignmember, "sfc_name", "sfcm_campaign_name_text")
+    # Merge lead/contact with campaignmember
+    new = merge(new, lead, "sfcm_lead_or_contact_id", "lead_id")
+    # Merge with account
+    return merge(account, new, "acc_account_id_long_version__c", "lead_lean_data_reporting_matched_account_c", how="right")
+
+
+def joinActivitySpark(new, dgc_users, pendo_activity):
+    """
+    joinActivity on Spark DataFrames, returns the leads with a DGC user and the leads with their activity rows.
+    The activity rows carry the USER_ORDER of their DGC user for personalisedStatusSpark.
+
+    :param dgc_users: The DGC users in the order of their extract
+    """
+    dgc_users = dgc_users.withColumn(USER_ORDER, F.monotonically_increasing_id())
+    completeLeft = merge(new, dgc_users, "lead_uuid_c", "usr_id")
+    activity = merge(completeLeft, pendo_activity, "usr_id", "pa_visitorid", how="left")
+    return completeLeft.drop(USER_ORDER), activity
+
+
+def joinUsageSpark(completeLeft, pendo_usage, assets, status):
+    """The usage merges of clean.createUsageData on Spark DataFrames."""
+    usage = merge(completeLeft, pendo_usage, "usr_id", "pu_visitorid")
+    usage = merge(usage, assets, "pu_parameter", "as_asset_id", how="left")
+    return merge(usage, status, "lead_uuid_c", how="left")
+
+
+def personalisedStatusSpark(activity, as_of, rules=STATUS_RULES, default: str = DEFAULT_STATUS):
+    """
+    personalisedStatus as one aggregation per lead. Like pandas, a lead with several DGC users of the same id
+    counts its days from the signup of the first of them, the one on its first activity row.
+
+    :param activity: The activity rows of joinActivitySpark with usr_createdOn (epoch milliseconds), lead_uuid_c,
+        pa_numminutes and USER_ORDER
+    :param as_of: The pd.Timestamp the days since signup are counted up to
+    :return: lead_uuid_c and act_status, one row per lead
+    """
+    leads = activity.groupBy("lead_uuid_c").agg(
+        F.sum(F.coalesce(F.col("pa_numminutes").cast("double"), F.lit(0.0))).alias("total"),
+        F.expr(f"min_by(usr_createdOn, {USER_ORDER})").alias("created_on"),
+    )
+    # Leads without an id get no total
+    total = F.when(F.col("lead_uuid_c").isNotNull(), F.col("total"))
+    # Whole days, floored like Timedelta.days, null for a missing signup
+    days = F.floor((F.lit(as_of.value // 10**6) - F.col("created_on")) / DAY_MS)
+    usage = {"none": total == 0, "used": total > 0, "unused": ~F.coalesce(total > 0, F.lit(False))}
+    status = F.lit(default)
+    for rule in reversed(rules):
+        condition = usage[rule.usage]
+        if rule.min_days is not None:
+            condition = condition & (days >= rule.min_days)
+        if rule.max_days is not None:
+            condition = condition & (days < rule.max_days)
+        status = F.when(condition, rule.label).otherwise(status)
+    return leads.select("lead_uuid_c", status.alias("act_status"))
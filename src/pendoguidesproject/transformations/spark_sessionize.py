@@ -0,0 +1,79 @@
+from pyspark.sql import Window
+from pyspark.sql import functions as F
+
+from pendoguidesproject.common.spark import ORDER_COLUMNS
+from pendoguidesproject.transformations.sessionize import GUIDE_KEYS, OUTPUT_COLUMNS, STEP_KEYS
+
+
+def sessionizeSpark(events, order=ORDER_COLUMNS):
+    """
+    sessionize as Spark window functions, the events of a (guide, visitor) or (guide, visitor, step) are
+    paired within their own window partition, so no executor needs the whole history.
+
+    :param events: The raw pendo.guides_usage events as a Spark DataFrame
+    :param order: The columns giving the order of the events, ties in browsertime are broken by it
+    :return: The sessionize output columns, sorted like sessionize sorts them
+    """
+    events = events.dropna(subset=GUIDE_KEYS + ["browsertime"])
+    output = pairDismissedSpark(events, order).unionByName(pairAdvancedSpark(events, order))
+    return output.orderBy(*order).select(*OUTPUT_COLUMNS)
+
+
+def pairDismissedSpark(events, order):
+    before = Window.partitionBy(*GUIDE_KEYS).orderBy("browsertime").rangeBetween(Window.unboundedPreceding, -1)
+    at = firstEventWindow(GUIDE_KEYS, order)
+    paired = events.select(
+        *GUIDE_KEYS, "browsertime", "type", *order,
+        # Latest seen strictly before the dismissal, the dismissal itself when there is none
+        F.coalesce(F.max(timeOf("guideSeen")).over(before), F.col("browsertime")).alias("seen_time"),
+        # Step and account are taken from the first event of the guide and visitor at that browsertime
+        F.first("guidestepid").over(at).alias("guidestepid"),
+        F.first("accountid").over(at).alias("account id"),
+    )
+    paired = paired.filter(F.col("type") == "guideDismissed")
+    return paired.select(
+        "account id", *GUIDE_KEYS, "guidestepid",
+        ((F.col("browsertime") - F.col("seen_time")) / 1000).alias("time on guide"),
+        timestampText(F.col("browsertime")).alias("date_partition"),
+        *order,
+    )
+
+
+def pairAdvancedSpark(events, order):
+    events = events.dropna(subset=["guidestepid"])
+    before = Window.partitionBy(*STEP_KEYS).orderBy("browsertime").rangeBetween(Window.unboundedPreceding, -1)
+    at = firstEventWindow(STEP_KEYS, order)
+    paired = events.select(
+        *STEP_KEYS, "browsertime", "type", *order,
+        F.max(timeOf("guideSeen")).over(before).alias("seen_time"),
+        F.max(timeOf("guideAdvanced")).over(before).alias("previous_advance"),
+        F.max(timeOf("guideAdvanced")).over(Window.partitionBy(*STEP_KEYS)).alias("last_advance"),
+        F.first("accountid").over(at).alias("account id"),
+        F.first("date_partition").over(at).cast("string").alias("date_partition"),
+    )
+    # Only the first advance following a seen closes a session, without a seen only the last advance of the step
+    first = F.when(F.col("seen_time").isNull(), F.col("browsertime") == F.col("last_advance")).otherwise(
+        F.col("previous_advance").isNull() | (F.col("previous_advance") <= F.col("seen_time"))
+    )
+    paired = paired.filter((F.col("type") == "guideAdvanced") & first)
+    duration = (F.col("browsertime") - F.coalesce(F.col("seen_time"), F.col("browsertime"))) / 1000
+    # Time on guide accumulates over the advances of a step in event order
+    running = Window.partitionBy(*STEP_KEYS).orderBy(*order).rowsBetween(Window.unboundedPreceding, Window.currentRow)
+    return paired.select(
+        "account id", *STEP_KEYS, F.sum(duration).over(running).alias("time on guide"), "date_partition", *order,
+    )
+
+
+def timeOf(event_type):
+    return F.when(F.col("type") == event_type, F.col("browsertime"))
+
+
+def firstEventWindow(keys, order):
+    return Window.partitionBy(*keys, "browsertime").orderBy(*order)
+
+
+def timestampText(millis):
+    # str() of the pd.Timestamp sessionize gives dismissals: milliseconds are only shown when there are any
+    seconds = F.from_unixtime(F.floor(millis / 1000), "yyyy-MM-dd HH:mm:ss")
+    fraction = F.pmod(millis, F.lit(1000))
+    return F.when(fraction == 0, seconds).otherwise(F.concat(seconds, F.lit("."), F.lpad(fraction.cast("string"), 3, "0"), F.lit("000")))
@@ -0,0 +1,68 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# A lead gets the label of the first rule it matches. usage is "none" (0 minutes), "used" (more than 0 minutes)
+# or "unused" (not more than 0 minutes, including leads without activity). Days since signup are within
+# [min_days, max_days), None leaves a bound open.
+StatusRule = namedtuple("StatusRule", ["label", "usage", "min_days", "max_days"])
+
+STATUS_RULES = [
+    StatusRule("Wasted test-drive (not logged in after a week)", "none", 8, None),
+    StatusRule("Test-drive period is over and was used", "used", 7, None),
+    StatusRule("Test-drive in progress", "used", None, 7),
+    StatusRule("At very high risk (not logged in after 72 hours)", "unused", 3, None),
+    StatusRule("At high risk (not logged in after 48 hours)", "unused", 2, None),
+    StatusRule("At risk (not logged in after 24 hours)", "unused", 1, None),
+    StatusRule("Registered less than 24 hours ago and no usage", "unused", 0, 1),
+]
+DEFAULT_STATUS = "Problem"
+
+
+def asOf(date: str = None) -> pd.Timestamp:
+    """The moment statuses are computed at: the end of the run date, or now without one."""
+    if date is None:
+        return pd.Timestamp.now(tz="UTC")
+    return pd.Timestamp(date, tz="UTC") + pd.Timedelta(days=1)
+
+
+def personalisedStatus(activity: pd.DataFrame, as_of: pd.Timestamp = None, rules=STATUS_RULES, default: str = DEFAULT_STATUS):
+    """
+    Classifies every test-drive lead by its total Pendo minutes and the whole days since it signed up.
+
+    :param activity: The activity rows with usr_createdOn (epoch milliseconds), lead_uuid_c and pa_numminutes
+    :param as_of: The moment the days since signup are counted up to, now when None
+    :param rules: The StatusRules, evaluated in order
+    :param default: The label of leads matching no rule
+    :return: lead_uuid_c and act_status, one row per lead in order of first appearance
+    """
+    as_of = asOf() if as_of is None else as_of
+    # One code per lead in order of first appearance, rows without a lead id share the last code
+    codes, uniques = pd.factorize(activity["lead_uuid_c"])
+    codes = np.where(codes < 0, len(uniques), codes)
+    groups = len(uniques) + 1
+    first = np.full(groups, len(codes))
+    np.minimum.at(first, codes, np.arange(len(codes)))
+    present = np.flatnonzero(first < len(codes))
+    rows = np.sort(first[present])
+    # Get total usage per user, leads without an id get no total
+    minutes = activity["pa_numminutes"].to_numpy(dtype=float)
+    totals = np.bincount(codes, weights=np.nan_to_num(minutes), minlength=groups)
+    totals[len(uniques)] = np.nan
+    total = totals[codes[rows]]
+    start = pd.to_datetime(activity["usr_createdOn"].iloc[rows], unit="ms", utc=True)
+    # Whole days, floored like Timedelta.days, NaN for a missing signup
+    days = ((as_of - start) // pd.Timedelta(days=1)).to_numpy(dtype=float)
+
+    usage = {"none": total == 0, "used": total > 0, "unused": ~(total > 0)}
+    conditions = []
+    for rule in rules:
+        condition = usage[rule.usage].copy()
+        if rule.min_days is not None:
+            condition &= days >= rule.min_days
+        if rule.max_days is not None:
+            condition &= days < rule.max_days
+        conditions.append(condition)
+    status = np.select(conditions, [rule.label for rule in rules], default=default) if rules else default
+    return pd.DataFrame({"lead_uuid_c": activity["lead_uuid_c"].iloc[rows].to_numpy(), "act_status": status})
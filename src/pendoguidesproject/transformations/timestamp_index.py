@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+
+class TimestampIndex:
+    """
+    Pre-sorted int64 event timestamps per key group (e.g. visitor, guide and step), answering
+    "latest before t" and "earliest after t" by binary search for a whole array of query times.
+    """
+
+    def __init__(self, keys: pd.DataFrame, times):
+        self.key_names = list(keys.columns)
+        frame = keys.reset_index(drop=True).copy()
+        frame["browsertime"] = np.asarray(times, dtype=np.int64)
+        frame = frame.sort_values(self.key_names + ["browsertime"], kind="mergesort")
+        groups = frame[self.key_names].drop_duplicates()
+        self.groups = pd.MultiIndex.from_frame(groups)
+        self.codes = self.groups.get_indexer(pd.MultiIndex.from_frame(frame[self.key_names]))
+        self.times = frame["browsertime"].to_numpy()
+        self.starts = np.searchsorted(self.codes, np.arange(len(self.groups)), side="left")
+        self.ends = np.searchsorted(self.codes, np.arange(len(self.groups)), side="right")
+
+    @classmethod
+    def fromEvents(cls, events: pd.DataFrame, event_type: str, keys):
+        selected = events.loc[events["type"] == event_type]
+        return cls(selected[keys], selected["browsertime"])
+
+    def latestBefore(self, keys: pd.DataFrame, times):
+        """
+        Latest indexed time strictly before each query time, the query time itself when there is
+        none (transform.findHighest).
+        """
+        codes, times = self.lookup(keys, times)
+        if len(self.times) == 0:
+            return times
+        positions = self.search(codes, times, side="left") - 1
+        found = (codes >= 0) & (positions >= self.starts[codes])
+        return np.where(found, self.times[np.maximum(positions, 0)], times)
+
+    def earliestAfter(self, keys: pd.DataFrame, times):
+        """
+        Earliest indexed time strictly after each query time, the latest time of the group when
+        there is none (transform.findLowest).
+        """
+        codes, times = self.lookup(keys, times)
+        if (codes < 0).any():
+            raise ValueError("earliestAfter queried a group without indexed timestamps")
+        positions = self.search(codes, times, side="right")
+        return self.times[np.minimum(positions, self.ends[codes] - 1)]
+
+    def lookup(self, keys, times):
+        codes = self.groups.get_indexer(pd.MultiIndex.from_frame(keys[self.key_names]))
+        return codes, np.asarray(times, dtype=np.int64)
+
+    def search(self, codes, times, side):
+        # Rank index and query times together, so (group, rank) packs into one sortable int64
+        ranks = np.unique(np.concatenate([self.times, times]))
+        width = len(ranks) + 1
+        indexed = self.codes.astype(np.int64) * width + np.searchsorted(ranks, self.times)
+        queried = codes.astype(np.int64) * width + np.searchsorted(ranks, times)
+        return np.searchsorted(indexed, queried, side=side)
+
+
+def latestBefore(lst, target):
+    times = np.sort(np.asarray(lst, dtype=np.int64))
+    position = np.searchsorted(times, target, side="left")
+    return target if position == 0 else int(times[position - 1])
+
+
+def earliestAfter(lst, target):
+    times = np.sort(np.asarray(lst, dtype=np.int64))
+    if len(times) == 0:
+        raise ValueError("earliestAfter() arg is an empty sequence")
+    position = np.searchsorted(times, target, side="right")
+    return int(times[min(position, len(times) - 1)])
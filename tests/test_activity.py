@@ -0,0 +1,118 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pendoguidesproject.jobs import entrypoint
+from pendoguidesproject.transformations import activity
+from pendoguidesproject.transformations.activity import CAMPAIGN_NAME, joinTestDriveLeads
+
+
+def make_salesforce(seed):
+    rng = np.random.RandomState(seed)
+
+    def maybe_null(values, fraction=0.1):
+        return [None if rng.rand() < fraction else value for value in values]
+
+    campaign = pd.DataFrame({
+        "created_date": ["2021-01-01", "2021-02-01", "2021-03-01"],
+        "id": ["c1", "c2", "c3"],
+        "name": [CAMPAIGN_NAME, "Other campaign", CAMPAIGN_NAME],
+        "start_date": ["2021-01-15", "2021-02-15", "2021-03-15"],
+        "type": ["Trial", "Webinar", "Trial"],
+        "description": ["dropped", "dropped", "dropped"],
+    })
+    member = pd.DataFrame({
+        "id": [f"m{i}" for i in range(60)],
+        "campaign_name_text": rng.choice([CAMPAIGN_NAME, "Other campaign"], size=60),
+        "lead_or_contact_id": maybe_null([f"p{i}" for i in rng.randint(0, 40, size=60)]),
+        "email": [f"user{i}@example.com" for i in range(60)],
+    })
+    lead = pd.DataFrame({
+        "id": [f"p{i}" for i in range(20)],
+        "lean_data_reporting_matched_account_c": maybe_null([f"a{i}" for i in rng.randint(0, 10, size=20)], 0.2),
+        "uuid_c": maybe_null([f"u{i}" for i in range(20)]),
+        "company": ["dropped"] * 20,
+    })
+    contact = pd.DataFrame({
+        "id": [f"p{i}" for i in range(20, 40)],
+        "account_id": maybe_null([f"a{i}" for i in rng.randint(0, 10, size=20)], 0.2),
+        "uuid_c": maybe_null([f"u{i}" for i in range(20, 40)]),
+    })
+    account = pd.DataFrame({
+        "account_id_long_version__c": maybe_null([f"a{i}" for i in rng.randint(0, 12, size=12)], 0.2),
+        "name": [f"Account {i}" for i in range(12)],
+        "industry": rng.choice(["Banking", "Pharma", None], size=12),
+    })
+    return {"campaign": campaign, "campaign_member": member, "lead": lead, "contact": contact, "account": account}
+
+
+@pytest.fixture
+def clean():
+    # Importing clean registers its job, the registry is restored for the tests that count the registered jobs
+    jobs, datasets = dict(entrypoint.all), dict(entrypoint.datasets)
+    from pendoguidesproject import clean
+
+    yield clean
+    entrypoint.all.clear()
+    entrypoint.all.update(jobs)
+    entrypoint.datasets.clear()
+    entrypoint.datasets.update(datasets)
+
+
+class CatalogImporter:
+    # The get_column_order of redshiftExporter against fixed tables
+    def __init__(self, tables):
+        self.tables = tables
+
+    def get_column_order(self, cursor, table, schema):
+        return list(self.tables[table].columns)
+
+
+def salesforceDatabase(tables):
+    con = sqlite3.connect(":memory:")
+    con.execute("attach database ':memory:' as salesforce")
+    for name, table in tables.items():
+        table.to_sql(name, con, index=False)
+        con.execute(f"create table salesforce.{name} as select * from main.{name}")
+    return con
+
+
+def sorted_frame(frame):
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.sort_values(list(frame.columns), key=lambda column: column.astype(str)).reset_index(drop=True)
+
+
+def test_pushed_down_join_matches_the_pandas_join_graph():
+    tables = make_salesforce(seed=0)
+    con = salesforceDatabase(tables)
+
+    pushed_down = pd.read_sql_query(activity.testDriveLeadsQuery(list(tables["campaign_member"].columns), list(tables["account"].columns)), con)
+
+    read = lambda sql, prefix: pd.read_sql_query(sql, con).add_prefix(prefix)
+    expected = joinTestDriveLeads(
+        read(f"select * from salesforce.campaign where name = '{CAMPAIGN_NAME}'", "sfc_"),
+        read(f"select * from salesforce.campaign_member where campaign_name_text = '{CAMPAIGN_NAME}'", "sfcm_"),
+        read("select * from salesforce.lead", "lead_"),
+        read("select * from salesforce.contact", "ctct_"),
+        read("select * from salesforce.account", "acc_"),
+    )
+
+    assert list(pushed_down.columns) == list(expected.columns)
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(sorted_frame(pushed_down), sorted_frame(expected))
+
+
+def test_leads_carry_the_account_columns_clean_account_kept(clean):
+    tables = make_salesforce(seed=1)
+    tables["account"] = tables["account"].assign(id=[f"001{i}" for i in range(12)], type="Customer", phone="555-0100")
+    importer = CatalogImporter(tables)
+    con = salesforceDatabase(tables)
+
+    leads = pd.read_sql_query(activity.testDriveLeadsQuery(list(tables["campaign_member"].columns), clean.accountColumns(importer, None)), con)
+
+    # The legacy clean selected every account column and dropped the list of cleanAccount after the prefix
+    kept = tables["account"].add_prefix("acc_").drop(columns=["acc_" + column for column in clean.ACCOUNT_NULL_COLUMNS], errors="ignore")
+    assert [column for column in leads.columns if column.startswith("acc_")] == list(kept.columns)
+    assert list(kept.columns) == ["acc_account_id_long_version__c", "acc_industry", "acc_type"]
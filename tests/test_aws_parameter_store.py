@@ -0,0 +1,79 @@
+import botocore
+from cryptography.fernet import Fernet
+
+from pendoguidesproject import aws_parameter_store
+from pendoguidesproject.aws_parameter_store import AwsParameterStore
+
+
+class FakeSSM:
+    def __init__(self, parameters, drops=0):
+        self.parameters = parameters
+        self.drops = drops
+        self.calls = []
+
+    def maybe_drop(self, operation):
+        self.calls.append(operation)
+        if self.drops > 0:
+            self.drops -= 1
+            raise botocore.exceptions.ClientError({"Error": {"Code": "ThrottlingException"}}, operation)
+
+    def get_parameter(self, Name, WithDecryption):
+        self.maybe_drop("GetParameter")
+        return {"Parameter": {"Name": Name, "Value": self.parameters[Name]}}
+
+    def get_parameters(self, Names, WithDecryption):
+        self.maybe_drop("GetParameters")
+        assert len(Names) <= 10
+        return {
+            "Parameters": [{"Name": name, "Value": self.parameters[name]} for name in Names if name in self.parameters],
+            "InvalidParameters": [name for name in Names if name not in self.parameters],
+        }
+
+
+def fake_ssm(monkeypatch, parameters, drops=0):
+    ssm = FakeSSM(parameters, drops)
+    monkeypatch.setattr(aws_parameter_store, "clients", {"us-east-1": ssm})
+    monkeypatch.setattr(aws_parameter_store, "cache", {})
+    monkeypatch.setattr(aws_parameter_store.time, "sleep", lambda seconds: None)
+    return ssm
+
+
+def test_parameters_are_fetched_in_batches_once_per_process(monkeypatch):
+    parameters = {f"/redshift/dev/param{i}": f"value{i}" for i in range(25)}
+    ssm = fake_ssm(monkeypatch, parameters)
+
+    assert AwsParameterStore().get_params(list(parameters)) == parameters
+    assert AwsParameterStore().get_param("/redshift/dev/param3") == "value3"
+    assert AwsParameterStore().get_params(["/redshift/dev/param1", "/redshift/dev/param2"]) == {
+        "/redshift/dev/param1": "value1", "/redshift/dev/param2": "value2"
+    }
+    assert ssm.calls == ["GetParameters"] * 3
+
+
+def test_dropped_requests_are_retried(monkeypatch):
+    ssm = fake_ssm(monkeypatch, {"/redshift/dev/endpoint": "cluster.redshift.amazonaws.com:5439"}, drops=2)
+    assert AwsParameterStore().get_param("/redshift/dev/endpoint") == "cluster.redshift.amazonaws.com:5439"
+    assert ssm.calls == ["GetParameter"] * 3
+
+
+def test_missing_parameters_raise(monkeypatch):
+    fake_ssm(monkeypatch, {"/a": "1"})
+    try:
+        AwsParameterStore().get_params(["/a", "/b"])
+        assert False, "expected a KeyError"
+    except KeyError as e:
+        assert e.args[0] == ["/b"]
+
+
+def test_disk_cache_is_encrypted_and_shared(monkeypatch, tmp_path):
+    ssm = fake_ssm(monkeypatch, {"/redshift/dev/endpoint": "secret-endpoint"})
+    key = Fernet.generate_key().decode()
+    path = str(tmp_path / "parameters.cache")
+
+    AwsParameterStore(cache_path=path, cache_key=key).get_param("/redshift/dev/endpoint")
+    assert b"secret-endpoint" not in open(path, "rb").read()
+
+    # A new process starts with an empty in-process cache
+    monkeypatch.setattr(aws_parameter_store, "cache", {})
+    assert AwsParameterStore(cache_path=path, cache_key=key).get_param("/redshift/dev/endpoint") == "secret-endpoint"
+    assert ssm.calls == ["GetParameter"]
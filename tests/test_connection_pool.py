@@ -0,0 +1,90 @@
+import datetime
+
+from pendoguidesproject.connection_pool import CachedCredentials, ConnectionPool, utcnow
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query):
+        if self.conn.broken:
+            raise RuntimeError("server closed the connection unexpectedly")
+
+    def fetchone(self):
+        return (1,)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = True
+        self.broken = False
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+def test_pool_reuses_connections_and_resets_transactions():
+    created = []
+    pool = ConnectionPool(lambda: created.append(FakeConnection()) or created[-1])
+
+    with pool.connection() as conn:
+        conn.autocommit = False
+    with pool.connection() as again:
+        assert again is conn
+    assert len(created) == 1
+    assert conn.autocommit and conn.rollbacks == 1
+
+
+def test_pool_replaces_dead_connections_and_closes_on_error():
+    created = []
+    pool = ConnectionPool(lambda: created.append(FakeConnection()) or created[-1], liveness_after=0)
+
+    with pool.connection() as conn:
+        pass
+    conn.broken = True
+    with pool.connection() as replacement:
+        assert replacement is not conn
+    assert conn.closed
+
+    try:
+        with pool.connection() as failed:
+            raise RuntimeError("query failed")
+    except RuntimeError:
+        pass
+    assert failed.closed
+    assert pool.idle == []
+
+
+def test_credentials_are_cached_until_shortly_before_they_expire():
+    fetched = []
+
+    def fetch():
+        fetched.append(1)
+        return {"password": "secret", "expiration": utcnow() + lifetime}
+
+    lifetime = datetime.timedelta(minutes=15)
+    credentials = CachedCredentials(fetch, margin=datetime.timedelta(minutes=2))
+    credentials.get()
+    credentials.get()
+    assert len(fetched) == 1
+
+    lifetime = datetime.timedelta(minutes=1)
+    credentials.value = None
+    credentials.get()
+    credentials.get()
+    assert len(fetched) == 3
@@ -0,0 +1,54 @@
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from pendoguidesproject.dtypes import EVENT_TYPES, PENDO_DTYPES, applyDtypes, memoryBytes
+from pendoguidesproject.storage import readPartitions, writePartitions
+from pendoguidesproject.transformations.sessionize import sessionize
+from tests.test_sessionize import canonical, make_events
+from tests.test_storage import fake_datalake
+
+
+def make_raw_events(seed, rows=20000):
+    # Pendo ids are uuids and e-mail like strings, read back from csv as object columns
+    rng = np.random.RandomState(seed)
+    visitors = [f"{uuid.UUID(int=int(rng.randint(2**31)))}@example.com" for _ in range(500)]
+    guides = [uuid.UUID(int=int(rng.randint(2**31))).hex[:27] for _ in range(40)]
+    accounts = [f"account-{uuid.UUID(int=int(rng.randint(2**31)))}" for _ in range(50)]
+    return pd.DataFrame({
+        "accountid": pd.Series(rng.choice(accounts, rows), dtype=object),
+        "guideid": pd.Series(rng.choice(guides, rows), dtype=object),
+        "visitorid": pd.Series(rng.choice(visitors, rows), dtype=object),
+        "guidestepid": pd.Series(rng.choice(guides, rows), dtype=object),
+        "type": pd.Series(rng.choice(EVENT_TYPES[:4], rows), dtype=object),
+        "browsertime": pd.Series(1_620_000_000_000 + rng.randint(0, 10**9, rows), dtype=object),
+    })
+
+
+def test_dtype_plan_shrinks_events_at_least_three_times():
+    raw = make_raw_events(seed=0)
+    compacted = applyDtypes(raw)
+    assert memoryBytes(raw) / memoryBytes(compacted) >= 3
+    assert compacted["browsertime"].dtype == "int64"
+    assert list(compacted["type"].cat.categories[:len(EVENT_TYPES)]) == EVENT_TYPES
+    assert (compacted.astype({column: object for column in raw.columns}) == raw).all().all()
+
+
+def test_unknown_event_types_and_float_browsertimes_survive():
+    raw = pd.DataFrame({"type": ["guideSeen", "guideReset"], "browsertime": [1.62e12, 1.62e12 + 1000]})
+    compacted = applyDtypes(raw)
+    assert list(compacted["type"]) == ["guideSeen", "guideReset"]
+    assert list(compacted["browsertime"]) == [1620000000000, 1620000001000]
+
+
+def test_compacted_partitions_stay_categorical_and_sessionize_the_same(monkeypatch):
+    fake_datalake(monkeypatch)
+    events = make_events(seed=0)
+    events["date_partition"] = np.where(np.arange(len(events)) % 2 == 0, "2021-05-26", "2021-05-27")
+    writePartitions(events, "raw/pendoguides", "pendoguides")
+
+    compacted = readPartitions("raw/pendoguides", "pendoguides", dtypes=PENDO_DTYPES)
+    assert all(isinstance(compacted[column].dtype, pd.CategoricalDtype) for column in ["guideid", "visitorid", "type"])
+    raw = readPartitions("raw/pendoguides", "pendoguides")
+    pd.testing.assert_frame_equal(canonical(sessionize(compacted)), canonical(sessionize(raw)))
@@ -0,0 +1,39 @@
+import threading
+import time
+
+from pendoguidesproject.connection_pool import ConnectionPool
+from pendoguidesproject.extraction import extractConcurrently, selectQuery
+from tests.test_connection_pool import FakeConnection
+
+
+def test_sources_are_extracted_concurrently_in_order():
+    sources = {f"source{i}": (lambda i=i: time.sleep(0.2) or [i] * i) for i in range(5)}
+    start = time.perf_counter()
+    results = extractConcurrently(sources)
+    assert time.perf_counter() - start < 0.6
+    assert list(results) == list(sources)
+    assert results["source3"] == [3, 3, 3]
+
+
+def test_pool_bounds_the_connections_in_use():
+    in_use = []
+    peak = []
+    lock = threading.Lock()
+    pool = ConnectionPool(FakeConnection, max_connections=2)
+
+    def query():
+        with pool.connection():
+            with lock:
+                in_use.append(1)
+                peak.append(len(in_use))
+            time.sleep(0.05)
+            with lock:
+                in_use.pop()
+
+    extractConcurrently({f"query{i}": query for i in range(6)})
+    assert max(peak) == 2
+
+
+def test_select_only_requests_allow_listed_columns():
+    assert selectQuery("salesforce.lead", ["id", "uuid_c"]) == 'select "id", "uuid_c" from salesforce.lead'
+    assert selectQuery("salesforce.campaign", where="name = 'x'") == "select * from salesforce.campaign where name = 'x'"
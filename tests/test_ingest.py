@@ -0,0 +1,48 @@
+import json
+
+import pandas as pd
+import pytest
+
+from pendoguidesproject.jobs import entrypoint
+from pendoguidesproject.storage import readPartitions, writePartitions
+from tests.test_storage import fake_datalake
+
+
+@pytest.fixture
+def ingest():
+    # Importing the job registers it, the registry is restored for the tests that count the registered jobs
+    jobs, datasets = dict(entrypoint.all), dict(entrypoint.datasets)
+    from pendoguidesproject.jobs import ingest
+
+    yield ingest
+    entrypoint.all.clear()
+    entrypoint.all.update(jobs)
+    entrypoint.datasets.clear()
+    entrypoint.datasets.update(datasets)
+
+
+def events(visitors, browsertimes, dates):
+    return pd.DataFrame({"visitorid": visitors, "type": "guideSeen", "browsertime": browsertimes, "date_partition": dates})
+
+
+def test_retried_ingest_does_not_append_the_events_twice(ingest, monkeypatch):
+    s3 = fake_datalake(monkeypatch)
+    monkeypatch.setenv("storage_format", "parquet")
+    writePartitions(events(["a", "b"], [1, 2], ["2021-05-01", "2021-05-02"]), ingest.RAW_PREFIX, "pendoguides")
+    s3.put_object(Bucket="cdo-datalake-dev-bphcob", Key=ingest.WATERMARK_KEY, Body=json.dumps({"browsertime": 2, "date_partition": "2021-05-02"}).encode())
+    new = events(["c", "d"], [3, 4], ["2021-05-02", "2021-05-03"])
+    monkeypatch.setattr(ingest, "ingestPendo", lambda watermark: new[new["browsertime"] > watermark["browsertime"]])
+    write_watermark = ingest.writeWatermark
+
+    def fail(pendo_guides):
+        raise ConnectionError("lost the connection before moving the watermark")
+
+    monkeypatch.setattr(ingest, "writeWatermark", fail)
+    with pytest.raises(ConnectionError):
+        ingest.ingestData()
+    monkeypatch.setattr(ingest, "writeWatermark", write_watermark)
+    ingest.ingestData()
+
+    raw = readPartitions(ingest.RAW_PREFIX, "pendoguides")
+    assert sorted(raw["visitorid"]) == ["a", "b", "c", "d"]
+    assert ingest.readWatermark() == {"browsertime": 4, "date_partition": "2021-05-03"}
@@ -1,4 +1,4 @@
-from pendoguidesproject.jobs import entrypoint
+from pendoguidesproject.jobs import entrypoint, job_options
 
 
 @entrypoint(name="job1")
@@ -14,3 +14,11 @@ def job2():
 def test_jobs_in_scope_can_be_discovered():
     jobs = entrypoint.all
     assert len(jobs) == 2
+
+
+def test_job_options_only_passes_accepted_options():
+    def sharded_job(env, date, workers=1):
+        pass
+
+    assert job_options(sharded_job, {"workers": 4}) == {"workers": 4}
+    assert job_options(job1, {"workers": 4}) == {}
@@ -0,0 +1,119 @@
+import json
+import socket
+import threading
+
+import pytest
+
+from pendoguidesproject import metrics
+from pendoguidesproject.extraction import extractConcurrently
+from pendoguidesproject.jobs import JobDatasets, make_job_decorator
+from pendoguidesproject.runner import runInProcess
+
+
+@pytest.fixture(autouse=True)
+def recorder():
+    yield metrics.reset()
+    metrics.reset()
+
+
+def stages(record):
+    return {span["stage"]: span for span in record["stages"]}
+
+
+def test_stages_nest_and_roll_up_counters(recorder):
+    with metrics.stage("clean"):
+        with metrics.stage("extract") as span:
+            metrics.count("s3_bytes_read", 100)
+            span.rows_out = 10
+        with metrics.stage("write", rows_in=10):
+            metrics.count("s3_bytes_written", 40)
+            metrics.count("s3_bytes_written", 2)
+
+    record = stages(recorder.record())
+    assert list(record) == ["clean/extract", "clean/write", "clean"]
+    assert record["clean/extract"]["rows_out"] == 10
+    assert record["clean/write"]["rows_in"] == 10
+    assert record["clean/write"]["s3_bytes_written"] == 42
+    assert record["clean"]["s3_bytes_read"] == 100
+    assert record["clean"]["s3_bytes_written"] == 42
+    assert record["clean"]["wall_seconds"] >= record["clean/extract"]["wall_seconds"]
+    assert record["clean"]["peak_rss_bytes"] > 0
+    assert all(span["status"] == "ok" for span in record.values())
+
+
+def test_failed_stages_are_recorded(recorder):
+    with pytest.raises(ValueError):
+        with metrics.stage("transform"):
+            with metrics.stage("sessionize"):
+                raise ValueError("boom")
+
+    record = stages(recorder.record())
+    assert record["transform/sessionize"]["status"] == "failed"
+    assert record["transform"]["status"] == "failed"
+
+
+def test_counters_of_worker_threads_go_to_the_stage_that_started_them(recorder):
+    with metrics.stage("extract"):
+        extractConcurrently({"pendo_activity": lambda: metrics.count("redshift_rows_read", 5), "lead": lambda: None})
+        # A thread outside the context of the stage doesn't count into it
+        worker = threading.Thread(target=metrics.count, args=("redshift_rows_read", 7))
+        worker.start()
+        worker.join()
+
+    assert stages(recorder.record())["extract"]["redshift_rows_read"] == 5
+
+
+def test_concurrent_jobs_are_separate_roots(recorder):
+    both = threading.Barrier(2, timeout=5)
+
+    def run_job(name):
+        with metrics.stage(name):
+            # Both jobs have their stage open at the same time
+            both.wait()
+            metrics.count("redshift_rows_read", len(name))
+            with metrics.stage("extract"):
+                both.wait()
+
+    runInProcess(["ingest", "clean"], run_job, {"ingest": JobDatasets((), ("raw/pendoguides",)), "clean": JobDatasets((), ("clean/testdriveanalysis",))})
+
+    record = stages(recorder.record())
+    assert sorted(record) == ["clean", "clean/extract", "ingest", "ingest/extract"]
+    assert record["ingest"]["redshift_rows_read"] == len("ingest")
+    assert record["clean"]["redshift_rows_read"] == len("clean")
+
+
+def test_counters_outside_stages_are_dropped(recorder):
+    metrics.count("s3_bytes_read", 1)
+    assert recorder.record()["stages"] == []
+
+
+def test_entrypoint_records_a_stage_per_job(recorder):
+    register = make_job_decorator()
+
+    @register("job")
+    def job(env, date, workers=1):
+        with metrics.stage("sessionize"):
+            return workers
+
+    assert register.all["job"]("dev", "2021-05-01", workers=3) == 3
+    assert list(stages(recorder.record())) == ["job/sessionize", "job"]
+
+
+def test_report_writes_json_prometheus_and_statsd(recorder, tmp_path):
+    with metrics.stage("ingest"):
+        metrics.count("s3_bytes_written", 7)
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(5)
+    port = receiver.getsockname()[1]
+
+    record = metrics.report(
+        str(tmp_path / "metrics.json"), f"127.0.0.1:{port}", str(tmp_path / "pendoguides.prom"), env="dev", date="2021-05-01"
+    )
+
+    assert json.loads((tmp_path / "metrics.json").read_text()) == record
+    assert record["env"] == "dev"
+    assert 'pendoguides_stage_s3_bytes_written{stage="ingest"} 7' in (tmp_path / "pendoguides.prom").read_text()
+    lines = {receiver.recv(1024).decode() for _ in metrics.statsdLines(record)}
+    receiver.close()
+    assert "pendoguides.ingest.s3_bytes_written:7|g" in lines
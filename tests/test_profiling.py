@@ -0,0 +1,45 @@
+import pstats
+import time
+
+import pytest
+
+from pendoguidesproject import profiling
+
+
+def busy(n):
+    return sum(square(i) for i in range(n))
+
+
+def square(i):
+    return i * i
+
+
+@pytest.mark.parametrize("profiler", profiling.PROFILERS)
+def test_profiled_writes_pstats_and_collapsed_stacks(profiler, tmp_path, caplog):
+    caplog.set_level("INFO")
+    with profiling.profiled(profiler, "job", str(tmp_path), top=5):
+        # Long enough for the sampler to catch busy a few times
+        end = time.perf_counter() + 0.2
+        while time.perf_counter() < end:
+            busy(20000)
+
+    stats = pstats.Stats(str(tmp_path / "job.pstats"))
+    assert any(name == "busy" for _, _, name in stats.stats)
+    collapsed = (tmp_path / "job.collapsed").read_text().splitlines()
+    assert any("busy (test_profiling.py" in line for line in collapsed)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in collapsed)
+    assert f"Profiled job with {profiler}" in caplog.text
+
+
+def test_profiled_writes_on_failure(tmp_path):
+    with pytest.raises(ZeroDivisionError):
+        with profiling.profiled("cprofile", "failed", str(tmp_path)):
+            busy(1000) / 0
+
+    assert (tmp_path / "failed.pstats").exists()
+
+
+def test_unknown_profiler():
+    with pytest.raises(ValueError):
+        with profiling.profiled("perf", "job"):
+            pass
@@ -0,0 +1,36 @@
+import pytest
+
+from pendoguidesproject import readiness
+from pendoguidesproject.readiness import waitUntilReady
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(readiness.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_returns_as_soon_as_ready(no_sleep):
+    waitUntilReady(lambda: True, "credentials")
+    assert no_sleep == []
+
+
+def test_retries_with_backoff_until_ready(no_sleep):
+    attempts = iter([ConnectionError("metadata service"), False, False, True])
+
+    def check():
+        attempt = next(attempts)
+        if isinstance(attempt, Exception):
+            raise attempt
+        return attempt
+
+    waitUntilReady(check, "credentials", interval=0.1)
+    assert no_sleep == [0.1, 0.2, 0.4]
+
+
+def test_times_out(no_sleep, monkeypatch):
+    clock = iter(range(0, 1000, 10))
+    monkeypatch.setattr(readiness.time, "monotonic", lambda: next(clock))
+    with pytest.raises(TimeoutError, match="credentials not ready"):
+        waitUntilReady(lambda: False, "credentials", timeout=30)
@@ -0,0 +1,183 @@
+import io
+from collections import namedtuple
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+from psycopg2 import sql
+
+from pendoguidesproject.Redshift import arrowSchema, redshiftExporter
+from pendoguidesproject.storage import S3MultipartWriter
+from tests.test_storage import FakeS3
+
+Column = namedtuple("Column", ["name", "type_code", "precision", "scale"], defaults=[None, None])
+
+
+def render(query) -> str:
+    # psycopg2 only renders identifiers against a live connection
+    if isinstance(query, sql.Composed):
+        return "".join(render(part) for part in query.seq)
+    if isinstance(query, sql.Identifier):
+        return ".".join(f'"{string}"' for string in query.strings)
+    if isinstance(query, sql.Literal):
+        return repr(query.wrapped)
+    if isinstance(query, sql.SQL):
+        return query.string
+    return query
+
+
+class RecordingCursor:
+    def __init__(self, description=None):
+        self.description = description
+        self.queries = []
+
+    def execute(self, query, params=None):
+        self.queries.append((render(query), params))
+
+
+def exporter(monkeypatch, table=""):
+    monkeypatch.setenv("environment", "dev")
+    return redshiftExporter("pendoguides", table)
+
+
+def test_empty_unload_keeps_the_columns_and_dtypes_of_the_query(monkeypatch):
+    cursor = RecordingCursor([Column("visitorid", 1043), Column("browsertime", 20), Column("numminutes", 701), Column("date", 1082)])
+    empty = exporter(monkeypatch).empty_result(cursor, "select visitorid, browsertime from productusage.pendo_activity;")
+
+    assert cursor.queries == [("select * from (select visitorid, browsertime from productusage.pendo_activity) as described limit 0", None)]
+    assert list(empty.columns) == ["visitorid", "browsertime", "numminutes", "date"]
+    assert len(empty) == 0
+    assert [str(dtype) for dtype in empty.dtypes] == ["object", "int64", "float64", "object"]
+
+
+class StreamingConnection:
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = rows
+        self.autocommit = True
+
+    def cursor(self, name=None):
+        connection = self
+
+        class StreamingCursor:
+            description = connection.description
+
+            def execute(self, query, params=None):
+                self.position = 0
+
+            def fetchmany(self, size):
+                rows = connection.rows[self.position:self.position + size]
+                self.position += size
+                return rows
+
+            def close(self):
+                pass
+
+        return StreamingCursor()
+
+    def rollback(self):
+        pass
+
+
+def test_streamed_batches_are_written_with_the_schema_of_the_result_set(monkeypatch):
+    description = [Column("visitorid", 1043), Column("browsertime", 20), Column("numminutes", 1700, 10, 2)]
+    assert arrowSchema(description) == pa.schema([("visitorid", pa.string()), ("browsertime", pa.int64()), ("numminutes", pa.decimal128(10, 2))])
+    # Every column is null in the first batch and has values later
+    rows = [(None, None, None), (None, None, None), ("v1", 1620000000000, None), ("v2", None, None)]
+    connection = StreamingConnection(description, rows)
+
+    batches = list(exporter(monkeypatch).stream_query(connection, "select * from pendo.guides_usage", itersize=2))
+    s3 = FakeS3()
+    with pytest.raises(pa.ArrowException):
+        # Inferred from the first batch, the columns would be typed null
+        with S3MultipartWriter("bucket", "raw/pendoguides/pendoguides.parquet", s3_client=s3) as writer:
+            for batch in batches:
+                writer.write_parquet(batch)
+    with S3MultipartWriter("bucket", "raw/pendoguides/pendoguides.parquet", s3_client=s3, schema=batches[0].attrs["arrow_schema"]) as writer:
+        for batch in batches:
+            writer.write_parquet(batch)
+
+    written = pd.read_parquet(io.BytesIO(s3.objects[("bucket", "raw/pendoguides/pendoguides.parquet")]))
+    assert list(written["visitorid"].fillna("-")) == ["-", "-", "v1", "v2"]
+    assert list(written["browsertime"].fillna(0)) == [0, 0, 1620000000000, 0]
+
+
+class UpsertConnection:
+    def __init__(self, cursor):
+        self.recording = cursor
+        self.autocommit = True
+        self.committed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return self.recording
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+
+class UpsertCursor(RecordingCursor):
+    def __init__(self, columns):
+        super().__init__()
+        self.columns = columns
+
+    def fetchone(self):
+        return (1,)
+
+    def fetchall(self):
+        return [(column,) for column in self.columns]
+
+
+def test_replacing_partitions_deletes_them_and_stages_the_sanitized_columns_of_the_table(monkeypatch):
+    wr = pytest.importorskip("awswrangler")
+    staged = {}
+    monkeypatch.setattr(wr.s3, "to_parquet", lambda df, path: staged.update(columns=list(df.columns), path=path))
+    monkeypatch.setattr(wr.s3, "delete_objects", lambda path: staged.update(deleted=path))
+    cursor = UpsertCursor(["account_id", "visitorid", "time_on_guide", "date_partition"])
+    connection = UpsertConnection(cursor)
+    target = exporter(monkeypatch, "guide_usage")
+    monkeypatch.setattr(target, "connection", lambda: connection)
+    # The names of the clean partitions, before the Glue catalog sanitized them
+    partitions = pd.DataFrame({"date_partition": ["2021-05-01"], "visitorid": ["v1"], "time on guide": [3.0], "account id": ["a1"]})
+
+    # 2021-04-30 lost its last rows, it is only deleted
+    assert target.replace_partitions(partitions, ["2021-05-01", "2021-04-30"])
+
+    assert staged["columns"] == ["account_id", "visitorid", "time_on_guide", "date_partition"]
+    assert staged["deleted"] == staged["path"][:-len("delta.parquet")]
+    statements = [query for query, params in cursor.queries[2:]]
+    assert statements[0] == 'DELETE FROM "pendoguides"."guide_usage" WHERE "date_partition"::date IN (\'2021-04-30\', \'2021-05-01\')'
+    assert statements[1] == 'CREATE TEMP TABLE "guide_usage_staging" (LIKE "pendoguides"."guide_usage")'
+    assert statements[3] == 'INSERT INTO "pendoguides"."guide_usage" SELECT * FROM "guide_usage_staging"'
+    assert connection.committed
+
+
+def test_replacing_emptied_partitions_only_deletes_them(monkeypatch):
+    wr = pytest.importorskip("awswrangler")
+    monkeypatch.setattr(wr.s3, "to_parquet", lambda df, path: pytest.fail("staged an empty partition"))
+    cursor = UpsertCursor(["account_id", "visitorid"])
+    connection = UpsertConnection(cursor)
+    target = exporter(monkeypatch, "guide_usage")
+    monkeypatch.setattr(target, "connection", lambda: connection)
+
+    assert target.replace_partitions(pd.DataFrame(columns=["account id", "visitorid"]), ["2021-05-01"])
+
+    assert [query for query, params in cursor.queries[2:]] == [
+        'DELETE FROM "pendoguides"."guide_usage" WHERE "date_partition"::date IN (\'2021-05-01\')'
+    ]
+    assert connection.committed
+
+
+def test_replacing_no_partitions_does_not_touch_the_table(monkeypatch):
+    target = exporter(monkeypatch, "guide_usage")
+    monkeypatch.setattr(target, "connection", lambda: pytest.fail("connected without partitions to replace"))
+
+    assert target.replace_partitions(pd.DataFrame(columns=["account id", "visitorid"]), [])
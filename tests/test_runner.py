@@ -0,0 +1,94 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from pendoguidesproject import storage
+from pendoguidesproject.jobs import JobDatasets
+from pendoguidesproject.runner import jobDependencies, runInProcess
+from pendoguidesproject.storage import listPartitions, readPartitions, writeDataset, writePartitions
+from tests.test_storage import fake_datalake
+
+DATASETS = {
+    "ingest": JobDatasets(("redshift:pendo.guides_usage",), ("raw/pendoguides",)),
+    "transform": JobDatasets(("raw/pendoguides",), ("clean/pendoguides",)),
+    "load": JobDatasets(("clean/pendoguides",), ("redshift:pendoguides.guide_usage",)),
+    "clean": JobDatasets(("redshift:salesforce",), ("clean/testdriveanalysis",)),
+    "sample": JobDatasets((), ()),
+}
+
+
+def test_job_dependencies_follow_the_datasets():
+    assert jobDependencies(["ingest", "clean", "transform", "load"], DATASETS) == {
+        "ingest": [],
+        "clean": [],
+        "transform": ["ingest"],
+        "load": ["transform"],
+    }
+    # A job doesn't overwrite what an earlier job still reads
+    assert jobDependencies(["transform", "ingest"], DATASETS) == {"transform": [], "ingest": ["transform"]}
+    # Undeclared jobs keep the given order
+    assert jobDependencies(["clean", "sample", "ingest"], DATASETS) == {"clean": [], "sample": ["clean"], "ingest": ["sample"]}
+
+
+def test_in_process_chain_hands_datasets_over_in_memory(monkeypatch):
+    s3 = fake_datalake(monkeypatch)
+    events = pd.DataFrame({"visitorid": ["v1", "v2", "v3"], "browsertime": [1, 2, 3], "date_partition": ["2021-05-01", "2021-05-01", "2021-05-02"]})
+    checkpoint = threading.Event()
+    put_object = s3.put_object
+
+    def slow_put_object(Bucket, Key, Body):
+        # Checkpoints only land once the whole chain ran
+        checkpoint.wait(5)
+        put_object(Bucket, Key, Body)
+
+    monkeypatch.setattr(s3, "put_object", slow_put_object)
+    read = {}
+
+    def run_job(name):
+        if name == "ingest":
+            writePartitions(events, "raw/pendoguides", "pendoguides")
+        elif name == "transform":
+            read["raw"] = readPartitions("raw/pendoguides", "pendoguides", end="2021-05-02")
+            assert listPartitions("raw/pendoguides") == ["2021-05-01", "2021-05-02"]
+            writeDataset(read["raw"].assign(seconds=1.0), "clean/pendoguides", "pendoguides", date="2021-05-02")
+            checkpoint.set()
+
+    runInProcess(["ingest", "transform"], run_job, DATASETS)
+
+    pd.testing.assert_frame_equal(read["raw"], events)
+    assert storage.handoff is None
+    assert len([key for _, key in s3.objects if key.startswith("raw/pendoguides/")]) == 2
+    assert readPartitions("clean/pendoguides", "pendoguides")["seconds"].tolist() == [1.0, 1.0, 1.0]
+
+
+def test_independent_jobs_run_concurrently(monkeypatch):
+    fake_datalake(monkeypatch)
+    both = threading.Barrier(2, timeout=5)
+    runInProcess(["ingest", "clean"], lambda name: both.wait(), DATASETS)
+
+
+def test_dependents_of_a_failed_job_do_not_run(monkeypatch):
+    fake_datalake(monkeypatch)
+    ran = []
+
+    def run_job(name):
+        ran.append(name)
+        if name == "ingest":
+            raise ValueError("Redshift is down")
+
+    with pytest.raises(RuntimeError, match="ingest") as error:
+        runInProcess(["ingest", "transform", "clean"], run_job, DATASETS)
+    assert isinstance(error.value.__cause__, ValueError)
+    assert sorted(ran) == ["clean", "ingest"]
+
+
+def test_failed_checkpoints_fail_the_run(monkeypatch):
+    s3 = fake_datalake(monkeypatch)
+
+    def failing_put_object(Bucket, Key, Body):
+        raise IOError("S3 is down")
+
+    monkeypatch.setattr(s3, "put_object", failing_put_object)
+    with pytest.raises(IOError):
+        runInProcess(["ingest"], lambda name: writeDataset(pd.DataFrame({"a": [1]}), "raw/pendoguides", "pendoguides"), DATASETS)
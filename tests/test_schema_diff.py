@@ -0,0 +1,38 @@
+from pendoguidesproject.schema_diff import SchemaDiff, catalogType, fingerprint, redshiftType
+
+
+def test_external_types_map_onto_information_schema_types():
+    assert redshiftType("string") == "character varying"
+    assert redshiftType("varchar(64)") == "character varying(64)"
+    assert redshiftType("decimal(10, 2)") == catalogType("numeric", precision=10, scale=2)
+    assert redshiftType("int") == catalogType("integer")
+    assert redshiftType("bigint") == "bigint"
+
+
+def test_diff_widens_varchars_and_replaces_other_type_changes():
+    existing = {
+        "visitorid": "character varying(64)",
+        "guideid": "character varying(256)",
+        "browsertime": "integer",
+        "accountid": "character varying(256)",
+        "legacy": "boolean",
+    }
+    external = {
+        "visitorid": "character varying(128)",
+        "guideid": "character varying",
+        "browsertime": "bigint",
+        "accountid": "character varying(64)",
+        "date_partition": "date",
+    }
+    diff = SchemaDiff(existing, external)
+
+    assert diff.add == [("date_partition", "date")]
+    assert diff.remove == ["legacy"]
+    assert diff.widen == [("visitorid", "character varying(128)")]
+    assert diff.replace == [("browsertime", "bigint")]
+    assert SchemaDiff(existing, existing).is_empty()
+
+
+def test_fingerprint_ignores_column_order():
+    assert fingerprint({"a": "string", "b": "bigint"}) == fingerprint({"b": "bigint", "a": "string"})
+    assert fingerprint({"a": "string"}) != fingerprint({"a": "bigint"})
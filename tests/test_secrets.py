@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import boto3
+
+from pendoguidesproject.config import SecretsConfig
+from pendoguidesproject.secrets import Secrets
+
+
+class FakeVault(BaseHTTPRequestHandler):
+    requests = []
+    token_ttl = 3600
+    secret_ttl = 600
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.requests.append(("POST", self.path))
+        if self.path == "/v1/auth/aws/login":
+            self.reply({"auth": {"client_token": "s.token", "lease_duration": self.token_ttl, "renewable": True}})
+        elif self.path == "/v1/auth/token/renew-self":
+            self.reply({"auth": {"client_token": "s.token", "lease_duration": self.token_ttl, "renewable": True}})
+        else:
+            self.reply({}, status=404)
+
+    def do_GET(self):
+        self.requests.append(("GET", self.path))
+        if self.headers.get("X-Vault-Token") != "s.token":
+            self.reply({"errors": ["permission denied"]}, status=403)
+        elif self.path.startswith("/v1/secret/"):
+            self.reply({"data": {"password": "hunter2"}, "lease_duration": self.secret_ttl})
+        else:
+            self.reply({}, status=404)
+
+    def reply(self, body, status=200):
+        payload = json.dumps(body).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def fake_vault(monkeypatch, token_ttl=3600, secret_ttl=600):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(boto3, "DEFAULT_SESSION", None)
+    handler = type("Vault", (FakeVault,), {"requests": [], "token_ttl": token_ttl, "secret_ttl": secret_ttl})
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    config = SecretsConfig(f"http://127.0.0.1:{server.server_port}", "aws", "pendoguides")
+    return server, handler.requests, config
+
+
+def test_secrets_authenticate_once_and_are_cached_for_their_lease(monkeypatch):
+    server, requests, config = fake_vault(monkeypatch)
+    try:
+        secrets = Secrets(config)
+        for name in ["redshift", "salesforce", "redshift", "salesforce"]:
+            assert secrets.get(name) == {"password": "hunter2"}
+        secrets.close()
+    finally:
+        server.shutdown()
+
+    assert requests == [
+        ("POST", "/v1/auth/aws/login"),
+        ("GET", "/v1/secret/redshift"),
+        ("GET", "/v1/secret/salesforce"),
+    ]
+
+
+def test_token_is_renewed_in_the_background(monkeypatch):
+    # A 3s token is renewed after 2s instead of logging in again
+    server, requests, config = fake_vault(monkeypatch, token_ttl=3, secret_ttl=3)
+    try:
+        secrets = Secrets(config)
+        secrets.get("redshift")
+        time.sleep(2.5)
+        secrets.get("salesforce")
+        secrets.close()
+    finally:
+        server.shutdown()
+
+    assert requests == [
+        ("POST", "/v1/auth/aws/login"),
+        ("GET", "/v1/secret/redshift"),
+        ("POST", "/v1/auth/token/renew-self"),
+        ("GET", "/v1/secret/salesforce"),
+    ]
@@ -0,0 +1,176 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pendoguidesproject.transformations.sessionize import OUTPUT_COLUMNS, STEP_KEYS, sessionize, sessionizeIncremental, verifyIncremental
+from pendoguidesproject.transformations.sharding import sessionizeIncrementalSharded, sessionizeSharded, shardByVisitor, shardIds
+
+
+# Reference copy of the nested-loop transform.timeonGuide the sessionize engine replaces
+def legacy_find_highest(lst, target):
+    if len(lst) == 0:
+        return target
+    max_element = min(pd.to_numeric(lst))
+    if target < min(pd.to_numeric(lst)):
+        return target
+    for e in lst:
+        if int(e) > max_element and int(e) < target:
+            max_element = int(e)
+    return max_element
+
+
+def legacy_find_lowest(lst, target):
+    max_element = max(pd.to_numeric(lst))
+    for e in lst:
+        if int(e) < max_element and int(e) > target:
+            max_element = int(e)
+    return max_element
+
+
+def legacy_time_on_guide(gid_list, vid_list, pendoguidesdata):
+    output = []
+    for gid in gid_list:
+        selected_gid = pendoguidesdata[pendoguidesdata["guideid"] == gid]
+        for vid in vid_list:
+            select_vid = selected_gid[selected_gid["visitorid"] == vid]
+            gsid_list = list(set(select_vid["guidestepid"]))
+            seen = select_vid.loc[select_vid["type"] == "guideSeen"]["browsertime"]
+            dismissed = select_vid.loc[select_vid["type"] == "guideDismissed"]["browsertime"]
+            for x in dismissed:
+                gs = list(select_vid.loc[select_vid["browsertime"] == x]["guidestepid"])[0]
+                accountID = list(select_vid.loc[select_vid["browsertime"] == x]["accountid"])[0]
+                date = list(select_vid.loc[select_vid["browsertime"] == x]["date_time"])[0]
+                output.append([accountID, gid, vid, gs, ((x - legacy_find_highest(seen, x)) / 1000), date])
+            for gsid in gsid_list:
+                m = 0
+                select_gsid = select_vid.loc[(select_vid["guidestepid"] == gsid)]
+                seen = pd.to_numeric(list(select_gsid.loc[select_gsid["type"] == "guideSeen"]["browsertime"]))
+                advance = pd.to_numeric(list(select_gsid.loc[select_gsid["type"] == "guideAdvanced"]["browsertime"]))
+                if len(advance) > 0:
+                    for a in advance:
+                        highest_seen = legacy_find_highest(seen, a)
+                        lowest_advanced = legacy_find_lowest(advance, highest_seen)
+                        date = list(select_gsid.loc[select_gsid["browsertime"] == a]["date_partition"])[0]
+                        if lowest_advanced == a:
+                            m += (int(a) - int(legacy_find_highest(seen, a))) / 1000
+                            output.append([accountID, gid, vid, gsid, m, date])
+    return pd.DataFrame.from_records(output, columns=OUTPUT_COLUMNS)
+
+
+def make_events(seed, visitors=6, guides=4, steps=3, events_per_pair=12):
+    rng = np.random.RandomState(seed)
+    rows = []
+    for v in range(visitors):
+        for g in range(guides):
+            times = np.sort(rng.choice(np.arange(1_620_000_000_000, 1_620_000_600_000), events_per_pair, replace=False))
+            types = list(rng.choice(["guideSeen", "guideAdvanced", "guideActivity", "guideSeen"], events_per_pair).astype(object))
+            # The legacy loop reuses the last dismissal's account id, so every pair ends with one
+            types[-1] = "guideDismissed"
+            for t, event_type in zip(times, types):
+                rows.append([f"acc{v}", f"guide{g}", f"visitor{v}", f"step{rng.randint(steps)}", event_type, int(t)])
+    events = pd.DataFrame(rows, columns=["accountid", "guideid", "visitorid", "guidestepid", "type", "browsertime"])
+    events = events.sample(frac=1, random_state=seed).reset_index(drop=True)
+    events["date_partition"] = pd.to_datetime(events["browsertime"], unit="ms").dt.strftime("%Y-%m-%d")
+    events["date_time"] = pd.to_datetime(events["browsertime"], unit="ms")
+    return events
+
+
+def canonical(df):
+    return df.astype(str).sort_values(OUTPUT_COLUMNS).reset_index(drop=True)
+
+
+def test_sessionize_matches_legacy_time_on_guide():
+    for seed in range(5):
+        events = make_events(seed)
+        expected = legacy_time_on_guide(sorted(set(events["guideid"])), sorted(set(events["visitorid"])), events)
+        actual = sessionize(events)
+        assert len(expected) > 0
+        pd.testing.assert_frame_equal(canonical(actual), canonical(expected))
+
+
+def test_sessionize_without_seen_events_yields_zero_durations():
+    events = pd.DataFrame(
+        [["acc", "g", "v", "s", "guideAdvanced", 2000, "2021-05-01"], ["acc", "g", "v", "s", "guideDismissed", 3000, "2021-05-01"]],
+        columns=["accountid", "guideid", "visitorid", "guidestepid", "type", "browsertime", "date_partition"],
+    )
+    output = sessionize(events)
+    assert list(output.columns) == OUTPUT_COLUMNS
+    assert list(output["time on guide"]) == [0.0, 0.0]
+
+
+def test_sharded_sessionize_matches_single_process():
+    events = make_events(seed=7, visitors=10)
+    shards = shardByVisitor(events, 3)
+    assert sum(len(shard) for shard in shards) == len(events)
+    assert all(set(a["visitorid"]).isdisjoint(b["visitorid"]) for a in shards for b in shards if a is not b)
+
+    sharded = sessionizeSharded(events, workers=3)
+    pd.testing.assert_frame_equal(canonical(sharded), canonical(sessionize(events)))
+    pd.testing.assert_frame_equal(sharded, sessionizeSharded(events, workers=3))
+
+
+def test_overlapping_sharded_runs_keep_their_own_events():
+    events = [make_events(seed=seed, visitors=10) for seed in (8, 9)]
+    # Like two jobs of the in-process runner sharding at the same time
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        sharded = list(pool.map(lambda frame: sessionizeSharded(frame, workers=2), events))
+
+    for frame, output in zip(events, sharded):
+        pd.testing.assert_frame_equal(canonical(output), canonical(sessionize(frame)))
+
+
+def test_categorical_visitors_shard_like_their_values():
+    visitors = pd.Series(["v1", "v2", "v3", "v1", "v4"], dtype=object)
+    categorical = visitors.astype("category")
+    np.testing.assert_array_equal(shardIds(categorical, 4), shardIds(visitors, 4))
+    sharded = sessionizeSharded(make_events(seed=8).astype({"visitorid": "category"}), workers=2)
+    pd.testing.assert_frame_equal(canonical(sharded), canonical(sessionize(make_events(seed=8))))
+
+
+def make_daily_events(seed):
+    events = make_events(seed, events_per_pair=30)
+    # Spread the events over four days, so sessions stay open across runs
+    start = events["browsertime"].min()
+    events["browsertime"] = start + (events["browsertime"] - start) * 500
+    events = events.sort_values("browsertime", kind="mergesort").reset_index(drop=True)
+    events["date_partition"] = pd.to_datetime(events["browsertime"], unit="ms").dt.strftime("%Y-%m-%d")
+    return events
+
+
+def test_incremental_sessionize_matches_full_recompute():
+    for seed in range(3):
+        events = make_daily_events(seed)
+        dates = sorted(set(events["date_partition"]))
+        assert len(dates) >= 3
+        assert verifyIncremental(events, dates[1:]) == []
+
+
+def test_open_advances_point_at_their_own_output_row():
+    for seed in range(3):
+        events = make_daily_events(seed)
+        dates = sorted(set(events["date_partition"]))
+        history, state = sessionizeIncremental(events[events["date_partition"] < dates[-1]])
+        today, state = sessionizeIncremental(events[events["date_partition"] == dates[-1]], state)
+        output = pd.concat([history, today])
+
+        open_steps = state.steps.dropna(subset=["open_date"])
+        assert 0 < len(open_steps) < len(state.steps)
+        rows = output[STEP_KEYS].astype(str).assign(open_date=output["date_partition"].astype(str))
+        matched = pd.merge(open_steps[STEP_KEYS + ["open_date"]].astype(str), rows.drop_duplicates(), how="left", indicator=True)
+        assert (matched["_merge"] == "both").all()
+
+
+def test_incremental_state_is_sharded_by_visitor():
+    events = make_daily_events(seed=11)
+    dates = sorted(set(events["date_partition"]))
+    history, today = events[events["date_partition"] < dates[-1]], events[events["date_partition"] == dates[-1]]
+    _, state = sessionizeIncremental(history)
+
+    expected, expected_state = sessionizeIncremental(today, state)
+    actual, actual_state = sessionizeIncrementalSharded(today, state, workers=2)
+
+    pd.testing.assert_frame_equal(canonical(actual), canonical(expected))
+    assert len(actual_state.steps) == len(expected_state.steps)
+    assert actual_state.steps["total"].sum() == pytest.approx(expected_state.steps["total"].sum())
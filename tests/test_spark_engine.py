@@ -0,0 +1,146 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+# CI sets require_spark, so the parity tests fail there instead of being skipped without a Java runtime
+if not os.environ.get("require_spark"):
+    pytest.importorskip("pyspark")
+    if shutil.which("java") is None and not os.environ.get("JAVA_HOME"):
+        pytest.skip("Spark needs a Java runtime", allow_module_level=True)
+
+from pendoguidesproject import synthetic
+from pendoguidesproject.common.spark import ORDER_COLUMNS, fromPandas, getSpark, readParquetPartitions
+from pendoguidesproject.storage import datasetKey, readPartitions, writePartitions
+from pendoguidesproject.transformations.activity import joinActivity, joinTestDriveLeads
+from pendoguidesproject.transformations.sessionize import sessionize
+from pendoguidesproject.transformations.spark_activity import (
+    USER_ORDER, joinActivitySpark, joinTestDriveLeadsSpark, joinUsageSpark, merge, personalisedStatusSpark,
+)
+from pendoguidesproject.transformations.spark_sessionize import sessionizeSpark
+from pendoguidesproject.transformations.status import asOf, personalisedStatus
+from tests import test_sessionize
+from tests.test_activity import sorted_frame
+from tests.test_storage import fake_datalake
+from tests.test_transform import transform  # noqa: F401, the fixture
+
+PREFIXES = {
+    "salesforcecampaign": "sfc_", "salesforcecampaignmember": "sfcm_", "lead": "lead_", "contact": "ctct_", "account": "acc_",
+    "dgc_users": "usr_", "pendo_activity": "pa_", "pendo_usage": "pu_", "assets": "as_",
+}
+SALESFORCE = ["salesforcecampaign", "salesforcecampaignmember", "lead", "contact", "account"]
+
+
+@pytest.fixture(scope="module")
+def spark():
+    return getSpark()
+
+
+def comparable(frame):
+    frame = frame.copy()
+    frame["date_partition"] = frame["date_partition"].astype(str)
+    return frame.astype(object).where(frame.notna(), None).reset_index(drop=True)
+
+
+def mirror(s3, root):
+    # Spark reads the objects the fake bucket holds from a local copy of the datalake
+    for (bucket, key), body in s3.objects.items():
+        path = os.path.join(root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(body)
+
+
+def test_spark_sessionize_matches_pandas_on_legacy_events(spark):
+    for seed in range(3):
+        events = test_sessionize.make_events(seed).drop(columns=["date_time"])
+        ordered = events.assign(**{ORDER_COLUMNS[0]: 0, ORDER_COLUMNS[1]: range(len(events))})
+        actual = sessionizeSpark(fromPandas(spark, ordered)).toPandas()
+        pd.testing.assert_frame_equal(comparable(actual), comparable(sessionize(events)), check_dtype=False)
+
+
+def test_spark_sessionize_reads_the_partitions_in_order(spark, transform, tmp_path, monkeypatch):
+    monkeypatch.setenv("environment", "dev")
+    monkeypatch.setenv("datalake_root", str(tmp_path))
+    events = synthetic.guidesUsage(5000, seed=3)
+    dates = sorted(set(events["date_partition"]))
+    for date in dates:
+        path = tmp_path / datasetKey("raw/pendoguides", "pendoguides", "parquet", date)
+        path.parent.mkdir(parents=True)
+        events[events["date_partition"] == date].to_parquet(path, index=False)
+
+    raw = readParquetPartitions(spark, "raw/pendoguides", "pendoguides", dates, transform.EVENT_COLUMNS)
+    expected = sessionize(pd.concat([events[events["date_partition"] == date] for date in dates], ignore_index=True))
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(comparable(sessionizeSpark(raw).toPandas()), comparable(expected), check_dtype=False)
+
+
+def test_spark_transform_writes_what_the_pandas_engine_writes(spark, transform, tmp_path, monkeypatch):
+    s3 = fake_datalake(monkeypatch)
+    # run sets the storage format for the whole process
+    monkeypatch.setenv("storage_format", "parquet")
+    monkeypatch.setenv("datalake_root", str(tmp_path))
+    writePartitions(synthetic.guidesUsage(3000, days=3, seed=4), "raw/pendoguides", "pendoguides", format="parquet")
+    mirror(s3, tmp_path)
+
+    transform.run("dev", "2021-05-03", full_refresh=True)
+    expected = readPartitions("clean/pendoguides", "pendoguides")
+    s3.objects = {key: body for key, body in s3.objects.items() if not key[1].startswith("clean/")}
+    transform.run("dev", "2021-05-03", full_refresh=True, engine="spark")
+    actual = readPartitions("clean/pendoguides", "pendoguides")
+
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(comparable(actual), comparable(expected), check_dtype=False)
+    with pytest.raises(ValueError):
+        transform.run("dev", "2021-05-03", storage_format="csv", engine="spark")
+
+
+def test_spark_clean_joins_match_pandas(spark):
+    data = {name: frame.add_prefix(PREFIXES[name]) for name, frame in synthetic.testDriveTables(300, seed=5).items() if name in PREFIXES}
+    new = joinTestDriveLeads(*(data[name] for name in SALESFORCE))
+    completeLeft, activity = joinActivity(new, data["dgc_users"], data["pendo_activity"])
+    status = personalisedStatus(activity, asOf("2021-06-01"))
+    usage = pd.merge(completeLeft, data["pendo_usage"], left_on="usr_id", right_on="pu_visitorid", how="inner")
+    usage = pd.merge(usage, data["assets"], left_on="pu_parameter", right_on="as_asset_id", how="left")
+    usage = pd.merge(usage, status, on="lead_uuid_c", how="left")
+
+    frames = {name: fromPandas(spark, frame) for name, frame in data.items()}
+    spark_new = joinTestDriveLeadsSpark(*(frames[name] for name in SALESFORCE))
+    spark_completeLeft, spark_activity = joinActivitySpark(spark_new, frames["dgc_users"], frames["pendo_activity"])
+    spark_status = personalisedStatusSpark(spark_activity, asOf("2021-06-01"))
+    spark_usage = joinUsageSpark(spark_completeLeft, frames["pendo_usage"], frames["assets"], spark_status)
+
+    # Spark joins don't keep the row order of pd.merge, the rows are compared sorted
+    for expected, actual in [(status, spark_status), (activity, spark_activity.drop(USER_ORDER)), (usage, spark_usage)]:
+        actual = actual.toPandas()
+        assert list(actual.columns) == list(expected.columns)
+        assert len(expected) > 0
+        pd.testing.assert_frame_equal(sorted_frame(actual), sorted_frame(expected), check_dtype=False)
+
+
+def test_spark_status_takes_the_signup_of_the_first_user_like_pandas(spark):
+    new = pd.DataFrame({"lead_id": ["p1", "p2"], "lead_uuid_c": ["u1", "u2"]})
+    # u1 signed up twice, the later signup comes first in the extract
+    dgc_users = pd.DataFrame({
+        "usr_id": ["u1", "u2", "u1"],
+        "usr_createdOn": [pd.Timestamp(day, tz="UTC").value // 10**6 for day in ["2021-05-31", "2021-05-31", "2021-05-20"]],
+    })
+    pendo_activity = pd.DataFrame({"pa_visitorid": ["u1", "u2"], "pa_numminutes": [0.0, 0.0]})
+    completeLeft, activity = joinActivity(new, dgc_users, pendo_activity)
+    expected = personalisedStatus(activity, asOf("2021-06-01"))
+
+    _, spark_activity = joinActivitySpark(*(fromPandas(spark, frame) for frame in [new, dgc_users, pendo_activity]))
+    actual = personalisedStatusSpark(spark_activity, asOf("2021-06-01")).toPandas()
+
+    assert list(expected["act_status"]) == ["At high risk (not logged in after 48 hours)"] * 2
+    pd.testing.assert_frame_equal(sorted_frame(actual), sorted_frame(expected), check_dtype=False)
+
+
+def test_merge_matches_missing_keys_like_pandas(spark):
+    left = pd.DataFrame({"key": ["a", None, "b"], "left": [1, 2, 3]})
+    right = pd.DataFrame({"key": ["a", None, "c"], "right": ["x", "y", "z"]})
+    for how in ["inner", "left"]:
+        expected = pd.merge(left, right, on="key", how=how)
+        actual = merge(fromPandas(spark, left), fromPandas(spark, right), "key", how=how).toPandas()
+        pd.testing.assert_frame_equal(sorted_frame(actual), sorted_frame(expected), check_dtype=False)
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+from pendoguidesproject.jobs import loadJob, make_job_decorator
+
+HEAVY_MODULES = ["pandas", "numpy", "boto3", "awswrangler", "psycopg2", "pyarrow", "authlib", "hvac", "requests"]
+
+
+def test_sample_job_starts_without_heavy_imports():
+    # A fresh interpreter, this process already imported everything
+    script = (
+        "import sys\n"
+        "from pendoguidesproject import app\n"
+        "from pendoguidesproject.jobs import loadJob\n"
+        "loadJob('sample')\n"
+        f"print(','.join(module for module in {HEAVY_MODULES!r} if module in sys.modules))\n"
+    )
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    env = {**os.environ, "PYTHONPATH": src}
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
+
+
+def test_load_job_imports_the_module_of_the_job_once(tmp_path, monkeypatch):
+    register = make_job_decorator()
+    monkeypatch.setitem(sys.modules, "lazy_registry", types.SimpleNamespace(register=register))
+    (tmp_path / "lazy_job.py").write_text(
+        "from lazy_registry import register\n"
+        "@register('lazy')\n"
+        "def run(env, date):\n"
+        "    return 'ran'\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    assert "lazy" not in register.all
+    job = loadJob("lazy", register, {"lazy": "lazy_job"})
+    assert job("dev", "2021-05-01") == "ran"
+    assert loadJob("lazy", register, {"lazy": "lazy_job"}) is job
+    with pytest.raises(KeyError, match="Unknown job"):
+        loadJob("unknown", register, {"lazy": "lazy_job"})
+
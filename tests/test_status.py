@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from pendoguidesproject.transformations.status import STATUS_RULES, StatusRule, asOf, personalisedStatus
+
+
+def legacy_personalised_status(activity, now):
+    # clean.addPersonalisedStatus before vectorization, with datetime.now() passed in
+    new = activity[["usr_createdOn", "lead_uuid_c", "pa_numminutes"]].copy()
+    new["total_minutes"] = new.groupby(["lead_uuid_c"])["pa_numminutes"].transform("sum")
+    new = new.drop_duplicates(subset=['lead_uuid_c'])
+    testDriveStatus = []
+    for index, row in new.iterrows():
+        start = pd.to_datetime(row["usr_createdOn"], unit='ms', utc = True)
+        if (row["total_minutes"] == 0) & ((now - start).days > 7):
+            testDriveStatus.append("Wasted test-drive (not logged in after a week)")
+        elif ((row["total_minutes"] > 0)) & ((now - start).days >= 7):
+            testDriveStatus.append("Test-drive period is over and was used")
+        elif ((row["total_minutes"] > 0)) & ((now - start).days < 7):
+            testDriveStatus.append("Test-drive in progress")
+        elif (not(row["total_minutes"] > 0)) & ((now - start).days >= 3):
+            testDriveStatus.append("At very high risk (not logged in after 72 hours)")
+        elif (not(row["total_minutes"] > 0)) & ((now - start).days >= 2):
+            testDriveStatus.append("At high risk (not logged in after 48 hours)")
+        elif (not(row["total_minutes"] > 0)) & ((now - start).days >= 1):
+            testDriveStatus.append("At risk (not logged in after 24 hours)")
+        elif (not(row["total_minutes"] > 0)) & ((now - start).days == 0):
+            testDriveStatus.append("Registered less than 24 hours ago and no usage")
+        else:
+            testDriveStatus.append("Problem")
+    new = new.reset_index(drop = True)
+    return pd.DataFrame({"lead_uuid_c": new["lead_uuid_c"], "act_status": testDriveStatus})
+
+
+def make_activity(seed, leads=300, rows=1500):
+    rng = np.random.RandomState(seed)
+    as_of = pd.Timestamp("2021-06-01", tz="UTC")
+    signups = as_of.value // 10**6 - rng.randint(-2 * 86400000, 12 * 86400000, size=leads)
+    # Whole-day boundaries are where floor and comparison bugs show up
+    signups[:20] = as_of.value // 10**6 - rng.randint(-2, 10, size=20) * 86400000
+    lead = rng.randint(0, leads, size=rows)
+    activity = pd.DataFrame({
+        "usr_createdOn": signups[lead].astype(float),
+        "lead_uuid_c": [f"lead{i}" for i in lead],
+        "pa_numminutes": rng.choice([0.0, 0.0, 1.5, 30.0, np.nan], size=rows),
+    })
+    activity.loc[rng.rand(rows) < 0.02, "lead_uuid_c"] = None
+    activity.loc[rng.rand(rows) < 0.02, "usr_createdOn"] = np.nan
+    return activity, as_of
+
+
+def test_statuses_match_the_legacy_row_loop():
+    for seed in range(3):
+        activity, as_of = make_activity(seed)
+        expected = legacy_personalised_status(activity, as_of)
+        status = personalisedStatus(activity, as_of)
+        assert list(status["lead_uuid_c"].astype(object)) == list(expected["lead_uuid_c"].astype(object))
+        assert list(status["act_status"]) == list(expected["act_status"])
+        assert set(expected["act_status"]) >= {rule.label for rule in STATUS_RULES} - {"Wasted test-drive (not logged in after a week)"}
+
+
+def test_rules_and_as_of_are_configurable():
+    activity = pd.DataFrame({
+        "usr_createdOn": [pd.Timestamp("2021-05-30", tz="UTC").value // 10**6] * 2,
+        "lead_uuid_c": ["a", "b"],
+        "pa_numminutes": [0.0, 5.0],
+    })
+    rules = [StatusRule("Active", "used", None, None), StatusRule("Dormant", "none", 2, None)]
+    status = personalisedStatus(activity, asOf("2021-05-31"), rules=rules, default="New")
+    assert list(status["act_status"]) == ["Dormant", "Active"]
+    assert list(personalisedStatus(activity, asOf("2021-05-30"), rules=rules, default="New")["act_status"]) == ["New", "Active"]
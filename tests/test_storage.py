@@ -0,0 +1,127 @@
+import io
+
+import pandas as pd
+
+from pendoguidesproject import storage
+from pendoguidesproject.storage import S3MultipartWriter, listPartitions, readDataset, readPartitions, writeDataset, writePartitions
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = bytes(Body)
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def Object(self, bucket, key):
+        s3 = self
+
+        class FakeObject:
+            def put(self, Body):
+                s3.put_object(Bucket=bucket, Key=key, Body=Body if isinstance(Body, bytes) else Body.encode("utf8"))
+
+        return FakeObject()
+
+    def get_paginator(self, operation):
+        s3 = self
+
+        class FakePaginator:
+            def paginate(self, Bucket, Prefix, Delimiter):
+                keys = [key[len(Prefix):] for bucket, key in s3.objects if bucket == Bucket and key.startswith(Prefix)]
+                prefixes = sorted({Prefix + key.split(Delimiter)[0] + Delimiter for key in keys if Delimiter in key})
+                yield {"CommonPrefixes": [{"Prefix": prefix} for prefix in prefixes]}
+
+        return FakePaginator()
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.uploads["upload-1"] = []
+        return {"UploadId": "upload-1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId].append(bytes(Body))
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        assert [part["PartNumber"] for part in MultipartUpload["Parts"]] == list(range(1, len(self.uploads[UploadId]) + 1))
+        self.objects[(Bucket, Key)] = b"".join(self.uploads.pop(UploadId))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+
+
+def test_multipart_writer_streams_csv_batches_into_parts():
+    s3 = FakeS3()
+    batches = [pd.DataFrame({"visitorid": [f"v{i}" for i in range(start, start + 50)], "browsertime": range(start, start + 50)}) for start in range(0, 500, 50)]
+    with S3MultipartWriter("bucket", "raw/pendoguides/pendoguides.csv", part_size=1024, s3_client=s3) as writer:
+        for batch in batches:
+            writer.write_csv(batch, index=True)
+
+    assert len(writer.parts) > 1
+    written = pd.read_csv(io.BytesIO(s3.objects[("bucket", "raw/pendoguides/pendoguides.csv")]), index_col=0)
+    pd.testing.assert_frame_equal(written, pd.concat(batches, ignore_index=True))
+
+
+def test_multipart_writer_aborts_on_error():
+    s3 = FakeS3()
+    try:
+        with S3MultipartWriter("bucket", "key", part_size=10, s3_client=s3) as writer:
+            writer.write(b"more than ten bytes")
+            raise RuntimeError("extraction failed")
+    except RuntimeError:
+        pass
+    assert s3.uploads == {}
+    assert s3.objects == {}
+
+
+def test_multipart_writer_streams_parquet_row_groups():
+    s3 = FakeS3()
+    batches = [pd.DataFrame({"visitorid": ["a", "b"], "browsertime": [start, start + 1]}) for start in range(0, 40, 2)]
+    with S3MultipartWriter("bucket", "raw/pendoguides/pendoguides.parquet", part_size=256, s3_client=s3) as writer:
+        for batch in batches:
+            writer.write_parquet(batch)
+
+    written = pd.read_parquet(io.BytesIO(s3.objects[("bucket", "raw/pendoguides/pendoguides.parquet")]))
+    pd.testing.assert_frame_equal(written, pd.concat(batches, ignore_index=True))
+
+
+def fake_datalake(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(storage.boto3, "client", lambda name: s3)
+    monkeypatch.setattr(storage.boto3, "resource", lambda name: s3)
+    monkeypatch.setenv("environment", "dev")
+    return s3
+
+
+def test_datasets_round_trip_with_column_projection(monkeypatch):
+    s3 = fake_datalake(monkeypatch)
+    events = pd.DataFrame({"visitorid": ["a", "b"], "type": ["guideSeen", "guideAdvanced"], "browsertime": [1620000000000, 1620000001000]})
+
+    for format in ["parquet", "csv"]:
+        writeDataset(events, "raw/pendoguides", "pendoguides", format=format)
+        assert ("cdo-datalake-dev-bphcob", f"raw/pendoguides/pendoguides.{format}") in s3.objects
+        projected = readDataset("raw/pendoguides", "pendoguides", columns=["visitorid", "browsertime"], format=format)
+        pd.testing.assert_frame_equal(projected, events[["visitorid", "browsertime"]], check_dtype=format == "parquet")
+        assert projected["browsertime"].dtype == "int64"
+
+
+def test_partitions_are_written_per_day_and_read_by_range(monkeypatch):
+    s3 = fake_datalake(monkeypatch)
+    events = pd.DataFrame({
+        "visitorid": ["a", "b", "c", "d"],
+        "browsertime": [1, 2, 3, 4],
+        "date_partition": ["2021-05-26", "2021-05-27", "2021-05-27", "2021-05-28"],
+    })
+
+    assert writePartitions(events, "raw/pendoguides", "pendoguides") == ["2021-05-26", "2021-05-27", "2021-05-28"]
+    assert ("cdo-datalake-dev-bphcob", "raw/pendoguides/date_partition=2021-05-27/pendoguides.parquet") in s3.objects
+    assert listPartitions("raw/pendoguides", start="2021-05-27") == ["2021-05-27", "2021-05-28"]
+
+    day = readDataset("raw/pendoguides", "pendoguides", date="2021-05-27")
+    assert list(day["visitorid"]) == ["b", "c"]
+    window = readPartitions("raw/pendoguides", "pendoguides", end="2021-05-27", columns=["visitorid"])
+    assert list(window["visitorid"]) == ["a", "b", "c"]
+    assert list(readPartitions("raw/pendoguides", "pendoguides", start="2021-06-01", columns=["visitorid"]).columns) == ["visitorid"]
@@ -0,0 +1,30 @@
+import pandas as pd
+
+from pendoguidesproject import synthetic
+from pendoguidesproject.transformations.sessionize import sessionize
+
+
+def test_guides_usage_is_seeded():
+    events = synthetic.guidesUsage(5000, seed=3)
+    assert len(events) == 5000
+    pd.testing.assert_frame_equal(events, synthetic.guidesUsage(5000, seed=3))
+    assert not events.equals(synthetic.guidesUsage(5000, seed=4))
+
+
+def test_guides_usage_sessionizes():
+    events = synthetic.guidesUsage(5000)
+    assert set(events["type"].unique()) <= {"guideSeen", "guideAdvanced", "guideDismissed", "guideActivity"}
+    assert events["date_partition"].nunique() >= 7
+    output = sessionize(events)
+    assert len(output) > 0
+    assert (output["time on guide"] >= 0).all()
+
+
+def test_test_drive_tables_join():
+    data = synthetic.testDriveTables(leads=200)
+    members = data["salesforcecampaignmember"]
+    people = pd.concat([data["lead"][["id", "uuid_c"]], data["contact"][["id", "uuid_c"]]])
+    leads = members.merge(people, left_on="lead_or_contact_id", right_on="id")
+    assert len(leads) == len(members)
+    assert leads["uuid_c"].isin(data["dgc_users"]["id"]).mean() > 0.5
+    assert data["pendo_activity"]["visitorid"].isin(data["dgc_users"]["id"]).any()
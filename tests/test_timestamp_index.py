@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from pendoguidesproject.transformations.timestamp_index import TimestampIndex, earliestAfter, latestBefore
+from tests.test_sessionize import legacy_find_highest, legacy_find_lowest
+
+
+def make_index_data(seed, groups=20, times_per_group=15):
+    rng = np.random.RandomState(seed)
+    keys = pd.DataFrame({
+        "visitorid": [f"visitor{g % 7}" for g in range(groups) for _ in range(times_per_group)],
+        "guideid": [f"guide{g}" for g in range(groups) for _ in range(times_per_group)],
+    })
+    times = rng.randint(1000, 1200, size=len(keys))
+    return keys, times
+
+
+def test_scalar_lookups_match_legacy_find_functions():
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        lst = list(rng.randint(0, 50, size=rng.randint(1, 10)))
+        target = int(rng.randint(-5, 55))
+        assert latestBefore(lst, target) == legacy_find_highest(lst, target)
+        assert earliestAfter(lst, target) == legacy_find_lowest(lst, target)
+    assert latestBefore([], 42) == legacy_find_highest([], 42)
+
+
+def test_bulk_lookups_match_legacy_find_functions():
+    keys, times = make_index_data(seed=1)
+    index = TimestampIndex(keys, times)
+    rng = np.random.RandomState(2)
+    queries = keys.sample(n=300, replace=True, random_state=3).reset_index(drop=True)
+    query_times = rng.randint(990, 1210, size=len(queries))
+
+    latest = index.latestBefore(queries, query_times)
+    earliest = index.earliestAfter(queries, query_times)
+
+    for i, (visitorid, guideid) in enumerate(zip(queries["visitorid"], queries["guideid"])):
+        group = list(times[(keys["visitorid"] == visitorid).to_numpy() & (keys["guideid"] == guideid).to_numpy()])
+        assert latest[i] == legacy_find_highest(group, query_times[i])
+        assert earliest[i] == legacy_find_lowest(group, query_times[i])
+
+
+def test_latest_before_returns_query_time_for_unknown_groups():
+    keys, times = make_index_data(seed=4, groups=2)
+    index = TimestampIndex(keys, times)
+    queries = pd.DataFrame({"visitorid": ["nobody"], "guideid": ["guide0"]})
+    assert list(index.latestBefore(queries, [1500])) == [1500]
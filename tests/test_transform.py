@@ -0,0 +1,114 @@
+import pandas as pd
+import pytest
+
+from pendoguidesproject.jobs import entrypoint
+from pendoguidesproject.storage import listPartitions, partitionDates, readDataset, readPartitions, writePartitions
+from pendoguidesproject.transformations.sessionize import OUTPUT_COLUMNS, sessionize
+from tests import test_sessionize
+from tests.test_storage import fake_datalake
+
+
+@pytest.fixture
+def transform():
+    # Importing the job registers it, the registry is restored for the tests that count the registered jobs
+    jobs, datasets = dict(entrypoint.all), dict(entrypoint.datasets)
+    from pendoguidesproject.jobs import transform
+
+    yield transform
+    entrypoint.all.clear()
+    entrypoint.all.update(jobs)
+    entrypoint.datasets.clear()
+    entrypoint.datasets.update(datasets)
+
+
+def test_sessionize_without_events_is_empty():
+    output = sessionize(pd.DataFrame(columns=["accountid", "guideid", "visitorid", "guidestepid", "type", "browsertime", "date_partition"]))
+    assert list(output.columns) == OUTPUT_COLUMNS
+    assert len(output) == 0
+
+
+def test_incremental_transform_carries_the_state_over_a_quiet_day(transform, monkeypatch):
+    s3 = fake_datalake(monkeypatch)
+    # run sets the storage format for the whole process
+    monkeypatch.setenv("storage_format", "parquet")
+    events = test_sessionize.make_daily_events(seed=2)
+    dates = writePartitions(events, "raw/pendoguides", "pendoguides")
+    quiet_day = transform.nextDay(dates[-1])
+
+    for date in dates + [quiet_day]:
+        transform.run("dev", date, incremental=True)
+
+    assert len(readDataset("clean/pendoguides", "pendoguides", date=quiet_day)) == 0
+    assert listPartitions(transform.STATE_PREFIX)[-1] == quiet_day
+    pd.testing.assert_frame_equal(transform.readState(quiet_day).steps, transform.readState(dates[-1]).steps)
+    # A full recompute over an empty raw dataset writes an empty partition too
+    s3.objects.clear()
+    transform.run("dev", quiet_day)
+    assert len(readPartitions("clean/pendoguides", "pendoguides")) == 0
+
+
+def test_incremental_partitions_add_up_to_a_full_recompute(transform, monkeypatch):
+    for seed in range(4):
+        s3 = fake_datalake(monkeypatch)
+        monkeypatch.setenv("storage_format", "parquet")
+        events = test_sessionize.make_daily_events(seed)
+        dates = writePartitions(events, "raw/pendoguides", "pendoguides")
+        for date in dates:
+            transform.run("dev", date, incremental=True)
+        incremental = readPartitions("clean/pendoguides", "pendoguides")
+
+        # Advances without a seen that a later day supersedes are removed from their earlier partition again
+        s3.objects = {key: body for key, body in s3.objects.items() if not key[1].startswith(("clean/", transform.STATE_PREFIX))}
+        transform.run("dev", dates[-1], full_refresh=True)
+        full = readPartitions("clean/pendoguides", "pendoguides")
+        assert len(full) > 0
+        pd.testing.assert_frame_equal(test_sessionize.canonical(incremental), test_sessionize.canonical(full))
+
+
+def test_incremental_transform_reports_every_partition_it_rewrote(transform, monkeypatch):
+    s3 = fake_datalake(monkeypatch)
+    monkeypatch.setenv("storage_format", "parquet")
+    dates = writePartitions(test_sessionize.make_daily_events(seed=1), "raw/pendoguides", "pendoguides")
+    earlier = set()
+
+    for date in dates:
+        before = {key: body for key, body in s3.objects.items() if key[1].startswith("clean/pendoguides/")}
+        transform.run("dev", date, incremental=True)
+        rewritten = {key[1].split("date_partition=")[1][:10] for key, body in s3.objects.items()
+                     if key[1].startswith("clean/pendoguides/") and before.get(key) != body}
+        reported = set(readDataset(transform.CHANGES_PREFIX, "pendoguides", date=date)["date_partition"])
+        # load replaces exactly these partitions in Redshift
+        assert rewritten <= reported
+        earlier |= {day for day in reported if day < date}
+    # Closing an advance rewrote an earlier partition
+    assert earlier
+
+
+class PartitionRecorder:
+    replaced = None
+
+    def __init__(self, schema, table, historical_load):
+        pass
+
+    def replace_partitions(self, df, dates):
+        PartitionRecorder.replaced = (df, dates)
+        return True
+
+
+def test_upsert_load_replaces_the_partitions_the_transform_reported(transform, monkeypatch):
+    from pendoguidesproject.jobs import load
+
+    fake_datalake(monkeypatch)
+    monkeypatch.setenv("storage_format", "parquet")
+    monkeypatch.setattr(load, "redshiftExporter", PartitionRecorder)
+    dates = writePartitions(test_sessionize.make_daily_events(seed=1), "raw/pendoguides", "pendoguides")
+    for date in dates:
+        transform.run("dev", date, incremental=True)
+
+    load.export_activity(dates[-1], "upsert")
+
+    df, replaced = PartitionRecorder.replaced
+    assert replaced == list(readDataset(transform.CHANGES_PREFIX, "pendoguides", date=dates[-1])["date_partition"])
+    clean = readPartitions("clean/pendoguides", "pendoguides")
+    expected = clean[partitionDates(clean["date_partition"]).isin(replaced)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(df, expected)